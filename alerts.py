@@ -0,0 +1,400 @@
+"""
+Alerting
+---
+Evaluates the /counter decision (days since the last outlier day, the
+anomaly share of the previous hour and the files missing from the DB) in a
+background asyncio loop whenever a source's snapshot is rebuilt and once a
+minute, and pushes its state transitions to sinks: a JSON lines file, a
+webhook or an SMTP server. A source is only re-evaluated when its snapshot
+version or the previous hour changed, and the hourly scoring reuses the
+stored models, so a minute's round over all sources is mostly lookups.
+Repeated transitions are de-duplicated and every sink is rate limited.
+
+sources.json:
+    {"sources": [...],
+     "alerts": {"interval": 60, "dedup_seconds": 3600,
+                "sinks": [{"type": "file", "path": "alerts.jsonl"},
+                          {"type": "webhook", "url": "http://localhost:9000/hook"},
+                          {"type": "smtp", "host": "localhost", "port": 1025,
+                           "sender": "monitor@localhost", "recipients": ["ops@localhost"],
+                           "rate_per_minute": 2}]}}
+"""
+import asyncio
+import json
+import logging
+import smtplib
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# A day is an outlier day when at least this share of the series flag it
+OUTLIER_DAY_SHARE = .2
+# The previous hour is an interface anomaly when at least this share of the series flag it
+ANOMALY_SHARE = .35
+
+
+def counter_status(snapshot, now=None):
+    """
+    Purpose:
+        Computes the days since the last outlier day, the status of the
+        previous hour and the files missing from the DB.
+    Args:
+        snapshot (Snapshot): current snapshot
+        now (datetime): evaluation time, defaults to datetime.now()
+    Returns:
+        Dictionary with count, anomaly, anomaly_flag, date, hour, percent and files
+    """
+    a = snapshot.outlier
+
+    # Today is still incomplete
+    is_outlier_day = a.daily_results.outlier_share()[:-1] >= OUTLIER_DAY_SHARE
+    count = len(is_outlier_day)
+    if is_outlier_day.any():
+        count -= np.flatnonzero(is_outlier_day)[-1] + 1
+
+    # The previous hour is the last complete one, yesterday's 23:00 right after midnight
+    previous_hour = (now or datetime.now()) - timedelta(hours=1)
+    date = previous_hour.strftime('%Y-%m-%d')
+    hour_now = previous_hour.hour
+
+    with snapshot.scoring_lock:
+        hourly = a.hourly_results(date, outliers_fraction=.06, n_estimate=24)
+    percent = hourly.outlier_share()[hour_now]
+
+    if percent >= ANOMALY_SHARE:
+        anomaly = "Interface anomaly between " + str(hour_now) + ":00 - " + str(
+            hour_now + 1) + ":00 detected, please check the files."
+        anomaly_flag = 1
+    else:
+        anomaly = "Between " + \
+            str(hour_now) + ":00 - " + str(hour_now + 1) + \
+            ":00 interface status is normal."
+        anomaly_flag = 0
+
+    return {'count': int(count), 'anomaly': anomaly, 'anomaly_flag': anomaly_flag, 'date': date,
+            'hour': hour_now, 'percent': float(percent), 'files': sorted(a.check_DB())}
+
+
+def transitions(source, previous, status):
+    """
+    Purpose:
+        Compares two counter_status results of a source.
+    Args:
+        source (str): source name
+        previous (dict): previous counter_status, None on the first evaluation
+        status (dict): current counter_status
+    Returns:
+        List of events, dictionaries with source, kind, state, message and key,
+        the key identifies repeats of the same transition
+    """
+    events = []
+    hour = '%s %02d:00' % (status['date'], status['hour'])
+    was_anomaly = previous is not None and previous['anomaly_flag'] and \
+        (previous['date'], previous['hour']) == (status['date'], status['hour'])
+    if status['anomaly_flag'] and not was_anomaly:
+        events.append({'kind': 'hourly_anomaly', 'state': 'raised', 'message': status['anomaly'],
+                       'hour': hour, 'percent': status['percent']})
+    elif previous is not None and previous['anomaly_flag'] and not status['anomaly_flag']:
+        events.append({'kind': 'hourly_anomaly', 'state': 'cleared', 'message': status['anomaly'],
+                       'hour': hour, 'percent': status['percent']})
+
+    if previous is not None and status['count'] < previous['count']:
+        events.append({'kind': 'outlier_day', 'state': 'raised',
+                       'message': 'New outlier day, ' + str(status['count']) + ' days since the last one.',
+                       'count': status['count']})
+
+    known = set(previous['files']) if previous is not None else set()
+    missing = sorted(set(status['files']) - known)
+    arrived = sorted(known - set(status['files']))
+    if missing:
+        events.append({'kind': 'missing_files', 'state': 'raised',
+                       'message': str(len(missing)) + ' files are missing from the DB.', 'files': missing})
+    if arrived:
+        events.append({'kind': 'missing_files', 'state': 'cleared',
+                       'message': str(len(arrived)) + ' missing files arrived.', 'files': arrived})
+
+    for event in events:
+        event['source'] = source
+        event['time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        event['key'] = (source, event['kind'], event['state'], event.get('hour'), event.get('count'),
+                        tuple(event.get('files', ())))
+    return events
+
+
+class Sink(object):
+
+    def __init__(self, rate_per_minute=6, burst=3):
+        # Token bucket: burst events at once, then rate_per_minute
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.sent = 0
+        self.suppressed = 0
+        self.failed = 0
+
+    def allow(self):
+        """
+        Returns:
+            True if the rate limit lets another event through, consuming a token
+        """
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            self.suppressed += 1
+            return False
+        self.tokens -= 1
+        return True
+
+    def deliver(self, event):
+        """
+        Purpose:
+            Sends one event, blocking, run on the event loop's executor.
+        Args:
+            event (dict): see transitions()
+        """
+        raise NotImplementedError
+
+    async def send(self, event):
+        await asyncio.get_running_loop().run_in_executor(None, self.deliver, event)
+        self.sent += 1
+
+    def stats(self):
+        return {'type': type(self).__name__, 'sent': self.sent, 'suppressed': self.suppressed,
+                'failed': self.failed}
+
+
+class FileSink(Sink):
+
+    def __init__(self, path='alerts.jsonl', **limits):
+        super(FileSink, self).__init__(**limits)
+        self.path = path
+
+    def deliver(self, event):
+        with open(self.path, 'a') as alert_file:
+            alert_file.write(json.dumps(public(event)) + '\n')
+
+
+class WebhookSink(Sink):
+
+    def __init__(self, url, timeout=10.0, **limits):
+        super(WebhookSink, self).__init__(**limits)
+        self.url = url
+        self.timeout = timeout
+
+    def deliver(self, event):
+        request = urllib.request.Request(self.url, data=json.dumps(public(event)).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class SmtpSink(Sink):
+
+    def __init__(self, host='localhost', port=25, sender='monitor@localhost', recipients=(), timeout=10.0,
+                 **limits):
+        super(SmtpSink, self).__init__(**limits)
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipients = list(recipients)
+        self.timeout = timeout
+
+    def deliver(self, event):
+        message = EmailMessage()
+        message['Subject'] = 'File Monitor %s: %s %s' % (event['source'], event['kind'], event['state'])
+        message['From'] = self.sender
+        message['To'] = ', '.join(self.recipients)
+        message.set_content(event['message'] + '\n\n' + json.dumps(public(event), indent=2))
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            smtp.send_message(message)
+
+
+# Sink classes by the "type" of their sources.json entry
+SINKS = {'file': FileSink, 'webhook': WebhookSink, 'smtp': SmtpSink}
+
+
+def public(event):
+    """
+    Returns:
+        The event without its de-duplication key
+    """
+    return {name: value for name, value in event.items() if name != 'key'}
+
+
+class AlertEvaluator(object):
+
+    def __init__(self, registry, sinks=(), interval=60.0, dedup_seconds=3600.0):
+        # sources.SourceRegistry whose snapshots are evaluated
+        self.registry = registry
+        self.sinks = list(sinks)
+        # Seconds between evaluations of every source
+        self.interval = interval
+        # An event repeated within this many seconds is not sent again
+        self.dedup_seconds = dedup_seconds
+        # Source name -> latest counter_status, with the time it was checked
+        self.states = OrderedDict()
+        # Source name -> (snapshot version, previous hour) of the latest evaluation
+        self._evaluated = {}
+        # Event key -> time it was last sent
+        self._sent = {}
+        self.stats = {'evaluations': 0, 'skipped': 0, 'events': 0, 'duplicates': 0, 'errors': 0}
+        self._loop = None
+        self._queue = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='outlier-alerts')
+        self._thread.daemon = True
+
+    @classmethod
+    def from_config(cls, registry, config):
+        """
+        Purpose:
+            Creates the evaluator from the "alerts" entry of sources.json.
+        Args:
+            registry (SourceRegistry): monitored sources
+            config (dict): interval, dedup_seconds and sinks, each sink a dictionary
+                with a type from SINKS and its arguments
+        Returns:
+            AlertEvaluator
+        """
+        sinks = []
+        for sink in config.get('sinks', []):
+            sink = dict(sink)
+            sinks.append(SINKS[sink.pop('type')](**sink))
+        return cls(registry, sinks, config.get('interval', 60.0), config.get('dedup_seconds', 3600.0))
+
+    def start(self):
+        """
+        Purpose:
+            Starts the event loop in a daemon thread.
+        """
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        """
+        Purpose:
+            Stops the loop after the evaluation in progress.
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+            self._thread.join()
+
+    def submit(self, name, snapshot=None):
+        """
+        Purpose:
+            Queues a source for evaluation, thread safe so it can be a
+            SourceRegistry listener.
+        Args:
+            name (str): source name
+            snapshot (Snapshot): ignored, the current snapshot is evaluated
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, name)
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._ready.set()
+        next_round = time.time()
+        while True:
+            try:
+                name = await asyncio.wait_for(self._queue.get(), max(next_round - time.time(), 0))
+            except asyncio.TimeoutError:
+                names = list(self.registry.sources)
+                next_round = time.time() + self.interval
+            else:
+                if name is None:
+                    return
+                names = [name]
+                # Rebuilds that arrived meanwhile are evaluated together
+                while not self._queue.empty():
+                    name = self._queue.get_nowait()
+                    if name is None:
+                        return
+                    names.append(name)
+            await self.evaluate(list(OrderedDict.fromkeys(names)))
+
+    async def evaluate(self, names):
+        """
+        Purpose:
+            Re-evaluates the sources whose snapshot or previous hour changed
+            since their last evaluation and sends their transitions.
+        Args:
+            names (list): source names
+        Returns:
+            List of the events that were sent
+        """
+        loop = asyncio.get_running_loop()
+        sent = []
+        for name in names:
+            now = datetime.now()
+            try:
+                snapshot = self.registry.get(name)
+                key = (snapshot.version, (now - timedelta(hours=1)).strftime('%Y-%m-%d %H'))
+                if self._evaluated.get(name) == key:
+                    self.stats['skipped'] += 1
+                    continue
+                # Scoring is CPU bound and takes the snapshot's scoring lock, it runs off the loop
+                status = await loop.run_in_executor(None, counter_status, snapshot, now)
+            except Exception:
+                self.stats['errors'] += 1
+                log.exception('Alert evaluation of source %s failed', name)
+                continue
+            self.stats['evaluations'] += 1
+            self._evaluated[name] = key
+            events = transitions(name, self.states.get(name), status)
+            status['checked'] = now.strftime('%Y-%m-%d %H:%M:%S')
+            self.states[name] = status
+            for event in events:
+                if self.duplicate(event):
+                    continue
+                sent.append(event)
+                await asyncio.gather(*[self.send(sink, event) for sink in self.sinks])
+        return sent
+
+    def duplicate(self, event):
+        """
+        Returns:
+            True if the same transition was sent within dedup_seconds, otherwise
+            records it as sent
+        """
+        now = time.time()
+        self._sent = {key: at for key, at in self._sent.items() if now - at < self.dedup_seconds}
+        if event['key'] in self._sent:
+            self.stats['duplicates'] += 1
+            return True
+        self._sent[event['key']] = now
+        self.stats['events'] += 1
+        return False
+
+    async def send(self, sink, event):
+        if not sink.allow():
+            return
+        try:
+            await sink.send(event)
+        except Exception:
+            sink.failed += 1
+            log.exception('Alert sink %s failed', type(sink).__name__)
+
+    def status(self):
+        """
+        Returns:
+            Dictionary with the evaluation counters and the counters of every sink
+        """
+        status = dict(self.stats)
+        status['running'] = self._thread.is_alive()
+        status['sinks'] = [sink.stats() for sink in self.sinks]
+        return status
@@ -0,0 +1,175 @@
+"""
+Historical Backfill
+---
+Labels the daily and hourly outliers of a range of days in one batched pass
+and writes them to a Parquet file, instead of requesting /date once per day.
+The source's snapshot is used as is, or rebuilt with --rebuild. Daily labels
+are the snapshot's daily results; hourly labels come from one model per file
+name predicting every hour of the range at once, see
+Outlier.backfill_hourly, with the file names spread over --executor.
+
+The file has one row per file name and hour: date, hour, name, interface,
+file_name, count, outlier, daily_count, daily_outlier and feature_outlier,
+the daily label of the count, bytes and arrival time features, see
+features.py. Rows are written in row groups of --batch file names. Requires
+pyarrow.
+
+    python backfill.py --days 90 --output backfill.parquet
+    python backfill.py --source dealer --start 2017-01-01 --end 2017-06-30 --executor processes
+    pandas.read_parquet('backfill.parquet', filters=[('outlier', '==', True)])
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from outlier import EXECUTORS
+from snapshot import StoredOutlier
+from sources import SourceRegistry
+
+
+def day_range(outlier, start=None, end=None, days=None):
+    """
+    Purpose:
+        Resolves the requested days to the ones held by both the daily results
+        and the hourly cube.
+    Args:
+        outlier (Outlier): built or restored object
+        start (str): first day in YYYY-MM-DD format, defaults to the first held day
+        end (str): last day in YYYY-MM-DD format, defaults to the last held day
+        days (int): number of days ending at end, instead of start
+    Returns:
+        DatetimeIndex of consecutive days, empty if none are held
+    """
+    daily = pd.DatetimeIndex(outlier.daily_results.categories)
+    cube = outlier.hourly_cube.dates
+    if not len(daily) or not len(cube):
+        return pd.DatetimeIndex([])
+    first = max(daily[0], cube[0])
+    last = min(daily[-1], cube[-1])
+    if end is not None:
+        last = min(last, pd.Timestamp(end))
+    if days is not None:
+        first = max(first, last - pd.Timedelta(days=days - 1))
+    elif start is not None:
+        first = max(first, pd.Timestamp(start))
+    return pd.date_range(first, last) if first <= last else pd.DatetimeIndex([])
+
+
+def backfill(outlier, dates, path, batch=500, outliers_fraction=.06, n_estimate=24):
+    """
+    Purpose:
+        Labels every day and hour of dates and writes the Parquet file.
+    Args:
+        outlier (Outlier): built or restored object
+        dates (DatetimeIndex): consecutive days, see day_range
+        path (str): output file, replaced atomically
+        batch (int): file names per row group
+        outliers_fraction (float): estimated outlier percentage of the hourly models
+        n_estimate (int): estimated number of outlier groups of the hourly models
+    Returns:
+        Dictionary with the number of rows, hourly outliers and seconds per phase
+    """
+    timings = {}
+    start = time.perf_counter()
+    counts, outliers = outlier.backfill_hourly(outlier.hourly_cube.day_index(dates[0]), len(dates),
+                                               outliers_fraction, n_estimate)
+    timings['hourly_s'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = outlier.daily_results
+    first = results.categories.index(dates[0].strftime('%Y-%m-%d'))
+    daily_counts = results.counts[:, first:first + len(dates)]
+    daily_outliers = results.outliers[:, first:first + len(dates)]
+    feature_outliers = outlier.feature_results.outliers[:, first:first + len(dates)]
+    catalog = outlier.catalog
+    names = pd.CategoricalDtype(outlier.names)
+    interfaces = pd.CategoricalDtype(catalog.interface_codes)
+    file_names = pd.CategoricalDtype(sorted(set(results.file_names)))
+    n_names, n_days = daily_counts.shape
+    # Row order inside a batch: file name, then day, then hour
+    day_column = np.tile(np.repeat(dates.values, 24), n_names)
+    hour_column = np.tile(np.arange(24, dtype=np.int8), n_names * n_days)
+
+    tmp_path = path + '.tmp'
+    writer = None
+    try:
+        for low in range(0, n_names, batch):
+            high = min(low + batch, n_names)
+            size = (high - low) * n_days * 24
+            rows = np.repeat(np.arange(low, high), n_days * 24)
+            frame = pd.DataFrame({
+                'date': day_column[:size],
+                'hour': hour_column[:size],
+                'name': pd.Categorical.from_codes(rows, dtype=names),
+                'interface': pd.Categorical.from_codes(results.interface_ids[rows], dtype=interfaces),
+                'file_name': pd.Categorical(np.asarray(results.file_names, dtype=object)[rows], dtype=file_names),
+                'count': counts[low:high].ravel(),
+                'outlier': outliers[low:high].ravel(),
+                'daily_count': np.repeat(daily_counts[low:high].ravel(), 24),
+                'daily_outlier': np.repeat(daily_outliers[low:high].ravel(), 24),
+                'feature_outlier': np.repeat(feature_outliers[low:high].ravel(), 24)})
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp_path, table.schema)
+            writer.write_table(table)
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(tmp_path, path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    timings['write_s'] = time.perf_counter() - start
+    return dict(timings, rows=counts.size, hourly_outliers=int(outliers.sum()),
+                outlier_days=int(daily_outliers.sum()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes the daily and hourly outliers of a range of days.')
+    parser.add_argument('--config', default='sources.json', help='sources.json, the default source without one')
+    parser.add_argument('--source', help='source name, defaults to the first')
+    parser.add_argument('--start', help='first day, YYYY-MM-DD')
+    parser.add_argument('--end', help='last day, YYYY-MM-DD')
+    parser.add_argument('--days', type=int, help='number of days ending at --end, instead of --start')
+    parser.add_argument('--output', default='backfill.parquet')
+    parser.add_argument('--rebuild', action='store_true', help='rebuild the source instead of using its snapshot')
+    parser.add_argument('--executor', choices=EXECUTORS, help='defaults to the one in sources.json')
+    parser.add_argument('--max-workers', type=int)
+    parser.add_argument('--batch', type=int, default=500, help='file names per row group')
+    args = parser.parse_args()
+
+    registry = SourceRegistry.load(args.config)
+    name = registry.resolve(args.source)
+    executor = args.executor or registry.executor
+    max_workers = args.max_workers or registry.max_workers
+    start = time.perf_counter()
+    outlier = None
+    if not args.rebuild and os.path.isfile(registry.snapshots[name].path):
+        outlier = StoredOutlier(registry.snapshots[name].path)
+        outlier.executor = executor
+        outlier.max_workers = max_workers
+    if outlier is None or outlier.feature_results is None:
+        # No snapshot, or one older than the daily features
+        outlier = registry.sources[name].build(executor, max_workers)
+    print('%-24s %10.2fs' % ('load', time.perf_counter() - start))
+
+    dates = day_range(outlier, args.start, args.end, args.days)
+    if not len(dates):
+        parser.error('no days of the source fall in the requested range')
+    summary = backfill(outlier, dates, args.output, args.batch)
+    print('%-24s %10.2fs' % ('hourly labels', summary['hourly_s']))
+    print('%-24s %10.2fs' % ('write', summary['write_s']))
+    print('%s to %s, %d file names, %d rows, %d outlier hours, %d outlier days written to %s' % (
+        dates[0].strftime('%Y-%m-%d'), dates[-1].strftime('%Y-%m-%d'), len(outlier.names), summary['rows'],
+        summary['hourly_outliers'], summary['outlier_days'], args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+"""
+Benchmarks for the Generic File Monitor. Run from the repository root, e.g.
+python -m benchmarks.bench_daily_counts
+"""
@@ -0,0 +1,76 @@
+"""
+Compares the original per-name/per-date scan of accumulate_sum_per_day_per_name
+against the grouped count on synthetic DirList CSVs.
+
+    python -m benchmarks.bench_daily_counts --rows 10000 100000 1000000 5000000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.synthetic import write_dirlist
+from ingest import DirListIngestor
+from outlier import Outlier, normalize_dirlist
+
+
+def legacy_accumulate_sum_per_day_per_name(df):
+    """
+    Purpose:
+        The original O(names x days x rows) implementation, kept for comparison.
+    Args:
+        df (DataFrame): get_df()
+    Returns:
+        DataFrame with rows of each day and columns of file count for each file category.
+    """
+    unique_names = df['name'].unique()
+    dates = pd.date_range(df['date'].iloc[0], df['date'].iloc[len(df) - 1])
+    daily = pd.DataFrame(index=dates)
+    daily.insert(0, "date", dates)
+    days = []
+    unique_dates = daily['date'].unique()
+    for val in range(len(daily)):
+        days.append(daily['date'].iloc[val].dayofweek)
+    daily.insert(1, "day", days)
+    for name in unique_names:
+        temp = []
+        for date in unique_dates:
+            temp.append(df[(df['name'] == name) & (df['date'] == date)].date.count())
+        daily.insert(len(daily.columns), name, temp)
+    return daily
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000, 5000000])
+    parser.add_argument('--names', type=int, default=20)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--legacy-max-rows', type=int, default=100000,
+                        help='skip the original implementation above this size')
+    args = parser.parse_args()
+
+    outlier = Outlier.__new__(Outlier)
+    print('%10s %12s %12s %10s' % ('rows', 'legacy (s)', 'grouped (s)', 'speedup'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            path = write_dirlist(os.path.join(tmp, 'DirList.csv'), rows, args.names, args.days)
+            df = DirListIngestor(normalize_dirlist).read(path)
+
+            start = time.perf_counter()
+            grouped = outlier.accumulate_sum_per_day_per_name(df)
+            grouped_time = time.perf_counter() - start
+
+            if rows <= args.legacy_max_rows:
+                start = time.perf_counter()
+                legacy = legacy_accumulate_sum_per_day_per_name(df)
+                legacy_time = time.perf_counter() - start
+                pd.testing.assert_frame_equal(legacy, grouped, check_dtype=False, check_freq=False)
+                print('%10d %12.3f %12.3f %9.1fx' % (rows, legacy_time, grouped_time, legacy_time / grouped_time))
+            else:
+                print('%10d %12s %12.3f %10s' % (rows, '-', grouped_time, '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Compares the daily count model against the multivariate daily features on a
+synthetic DirList with missing days, truncated files and late deliveries:
+the share of each kind of anomaly found, the precision of the flagged days,
+and the time to aggregate and label the features at --threshold.
+
+    python -m benchmarks.bench_features --interfaces 50 --days 120 --anomalies 60
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import write_dataset
+from features import daily_features, score_features
+from outlier import Outlier
+
+KINDS = ('missing_day', 'truncated', 'late')
+
+
+def truth_of(results, anomalies):
+    """
+    Purpose:
+        Marks the (file name, day) cells of every interface an anomaly hit.
+    Args:
+        results (SeriesResults): daily results, one row per file name
+        anomalies (list): anomalies.json of write_dataset
+    Returns:
+        Dictionary of anomaly kind to a bool array of the results' shape
+    """
+    interfaces = np.asarray(results.interfaces)
+    days = {date: i for i, date in enumerate(results.categories)}
+    truth = {kind: np.zeros(results.outliers.shape, dtype=bool) for kind in KINDS}
+    for anomaly in anomalies:
+        if anomaly['date'] in days:
+            truth[anomaly['kind']][interfaces == anomaly['interface'], days[anomaly['date']]] = True
+    return truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--interfaces', type=int, default=50)
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--files-per-day', type=int, default=6)
+    parser.add_argument('--anomalies', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threshold', type=float, default=5.0, help='see features.score_features')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset = write_dataset(os.path.join(tmp, 'data'), args.interfaces, args.days, args.files_per_day,
+                                args.anomalies, seed=args.seed, kinds=KINDS)
+        with open(dataset['anomalies_path']) as anomalies_file:
+            anomalies = json.load(anomalies_file)
+        outlier = Outlier(dataset['raw_path'], dataset['db_path'], hourly_path=os.path.join(tmp, 'hourly.bin'),
+                          model_path=None, history_path=os.path.join(tmp, 'history'),
+                          catalog_path=os.path.join(tmp, 'catalog.json'))
+
+    start = time.perf_counter()
+    features = daily_features(outlier.trainingdf, outlier.daily_counts['date'], outlier.names)
+    aggregate_time = time.perf_counter() - start
+    start = time.perf_counter()
+    feature_outliers = score_features(features, args.threshold)
+    score_time = time.perf_counter() - start
+
+    truth = truth_of(outlier.daily_results, anomalies)
+    anomalous = np.logical_or.reduce(list(truth.values()))
+    print('%d rows, %d file names, %d days, %d anomalies' % (
+        dataset['rows'], len(outlier.names), len(outlier.daily_results.categories), len(anomalies)))
+    print('features: aggregate %.3fs, score %.3fs' % (aggregate_time, score_time))
+    print('%10s %10s %9s' % ('model', 'flagged', 'precision') + ''.join(' %12s' % kind for kind in KINDS))
+    for model, flagged in (('counts', outlier.daily_results.outliers), ('features', feature_outliers)):
+        recall = ['%12.3f' % ((flagged & truth[kind]).sum() / float(max(truth[kind].sum(), 1))) for kind in KINDS]
+        print('%10s %10d %9.3f ' % (model, flagged.sum(), (flagged & anomalous).sum() / float(max(flagged.sum(), 1)))
+              + ' '.join(recall))
+
+
+if __name__ == '__main__':
+    main()
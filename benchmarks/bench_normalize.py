@@ -0,0 +1,141 @@
+"""
+Profiles the time and memory of parsing and normalizing synthetic DirList
+CSVs of increasing size, comparing the original per-row normalization with
+normalize_dirlist. Every measurement runs in a fresh interpreter so that the
+peak RSS of one size does not hide the next.
+
+    python -m benchmarks.bench_normalize --rows 10000 100000 1000000 5000000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import write_dirlist
+from outlier import normalize_dirlist
+
+
+def legacy_normalize_dirlist(raw_df):
+    """
+    Purpose:
+        The original get_df normalization with a Python loop over the time
+        column, kept for comparison.
+    Args:
+        raw_df (DataFrame): rows as read by pd.read_csv
+    Returns:
+        DataFrame with columns: date, time, hour, size, name
+    """
+    raw_df = raw_df[raw_df.name.str.match(
+        '.*SST.*')].reset_index(drop=True)
+    raw_df['name'] = raw_df['name'].str.replace(r"_20[0-9]*.*$", "", regex=True)
+    raw_df['date'] = raw_df['date'].str.replace(".", "", regex=False)
+    raw_df['date'] = pd.to_datetime(raw_df['date'], format='%m%d%Y')
+    temp_hours = []
+    for x in range(len(raw_df)):
+        temp_hours.append(
+            raw_df['time'].iloc[x][0:raw_df['time'].iloc[x].index(":")])
+    raw_df.insert(2, "hour", temp_hours)
+    return raw_df
+
+
+NORMALIZERS = {'legacy': legacy_normalize_dirlist, 'vectorized': normalize_dirlist}
+
+
+def current_rss():
+    """
+    Returns:
+        Resident set size of this process in bytes
+    """
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def profile(normalizer, path):
+    """
+    Purpose:
+        Parses and normalizes a CSV in this process.
+    Args:
+        normalizer (str): key of NORMALIZERS
+        path (str): DirList CSV
+    Returns:
+        Dictionary with parse and normalize seconds, peak RSS growth and the
+        size of the resulting frame in bytes
+    """
+    baseline = current_rss()
+    start = time.perf_counter()
+    raw_df = pd.read_csv(path)
+    parsed = time.perf_counter()
+    df = NORMALIZERS[normalizer](raw_df)
+    done = time.perf_counter()
+    del raw_df
+    # ru_maxrss is reported in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {'rows': len(df), 'parse_s': parsed - start, 'normalize_s': done - parsed,
+            'peak_rss_mb': max(peak - baseline, 0) / 1e6,
+            'frame_mb': df.memory_usage(deep=True).sum() / 1e6}
+
+
+def check(path):
+    """
+    Purpose:
+        Asserts that both normalizers agree on a CSV.
+    Args:
+        path (str): DirList CSV
+    """
+    legacy = legacy_normalize_dirlist(pd.read_csv(path))
+    vectorized = normalize_dirlist(pd.read_csv(path))
+    assert (legacy['date'].values == vectorized['date'].values).all()
+    assert (legacy['hour'].astype(int).values == vectorized['hour'].values).all()
+    assert (legacy['size'].values == vectorized['size'].values).all()
+    assert (legacy['name'].astype(str).values == vectorized['name'].astype(str).values).all()
+    minutes = legacy['time'].str.slice(-2).astype(int).values
+    assert (vectorized['minute'].values == vectorized['hour'].values.astype(np.int64) * 60 + minutes).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000, 5000000])
+    parser.add_argument('--names', type=int, default=20)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--legacy-max-rows', type=int, default=1000000,
+                        help='skip the original implementation above this size')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--child', nargs=2, metavar=('NORMALIZER', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(profile(*args.child)))
+        return
+
+    results = []
+    print('%10s %11s %10s %13s %13s %10s' % ('rows', 'normalizer', 'parse (s)', 'normalize (s)',
+                                             'peak RSS (MB)', 'frame (MB)'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            path = write_dirlist(os.path.join(tmp, 'DirList.csv'), rows, args.names, args.days)
+            if rows <= args.legacy_max_rows:
+                check(path)
+            for normalizer in sorted(NORMALIZERS):
+                if normalizer == 'legacy' and rows > args.legacy_max_rows:
+                    continue
+                output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_normalize', '--child',
+                                         normalizer, path], check=True, capture_output=True, text=True).stdout
+                result = dict(json.loads(output), normalizer=normalizer, csv_rows=rows)
+                results.append(result)
+                print('%10d %11s %10.3f %13.3f %13.1f %10.1f' % (rows, normalizer, result['parse_s'],
+                                                                 result['normalize_s'], result['peak_rss_mb'],
+                                                                 result['frame_mb']))
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
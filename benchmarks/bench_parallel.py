@@ -0,0 +1,75 @@
+"""
+Reports the wall-clock speedup of the per file name model fits in
+get_daily_outliers and get_hourly_outliers versus executor and worker count,
+and checks every configuration returns exactly the serial results.
+
+    python -m benchmarks.bench_parallel --names 200 --workers 1 2 4 8
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import make_names, write_dirlist, write_manifest
+from model_store import ModelStore
+from outlier import Outlier
+
+
+def run(outlier, date):
+    """
+    Purpose:
+        Times one daily and one hourly scoring pass, fitting every model again
+        in a fresh in-memory model store.
+    Args:
+        outlier (Outlier): configured instance
+        date (str): target date of the hourly pass
+    Returns:
+        (daily seconds, hourly seconds, daily results, hourly results)
+    """
+    outlier.model_store = ModelStore(None)
+    start = time.perf_counter()
+    daily = outlier.get_daily_outliers(outlier.trainingdf, outlier.trainingdf, outliers_fraction=.3, n_estimate=8)
+    daily_time = time.perf_counter() - start
+    start = time.perf_counter()
+    hourly = outlier.get_hourly_outliers(date, outliers_fraction=.06, n_estimate=24)
+    hourly_time = time.perf_counter() - start
+    return daily_time, hourly_time, daily, hourly
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--names', type=int, default=200)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--files-per-day', type=int, default=4, help='files per name per day')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--executors', nargs='+', default=['threads', 'processes'])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rows = args.names * args.days * args.files_per_day
+        raw_path = write_dirlist(os.path.join(tmp, 'DirList.csv'), rows, args.names, args.days)
+        db_path = write_manifest(os.path.join(tmp, 'list.txt'), make_names(args.names))
+        outlier = Outlier(raw_path, db_path, os.path.join(tmp, 'outlier_hourly.bin'), model_path=None,
+                          history_path=os.path.join(tmp, 'outlier_history'),
+                          catalog_path=os.path.join(tmp, 'outlier_catalog.json'))
+        date = outlier.hourly_cube.dates[-1].strftime('%Y-%m-%d')
+
+        serial_daily_time, serial_hourly_time, serial_daily, serial_hourly = run(outlier, date)
+        print('%10s %8s %10s %10s %10s %10s' % ('executor', 'workers', 'daily (s)', 'speedup',
+                                                'hourly (s)', 'speedup'))
+        print('%10s %8d %10.2f %9.2fx %10.2f %9.2fx' % ('serial', 1, serial_daily_time, 1,
+                                                        serial_hourly_time, 1))
+        for executor in args.executors:
+            for workers in args.workers:
+                outlier.executor = executor
+                outlier.max_workers = workers
+                daily_time, hourly_time, daily, hourly = run(outlier, date)
+                if daily != serial_daily or hourly != serial_hourly:
+                    raise AssertionError(executor + ' with ' + str(workers) + ' workers differs from serial')
+                print('%10s %8d %10.2f %9.2fx %10.2f %9.2fx' % (
+                    executor, workers, daily_time, serial_daily_time / daily_time,
+                    hourly_time, serial_hourly_time / hourly_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Measures the /api/daily document the dashboard loads for a long window: the
+points per series, the JSON and gzip sizes, the server time to build,
+serialize and compress it, and the client time to parse it and prepare the
+Highcharts series (with node, if installed), at full resolution and reduced
+to the point budget with each aggregate. Counts follow a weekly delivery
+pattern and outlier days are drawn at --outlier-shares, 0.3 being the share
+the daily count model flags and 0.02 about the feature model's.
+
+    python -m benchmarks.bench_payload --interfaces 1000 --days 365 --points 120
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import FILE_TYPES, make_names
+from catalog import InterfaceCatalog
+from downsample import AGGREGATES
+from results import SeriesResults
+
+# Parses a document and builds the chart series as templates/all.html does
+CLIENT = '''
+const text = require('fs').readFileSync(process.argv[1], 'utf8');
+const start = process.hrtime.bigint();
+const data = JSON.parse(text);
+const series = data.series.map(function (s) {
+    return s.x ? s.x.map(function (position, i) { return [position, s.data[i]]; }) : s.data;
+});
+console.log(Number(process.hrtime.bigint() - start) / 1e6, series.length);
+'''
+
+
+def make_results(interfaces, days, outlier_share, seed=0):
+    """
+    Returns:
+        SeriesResults of interfaces * len(FILE_TYPES) daily series ending today
+    """
+    rng = np.random.RandomState(seed)
+    catalog = InterfaceCatalog(None).add(make_names(interfaces * len(FILE_TYPES)))
+    dates = pd.date_range(end=pd.Timestamp.today().normalize(), periods=days)
+    expected = np.where(dates.dayofweek.values >= 5, 3, 6)
+    counts = rng.binomial(np.broadcast_to(expected, (len(catalog), days)), .95)
+    outliers = rng.rand(len(catalog), days) < outlier_share
+    return SeriesResults(dates.strftime('%Y-%m-%d'), catalog.interfaces, catalog.file_names, counts, outliers,
+                         catalog.interface_ids)
+
+
+def client_ms(path):
+    """
+    Returns:
+        Milliseconds node takes to parse the document at path and build the series, None without node
+    """
+    if shutil.which('node') is None:
+        return None
+    output = subprocess.check_output(['node', '-e', CLIENT, path])
+    return float(output.split()[0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--interfaces', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--points', type=int, default=120, help='point budget per series')
+    parser.add_argument('--outlier-shares', type=float, nargs='+', default=[.3, .02])
+    args = parser.parse_args()
+
+    print('%d series x %d days' % (args.interfaces * len(FILE_TYPES), args.days))
+    print('%8s %10s %12s %12s %12s %12s %12s' % ('outliers', 'aggregate', 'points', 'json KB', 'gzip KB',
+                                                 'server ms', 'client ms'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for share in args.outlier_shares:
+            results = make_results(args.interfaces, args.days, share)
+            for aggregate in ('full',) + AGGREGATES:
+                start = time.perf_counter()
+                document = results.to_json(None, 'all', None, None if aggregate == 'full' else args.points,
+                                           aggregate)
+                body = json.dumps(document, separators=(',', ':')).encode('utf-8')
+                compressed = gzip.compress(body, 6)
+                server = (time.perf_counter() - start) * 1000
+                path = os.path.join(tmp, 'daily.json')
+                with open(path, 'wb') as document_file:
+                    document_file.write(body)
+                client = client_ms(path)
+                points = sum(len(series['data']) for series in document['series'])
+                print('%8.2f %10s %12d %12.0f %12.0f %12.0f %12s' % (
+                    share, aggregate, points, len(body) / 1024.0, len(compressed) / 1024.0, server,
+                    '-' if client is None else '%.0f' % client))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Measures /api/hourly and /api/counter latency against synthetic DirList
+histories with an increasing number of interface file names. The /date and
+/counter pages only render a template, their data comes from these routes.
+The first request of each route misses the response cache, the following
+ones are served from it. Every size is measured in its own process and
+directory, so its registry, snapshot and response caches start empty.
+
+    python -m benchmarks.bench_routes --names 50 500 5000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import make_names, write_dirlist, write_manifest
+from sources import SourceRegistry
+
+
+def time_route(client, url, repeat):
+    """
+    Purpose:
+        Requests url repeat times.
+    Args:
+        client: Flask test client
+        url (str): route with query string
+        repeat (int): number of requests
+    Returns:
+        Array of latencies in seconds
+    """
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(url + ' returned ' + str(response.status_code))
+    return np.array(latencies)
+
+
+def measure(directory, n_names, days, files_per_day, repeat):
+    """
+    Purpose:
+        Builds a source of n_names file names in directory and times its routes.
+        Run in a child process, flaskServer serves the snapshots of the
+        working directory's sources.json from the moment it is imported.
+    Args:
+        directory (str): empty state directory, made the working directory
+        n_names (int): number of file names
+        days (int): days of history
+        files_per_day (int): files per name per day
+        repeat (int): number of cached requests per route
+    Returns:
+        Dictionary with rows and the hourly and counter latencies in seconds
+    """
+    rows = n_names * days * files_per_day
+    raw_path = write_dirlist(os.path.join(directory, 'DirList.csv'), rows, n_names, days)
+    db_path = write_manifest(os.path.join(directory, 'list.txt'), make_names(n_names))
+    with open(os.path.join(directory, 'sources.json'), 'w') as sources_file:
+        json.dump({'sources': [{'name': 'bench', 'raw_path': raw_path, 'db_path': db_path, 'state_dir': '.'}]},
+                  sources_file)
+    os.chdir(directory)
+    SourceRegistry.load('sources.json').ensure_snapshots()
+    import flaskServer
+    client = flaskServer.app.test_client()
+    hourly = time_route(client, '/api/hourly?date=2017-01-15', repeat + 1)
+    counter = time_route(client, '/api/counter', repeat + 1)
+    return {'rows': rows, 'hourly': hourly.tolist(), 'counter': counter.tolist()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--names', type=int, nargs='+', default=[50, 500, 5000])
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--files-per-day', type=int, default=4, help='files per name per day')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', metavar='DIRECTORY', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        sys.path.insert(0, os.getcwd())
+        print(json.dumps(measure(args.child, args.names[0], args.days, args.files_per_day, args.repeat)))
+        return
+
+    print('%8s %10s %14s %14s %16s %16s' % ('names', 'rows', 'hourly first', 'hourly cached',
+                                            'counter first', 'counter cached'))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_names in args.names:
+            directory = os.path.join(tmp, str(n_names))
+            os.makedirs(directory)
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.bench_routes', '--child', directory,
+                                     '--names', str(n_names), '--days', str(args.days),
+                                     '--files-per-day', str(args.files_per_day), '--repeat', str(args.repeat)],
+                                    check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            hourly, counter = np.array(result['hourly']), np.array(result['counter'])
+            print('%8d %10d %13.3fs %13.4fs %15.3fs %15.4fs' % (
+                n_names, result['rows'], hourly[0], np.median(hourly[1:]), counter[0], np.median(counter[1:])))
+
+
+if __name__ == '__main__':
+    main()
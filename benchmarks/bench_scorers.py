@@ -0,0 +1,80 @@
+"""
+Compares the hourly profile scorer against the Isolation Forest on a DirList
+CSV: agreement of the flagged hours, time to fit and score every file name,
+and the time a rebuild takes to update the stored profiles with a recounted
+day instead of refitting them.
+
+    python -m benchmarks.bench_scorers --raw-path data/DirList_06_26_2017.csv --days 30
+"""
+import argparse
+import tempfile
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from outlier import Outlier, name_seed
+from scorers import SCORERS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--raw-path', default='data/DirList_06_26_2017.csv')
+    parser.add_argument('--db-path', default='data/list.txt')
+    parser.add_argument('--days', type=int, default=30, help='number of trailing target days')
+    parser.add_argument('--fraction', type=float, default=.06)
+    parser.add_argument('--n-estimate', type=int, default=24)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        outlier = Outlier(args.raw_path, args.db_path, hourly_path=tmp + '/hourly.bin', model_path=None,
+                          history_path=tmp + '/history', catalog_path=tmp + '/catalog.json')
+    cube = outlier.hourly_cube
+    names = list(outlier.trainingdf['name'].unique())
+    training = dict(zip(names, cube.iter_training_rows(names)))
+    last_day = cube.start + timedelta(days=len(cube.counts) - 1)
+    dates = [last_day - timedelta(days=offset) for offset in range(min(args.days, len(cube.counts)))]
+
+    flagged = {}
+    timings = {}
+    for kind, scorer in sorted(SCORERS.items()):
+        start = time.perf_counter()
+        models = {name: scorer.fit(training[name], args.fraction, args.n_estimate, name_seed(name))
+                  for name in names}
+        fit_time = time.perf_counter() - start
+        labels = []
+        start = time.perf_counter()
+        for date in dates:
+            day = cube.day(date)
+            for name in names:
+                target = np.column_stack([np.full(24, date.weekday()), np.arange(24),
+                                          day[:, cube.name_index[name]]])
+                labels.append(models[name].predict(target) == -1)
+        score_time = time.perf_counter() - start
+        flagged[kind] = np.concatenate(labels)
+        timings[kind] = (fit_time, score_time)
+
+    forest, profile = flagged['forest'], flagged['profile']
+    both = (forest & profile).sum()
+    print('%d file names, %d target days, %d hours' % (len(names), len(dates), len(forest)))
+    print('%10s %10s %12s %12s' % ('scorer', 'flagged', 'fit (s)', 'score (s)'))
+    for kind in sorted(SCORERS):
+        print('%10s %10d %12.3f %12.3f' % (kind, flagged[kind].sum(), timings[kind][0], timings[kind][1]))
+    print('agreement %.4f  precision %.3f  recall %.3f  jaccard %.3f (profile against forest)' % (
+        (forest == profile).mean(), both / float(max(profile.sum(), 1)), both / float(max(forest.sum(), 1)),
+        both / float(max((forest | profile).sum(), 1))))
+
+    # A rebuild recounts the last day of every file name, see Outlier.update_profiles
+    profiles = {name: SCORERS['profile'].fit(training[name], args.fraction, args.n_estimate, 0) for name in names}
+    last = cube.counts[-1:]
+    start = time.perf_counter()
+    for name in names:
+        rows = cube.block_rows(cube.dates[-1:], last, cube.name_index[name])
+        profiles[name].add_rows(rows, -1)
+        profiles[name].add_rows(rows)
+    print('profile rebuild update of one day %.4fs, refit %.4fs' % (time.perf_counter() - start,
+                                                                   timings['profile'][0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Measures how long a file dropped into a watched directory takes to reach the
+hourly anomaly check: the source registry wakes on the inotify event (or the
+next scan), rebuilds the snapshot and calls its listeners.
+
+    python -m benchmarks.bench_watcher --files 2000 --drops 10
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.synthetic import make_names, write_directory, write_manifest
+from sources import Source, SourceRegistry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=2000, help='files in the directory before watching')
+    parser.add_argument('--names', type=int, default=20)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--drops', type=int, default=10, help='files dropped while watching')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = os.path.join(tmp, 'files')
+        start = (datetime.today() - timedelta(days=args.days - 1)).strftime('%Y-%m-%d')
+        write_directory(files, args.files, args.names, args.days, start)
+        db_path = write_manifest(os.path.join(tmp, 'list.txt'), make_names(args.names))
+
+        source = Source('watched', files, db_path, state_dir=os.path.join(tmp, 'state'))
+        registry = SourceRegistry([source], interval=30.0)
+        begin = time.perf_counter()
+        registry.ensure_snapshots()
+        print('initial build %.2f s' % (time.perf_counter() - begin))
+
+        checked = threading.Condition()
+        seen = {}
+
+        def listener(name, snapshot):
+            with checked:
+                for file_name in snapshot.outlier.ingestor.files:
+                    seen.setdefault(file_name, time.perf_counter())
+                checked.notify_all()
+
+        registry.listeners.append(listener)
+        registry.start()
+        # The first round checks the existing files
+        time.sleep(1.0)
+        print('backend %s' % ('inotify' if registry.get().outlier.ingestor.fileno() is not None else 'scan'))
+        latencies = []
+        for drop in range(args.drops):
+            name = make_names(args.names)[drop % args.names] + datetime.now().strftime('_%Y%m%d%H%M%S') + \
+                '%02d.dat' % drop
+            dropped = time.perf_counter()
+            with open(os.path.join(files, name), 'wb') as data_file:
+                data_file.write(b'x' * 1024)
+            with checked:
+                checked.wait_for(lambda: name in seen, timeout=60)
+            latencies.append(seen.get(name, float('nan')) - dropped)
+        registry.stop()
+
+    latencies.sort()
+    print('%d drops: median %.2f s, max %.2f s from file creation to the hourly check' % (
+        len(latencies), latencies[len(latencies) // 2], latencies[-1]))
+
+
+if __name__ == '__main__':
+    main()
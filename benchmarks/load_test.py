@@ -0,0 +1,186 @@
+"""
+Load generator for serve.py: starts the multi-process server on a synthetic
+DirList for each worker count, drives it with concurrent keep-alive clients
+requesting a mix of routes for a fixed time, and reports the throughput and
+the latency percentiles per route. /api/hourly asks for random days of the
+history so most of its requests miss the response cache and are scored.
+
+    python -m benchmarks.load_test --workers 1 2 4 --clients 16 --duration 30
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from benchmarks.synthetic import write_dataset
+
+# Route, share of the requests
+MIX = [('/api/hourly', .3), ('/api/counter', .2), ('/api/daily', .4), ('/status', .1)]
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def wait_ready(port, timeout=300.0):
+    """
+    Purpose:
+        Polls /status until a worker answers.
+    Args:
+        port (int): server port
+        timeout (float): seconds to wait
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/status')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(.5)
+    raise RuntimeError('server on port %d did not start' % port)
+
+
+def client(port, days, stop, samples, seed):
+    """
+    Purpose:
+        Sends requests of the MIX over one keep-alive connection until stop is set.
+    Args:
+        port (int): server port
+        days (list): YYYY-MM-DD days to request hourly outliers for
+        stop (threading.Event): ends the client
+        samples (list): receives (route, status, latency in seconds) tuples
+        seed (int): seed of the route and day choice
+    """
+    rng = random.Random(seed)
+    routes = [route for route, _ in MIX]
+    weights = [share for _, share in MIX]
+    connection = None
+    while not stop.is_set():
+        route = rng.choices(routes, weights)[0]
+        url = route + ('?date=' + rng.choice(days) if route == '/api/hourly' else '')
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+            connection.request('GET', url)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            connection = None
+            status = 0
+        samples.append((route, status, time.perf_counter() - start))
+
+
+def run_load(port, days, clients, duration):
+    """
+    Purpose:
+        Drives a running server with concurrent clients.
+    Args:
+        port (int): server port
+        days (list): days requested from /api/hourly
+        clients (int): number of concurrent connections
+        duration (float): seconds of load
+    Returns:
+        List of (route, status, latency) tuples
+    """
+    stop = threading.Event()
+    samples = []
+    threads = [threading.Thread(target=client, args=(port, days, stop, samples, seed)) for seed in range(clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def summarize(samples, duration):
+    """
+    Returns:
+        Dictionary of route (and 'all') to requests, errors, throughput and latency percentiles in ms
+    """
+    summary = {}
+    for route in ['all'] + [route for route, _ in MIX]:
+        rows = [sample for sample in samples if route == 'all' or sample[0] == route]
+        if not rows:
+            continue
+        latencies = np.array([latency for _, status, latency in rows if status == 200]) * 1000
+        summary[route] = {'requests': len(rows), 'errors': sum(1 for _, status, _ in rows if status != 200),
+                          'throughput': len(rows) / duration}
+        for percentile in (50, 95, 99):
+            summary[route]['p%d_ms' % percentile] = float(np.percentile(latencies, percentile)) \
+                if len(latencies) else None
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--warmup', type=float, default=5.0, help='seconds of load before measuring')
+    parser.add_argument('--interfaces', type=int, default=20)
+    parser.add_argument('--days', type=int, default=120)
+    parser.add_argument('--files-per-day', type=int, default=6)
+    parser.add_argument('--compute-threads', type=int, default=1)
+    parser.add_argument('--compute-queue', type=int, default=8)
+    parser.add_argument('--compute-timeout', type=float, default=30.0)
+    parser.add_argument('--output', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    repo = os.getcwd()
+    results = {'cpus': os.cpu_count(), 'params': vars(args), 'runs': {}}
+    start = (datetime.today() - timedelta(days=args.days - 1)).strftime('%Y-%m-%d')
+    days = [(datetime.today() - timedelta(days=offset)).strftime('%Y-%m-%d') for offset in range(args.days)]
+    print('%8s %-14s %9s %7s %10s %10s %10s %10s' % ('workers', 'route', 'requests', 'errors', 'req/s',
+                                                      'p50 ms', 'p95 ms', 'p99 ms'))
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset = write_dataset(os.path.join(tmp, 'data'), args.interfaces, args.days, args.files_per_day, 0, start)
+        with open(os.path.join(tmp, 'sources.json'), 'w') as sources_file:
+            json.dump({'sources': [{'name': 'load', 'raw_path': dataset['raw_path'], 'db_path': dataset['db_path'],
+                                    'state_dir': '.'}]}, sources_file)
+        for workers in args.workers:
+            port = free_port()
+            server = subprocess.Popen([sys.executable, os.path.join(repo, 'serve.py'), '--host', '127.0.0.1',
+                                       '--port', str(port), '--workers', str(workers),
+                                       '--compute-threads', str(args.compute_threads),
+                                       '--compute-queue', str(args.compute_queue),
+                                       '--compute-timeout', str(args.compute_timeout)],
+                                      cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                wait_ready(port)
+                # Every worker imports flaskServer and maps the snapshot before it is measured
+                run_load(port, days, args.clients, args.warmup)
+                summary = summarize(run_load(port, days, args.clients, args.duration), args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+            results['runs'][str(workers)] = summary
+            for route, row in summary.items():
+                print('%8d %-14s %9d %7d %10.1f %10s %10s %10s' % (
+                    workers, route, row['requests'], row['errors'], row['throughput'],
+                    *['-' if row[key] is None else '%.1f' % row[key] for key in ('p50_ms', 'p95_ms', 'p99_ms')]))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=1)
+
+
+if __name__ == '__main__':
+    main()
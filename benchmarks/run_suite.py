@@ -0,0 +1,274 @@
+"""
+Benchmark suite: times every hot path of the monitor on a synthetic DirList
+and stores the results as JSON so they can be compared between commits.
+Each stage reports the median, minimum and maximum of its repeats and the
+peak memory it allocated, traced by tracemalloc in one extra run.
+
+    python -m benchmarks.run_suite --interfaces 20 --days 365 --files-per-day 6 --anomalies 40
+    python -m benchmarks.run_suite --baseline benchmarks/results/<older run>.json
+    python -m benchmarks.run_suite --compare OLD.json NEW.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+from benchmarks.synthetic import write_dataset
+from history_store import HistoryStore
+from ingest import DirListIngestor
+from model_store import ModelStore
+from outlier import Outlier, normalize_dirlist
+from response_cache import ResponseCache
+from sources import SourceRegistry
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+# Flask routes timed by the suite, {date} is the last day of the data
+ROUTES = ['/', '/date?date={date}', '/counter', '/api/daily', '/api/hourly?date={date}', '/api/counter']
+
+
+def measure(run, setup=None, repeat=5):
+    """
+    Purpose:
+        Times run() repeat times, calling setup() untimed before each run, then
+        traces the peak memory of one more run.
+    Args:
+        run: callable to measure
+        setup: callable preparing a run, e.g. dropping a cache
+        repeat (int): number of timed runs
+    Returns:
+        Dictionary with median_s, min_s, max_s, repeats and peak_mb
+    """
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        run()
+        peak = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return {'median_s': statistics.median(timings), 'min_s': min(timings), 'max_s': max(timings),
+            'repeats': repeat, 'peak_mb': peak / 2.0 ** 20}
+
+
+def report(name, result):
+    print('%-40s %10.4fs %10.1f MB' % (name, result['median_s'], result.get('peak_mb', float('nan'))))
+
+
+def git_revision():
+    """
+    Returns:
+        (short commit hash, True if the working tree has changes), None values outside a git checkout
+    """
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL)
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                        stderr=subprocess.DEVNULL)
+        return commit.decode().strip(), bool(dirty.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def outlier_stages(outlier, date, tmp):
+    """
+    Purpose:
+        Lists the Outlier methods measured by the suite.
+    Args:
+        outlier (Outlier): built on the synthetic data
+        date (str): target date of the hourly stages
+        tmp (str): scratch directory for cold histories
+    Returns:
+        List of (stage name, run, setup)
+    """
+    df = outlier.trainingdf
+    histories = iter(range(10 ** 6))
+
+    def cold_ingest():
+        outlier.ingestor = DirListIngestor(partial(normalize_dirlist, name_filter=outlier.name_filter))
+        outlier.history = HistoryStore.load(os.path.join(tmp, 'history_%d' % next(histories)))
+
+    def cold_models():
+        outlier.model_store = ModelStore(None)
+
+    return [('get_df cold', outlier.get_df, cold_ingest),
+            ('get_df warm', outlier.get_df, None),
+            ('accumulate_sum_per_day_per_name', lambda: outlier.accumulate_sum_per_day_per_name(df), None),
+            ('get_daily_outliers cold', lambda: outlier.get_daily_outliers(df, df, .3, 8), cold_models),
+            ('get_daily_outliers warm', lambda: outlier.get_daily_outliers(df, df, .3, 8), None),
+            ('create_full_hour_traindata', lambda: outlier.create_full_hour_traindata(df), None),
+            ('get_hourly_outliers cold', lambda: outlier.get_hourly_outliers(date, .06, 24), cold_models),
+            ('get_hourly_outliers warm', lambda: outlier.get_hourly_outliers(date, .06, 24), None),
+            ('check_DB', outlier.check_DB, None)]
+
+
+def route_stages(server, date):
+    """
+    Purpose:
+        Lists the Flask routes measured by the suite, each with and without
+        its response cache.
+    Args:
+        server: the imported flaskServer module
+        date (str): ?date= of the hourly routes
+    Returns:
+        List of (stage name, run, setup)
+    """
+    client = server.app.test_client()
+    name = server.registry.default
+
+    def get(url):
+        response = client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(url + ' returned ' + str(response.status_code))
+
+    def drop_cache():
+        server.response_caches[name] = ResponseCache(maxsize=256)
+
+    stages = []
+    for route in ROUTES:
+        url = route.format(date=date)
+        stages.append(('route ' + route.split('?')[0] + ' uncached', partial(get, url), drop_cache))
+        stages.append(('route ' + route.split('?')[0] + ' cached', partial(get, url), None))
+    return stages
+
+
+def compare(baseline, current, threshold=1.25):
+    """
+    Purpose:
+        Prints the median time of every stage of two result files.
+    Args:
+        baseline (dict): older results
+        current (dict): newer results
+        threshold (float): ratio of medians reported as a regression
+    Returns:
+        List of the names of regressed stages
+    """
+    regressed = []
+    print('%-40s %12s %12s %8s' % ('stage', baseline.get('commit') or 'baseline',
+                                   current.get('commit') or 'current', 'ratio'))
+    for stage, result in current['stages'].items():
+        if stage not in baseline['stages']:
+            print('%-40s %12s %11.4fs %8s' % (stage, '-', result['median_s'], '-'))
+            continue
+        before = baseline['stages'][stage]['median_s']
+        ratio = result['median_s'] / before if before else float('inf')
+        flag = ''
+        if ratio > threshold:
+            regressed.append(stage)
+            flag = '  slower'
+        print('%-40s %11.4fs %11.4fs %7.2fx%s' % (stage, before, result['median_s'], ratio, flag))
+    if baseline.get('params') != current.get('params'):
+        print('warning: the runs used different parameters')
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--interfaces', type=int, default=10)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--files-per-day', type=int, default=6)
+    parser.add_argument('--anomalies', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-routes', action='store_true')
+    parser.add_argument('--output', help='result file, defaults to benchmarks/results/<time>-<commit>.json')
+    parser.add_argument('--baseline', help='result file to compare this run with')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='only compare two result files')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as old_file, open(args.compare[1]) as new_file:
+            sys.exit(1 if compare(json.load(old_file), json.load(new_file), args.threshold) else 0)
+
+    commit, dirty = git_revision()
+    repo = os.getcwd()
+    # The data ends today so the manifest window and the previous hour are realistic
+    start = (datetime.today() - timedelta(days=args.days - 1)).strftime('%Y-%m-%d')
+    params = {'interfaces': args.interfaces, 'days': args.days, 'files_per_day': args.files_per_day,
+              'anomalies': args.anomalies, 'seed': args.seed, 'repeat': args.repeat}
+    stages = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset = write_dataset(os.path.join(tmp, 'data'), args.interfaces, args.days, args.files_per_day,
+                                args.anomalies, start, args.seed)
+        params['rows'] = dataset['rows']
+        date = dataset['last_date']
+        print('%d rows, %d file names' % (dataset['rows'], args.interfaces * 8))
+
+        builds = iter(range(10 ** 6))
+
+        def build():
+            state = os.path.join(tmp, 'state_%d' % next(builds))
+            os.makedirs(state)
+            return Outlier(dataset['raw_path'], dataset['db_path'], hourly_path=os.path.join(state, 'hourly.bin'),
+                           model_path=os.path.join(state, 'models.pickle'),
+                           history_path=os.path.join(state, 'history'),
+                           catalog_path=os.path.join(state, 'catalog.json'))
+
+        stages['Outlier() cold'] = measure(build, repeat=max(args.repeat // 2, 1))
+        report('Outlier() cold', stages['Outlier() cold'])
+        outlier = build()
+        for name, run, setup in outlier_stages(outlier, date, tmp):
+            stages[name] = measure(run, setup, args.repeat)
+            report(name, stages[name])
+
+        if not args.skip_routes:
+            server_dir = os.path.join(tmp, 'server')
+            os.makedirs(server_dir)
+            with open(os.path.join(server_dir, 'sources.json'), 'w') as sources_file:
+                json.dump({'sources': [{'name': 'bench', 'raw_path': dataset['raw_path'],
+                                        'db_path': dataset['db_path'], 'state_dir': '.'}]}, sources_file)
+            os.chdir(server_dir)
+            try:
+                sys.path.insert(0, repo)
+                SourceRegistry.load('sources.json').ensure_snapshots()
+                start_time = time.perf_counter()
+                import flaskServer
+                stages['server startup'] = {'median_s': time.perf_counter() - start_time, 'repeats': 1}
+                for name, run, setup in route_stages(flaskServer, date):
+                    stages[name] = measure(run, setup, args.repeat)
+                    report(name, stages[name])
+            finally:
+                os.chdir(repo)
+
+    results = {'commit': commit, 'dirty': dirty, 'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+               'python': platform.python_version(), 'platform': platform.platform(),
+               'versions': {'numpy': np.__version__, 'pandas': pd.__version__, 'scikit-learn': sklearn.__version__},
+               'params': params, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+               'stages': stages}
+    output = args.output
+    if output is None:
+        if not os.path.isdir(RESULTS_DIR):
+            os.makedirs(RESULTS_DIR)
+        output = os.path.join(RESULTS_DIR, '%s-%s.json' % (datetime.now().strftime('%Y%m%d-%H%M%S'),
+                                                          commit or 'nogit'))
+    with open(output, 'w') as results_file:
+        json.dump(results, results_file, indent=1)
+    print('results written to ' + output)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            sys.exit(1 if compare(json.load(baseline_file), results, args.threshold) else 0)
+
+
+if __name__ == '__main__':
+    main()
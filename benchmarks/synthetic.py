@@ -0,0 +1,289 @@
+"""
+Synthetic DirList data for benchmarks
+---
+Writes CSVs in the format produced by CSVGetter.ps1:
+date(MM.dd.yyyy), time(HH:mm), size(bytes), file name
+or the monitored directory itself, for the watcher, and list.txt manifests
+in the format of DB_filelist.ps1.
+
+    python -m benchmarks.synthetic --interfaces 20 --days 365 --files-per-day 6 --anomalies 40 --output bench_data
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+FILE_TYPES = ['USC_VEHICLE_HEADER', 'USC_VEHICLE_ITEMS', 'USC_VEHICLE_PRICE', 'USC_VEHICLE_EVENT',
+              'USM_VEHICLE_HEADER', 'USM_VEHICLE_ITEMS', 'USM_VEHICLE_PRICE', 'USM_VEHICLE_EVENT']
+# Anomalies make_interface_dirlist injects: an interface delivers nothing for a day,
+# nothing for one of its hours, or a burst of extra files in one of its hours
+ANOMALIES = ('missing_day', 'missing_hour', 'burst')
+# Anomalies that keep the number of files: a day of truncated files, a day of late deliveries
+FILE_ANOMALIES = ('truncated', 'late')
+# Hours a late delivery is delayed by, and the size a truncated file keeps
+LATE_HOURS = 6
+TRUNCATED_SHARE = .05
+
+
+def make_names(n_names):
+    """
+    Purpose:
+        Generates normalized file names matching the SST interface pattern.
+    Args:
+        n_names (int): number of distinct file names
+    Returns:
+        List of names such as SST1000_USC_VEHICLE_HEADER
+    """
+    return ['SST' + str(1000 + i // len(FILE_TYPES)) + '_' + FILE_TYPES[i % len(FILE_TYPES)]
+            for i in range(n_names)]
+
+
+def make_dirlist(n_rows, n_names=20, days=365, start='2017-01-01', seed=0):
+    """
+    Purpose:
+        Generates a raw DirList DataFrame with n_rows files spread over
+        n_names file names and the given number of days.
+    Args:
+        n_rows (int): number of files
+        n_names (int): number of distinct file names
+        days (int): length of the history in days
+        start (str): first day in YYYY-MM-DD format
+        seed (int): random seed
+    Returns:
+        DataFrame with columns: date, time, size, name
+    """
+    rng = np.random.RandomState(seed)
+    names = np.array(make_names(n_names))
+    day_offsets = np.sort(rng.randint(0, days, n_rows))
+    minutes = rng.randint(0, 24 * 60, n_rows)
+    stamps = (pd.Timestamp(start) + pd.to_timedelta(day_offsets, unit='D') +
+              pd.to_timedelta(minutes, unit='m'))
+    name_idx = rng.randint(0, n_names, n_rows)
+    suffix = pd.Series(stamps.strftime('_%Y%m%d%H%M')) + pd.Series(rng.randint(10, 60, n_rows)).astype(str)
+    return pd.DataFrame({'date': stamps.strftime('%m.%d.%Y'),
+                         'time': stamps.strftime('%H:%M'),
+                         'size': rng.randint(0, 250000, n_rows),
+                         'name': pd.Series(names[name_idx]) + suffix + '.dat'})
+
+
+def write_dirlist(path, n_rows, n_names=20, days=365, start='2017-01-01', seed=0):
+    """
+    Purpose:
+        Writes a synthetic DirList CSV to path.
+    Args:
+        path (str): output CSV path
+        Remaining arguments are passed to make_dirlist
+    Returns:
+        path
+    """
+    make_dirlist(n_rows, n_names, days, start, seed).to_csv(path, index=False)
+    return path
+
+
+def write_directory(path, n_rows, n_names=20, days=365, start='2017-01-01', seed=0):
+    """
+    Purpose:
+        Creates the files of a synthetic DirList in a directory, sized and
+        timestamped as listed.
+    Args:
+        path (str): output directory, created if missing
+        Remaining arguments are passed to make_dirlist
+    Returns:
+        DataFrame of the created files
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    dirlist = make_dirlist(n_rows, n_names, days, start, seed).drop_duplicates('name')
+    stamps = pd.to_datetime(dirlist['date'] + ' ' + dirlist['time'], format='%m.%d.%Y %H:%M')
+    for name, size, stamp in zip(dirlist['name'], dirlist['size'], stamps):
+        file_path = os.path.join(path, name)
+        with open(file_path, 'wb') as data_file:
+            data_file.truncate(size)
+        os.utime(file_path, (stamp.timestamp(), stamp.timestamp()))
+    return dirlist
+
+
+def make_interface_dirlist(interfaces=10, days=90, files_per_day=6, anomalies=0, start='2017-01-01', seed=0,
+                           kinds=ANOMALIES):
+    """
+    Purpose:
+        Generates a raw DirList in which every interface delivers each of its
+        FILE_TYPES files files_per_day times a day at the interface's own hours,
+        about half as often on weekends, with a few files lost at random and
+        injected anomalies.
+    Args:
+        interfaces (int): number of interfaces, each with len(FILE_TYPES) file names
+        days (int): length of the history in days
+        files_per_day (int): deliveries per file name on a weekday
+        anomalies (int): number of injected anomalies
+        start (str): first day in YYYY-MM-DD format
+        seed (int): random seed
+        kinds (tuple): kinds of anomalies drawn from, ANOMALIES and FILE_ANOMALIES
+    Returns:
+        (DataFrame with columns: date, time, size, name sorted by time,
+         list of anomalies, dictionaries with kind, interface, date, hour and
+         the names of the files it removed)
+    """
+    rng = np.random.RandomState(seed)
+    names = np.array(make_names(interfaces * len(FILE_TYPES)))
+    interface_of = np.arange(len(names)) // len(FILE_TYPES)
+    schedules = np.sort(np.array([rng.choice(24, files_per_day, replace=files_per_day > 24)
+                                  for _ in range(interfaces)]).reshape(interfaces, files_per_day), axis=1)
+    dates = pd.date_range(start, periods=days)
+
+    # One row per (name, day, delivery)
+    name_idx, day_idx, slot = [grid.ravel() for grid in np.meshgrid(np.arange(len(names)), np.arange(days),
+                                                                    np.arange(files_per_day), indexing='ij')]
+    hour = schedules[interface_of[name_idx], slot]
+    weekend = dates.dayofweek.values[day_idx] >= 5
+    keep = (~weekend | (rng.rand(len(name_idx)) < .5)) & (rng.rand(len(name_idx)) >= .02)
+
+    injected = []
+    extra = []
+    truncated = np.zeros(len(name_idx), dtype=bool)
+    for _ in range(anomalies):
+        kind = kinds[rng.randint(len(kinds))]
+        interface = rng.randint(interfaces)
+        # Anomalies leave the first week as a clean history
+        day = rng.randint(min(7, days - 1), days)
+        anomaly_hour = int(schedules[interface, rng.randint(files_per_day)])
+        rows = (interface_of[name_idx] == interface) & (day_idx == day)
+        if kind == 'missing_hour':
+            rows &= hour == anomaly_hour
+        anomaly = {'kind': kind, 'interface': names[interface * len(FILE_TYPES)].split('_')[0],
+                   'date': dates[day].strftime('%Y-%m-%d'),
+                   'hour': anomaly_hour if kind in ('missing_hour', 'burst') else None,
+                   'rows': rows & keep}
+        if kind == 'burst':
+            burst = np.repeat(np.arange(interface * len(FILE_TYPES), (interface + 1) * len(FILE_TYPES)),
+                              5 * max(files_per_day // 2, 1))
+            extra.append((burst, np.full(len(burst), day), np.full(len(burst), anomaly_hour)))
+            anomaly['rows'] = None
+        elif kind == 'truncated':
+            truncated |= rows
+            anomaly['rows'] = None
+        elif kind == 'late':
+            hour[rows] = np.minimum(hour[rows] + LATE_HOURS, 23)
+            anomaly['rows'] = None
+        else:
+            keep &= ~rows
+        injected.append(anomaly)
+
+    name_idx, day_idx, hour, truncated = name_idx[keep], day_idx[keep], hour[keep], truncated[keep]
+    removed_rows = [anomaly.pop('rows') for anomaly in injected]
+    if extra:
+        name_idx = np.concatenate([name_idx] + [rows[0] for rows in extra])
+        day_idx = np.concatenate([day_idx] + [rows[1] for rows in extra])
+        hour = np.concatenate([hour] + [rows[2] for rows in extra])
+        truncated = np.concatenate([truncated, np.zeros(len(name_idx) - len(truncated), dtype=bool)])
+
+    def stamps_of(name_rows, day_rows, hour_rows):
+        seconds = rng.randint(0, 3600, len(name_rows))
+        return pd.DatetimeIndex(dates.values[day_rows]) + pd.to_timedelta(hour_rows * 3600 + seconds, unit='s')
+
+    stamps = stamps_of(name_idx, day_idx, hour)
+    file_names = pd.Series(names[name_idx]) + pd.Series(stamps.strftime('_%Y%m%d%H%M%S.dat'))
+    # Payload sizes vary around a per file type size
+    base_size = np.exp(rng.uniform(8, 12, len(FILE_TYPES)))
+    sizes = (base_size[name_idx % len(FILE_TYPES)] * rng.lognormal(0, .3, len(name_idx))).astype(np.int64)
+    sizes[truncated] = (sizes[truncated] * TRUNCATED_SHARE).astype(np.int64)
+    dirlist = pd.DataFrame({'date': stamps.strftime('%m.%d.%Y'), 'time': stamps.strftime('%H:%M'),
+                            'size': sizes, 'name': file_names, 'stamp': stamps})
+    dirlist = dirlist.drop_duplicates('name').sort_values('stamp', kind='mergesort').drop(columns='stamp')
+
+    # The files an anomaly removed are still expected by the database
+    all_idx, all_day, all_hour = [grid.ravel() for grid in np.meshgrid(
+        np.arange(len(names)), np.arange(days), np.arange(files_per_day), indexing='ij')]
+    all_hour = schedules[interface_of[all_idx], all_hour]
+    for anomaly, rows in zip(injected, removed_rows):
+        anomaly['files'] = [] if rows is None else (
+            pd.Series(names[all_idx[rows]]) +
+            pd.Series(stamps_of(all_idx[rows], all_day[rows], all_hour[rows]).strftime('_%Y%m%d%H%M%S.dat'))).tolist()
+    return dirlist.reset_index(drop=True), injected
+
+
+def write_dataset(directory, interfaces=10, days=90, files_per_day=6, anomalies=0, start='2017-01-01', seed=0,
+                  manifest_days=2, kinds=ANOMALIES):
+    """
+    Purpose:
+        Writes make_interface_dirlist as the DirList CSV of its last day, a
+        list.txt expecting the files of the last manifest_days days including
+        the ones anomalies removed, and anomalies.json.
+    Args:
+        directory (str): output directory, created if missing
+        manifest_days (int): days of files listed in list.txt
+        Remaining arguments are passed to make_interface_dirlist
+    Returns:
+        Dictionary with raw_path, db_path, anomalies_path, rows and last_date
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    dirlist, injected = make_interface_dirlist(interfaces, days, files_per_day, anomalies, start, seed, kinds)
+    last_day = pd.Timestamp(start) + pd.Timedelta(days=days - 1)
+    raw_path = os.path.join(directory, last_day.strftime('DirList_%m_%d_%Y.csv'))
+    dirlist.to_csv(raw_path, index=False)
+
+    first_listed = (last_day - pd.Timedelta(days=manifest_days - 1)).strftime('%Y-%m-%d')
+    dates = pd.to_datetime(dirlist['date'], format='%m.%d.%Y').dt.strftime('%Y-%m-%d')
+    expected = dirlist['name'][dates >= first_listed].tolist()
+    expected += [name for anomaly in injected if anomaly['date'] >= first_listed for name in anomaly['files']]
+    db_path = write_file_list(os.path.join(directory, 'list.txt'), expected)
+
+    anomalies_path = os.path.join(directory, 'anomalies.json')
+    with open(anomalies_path, 'w') as anomalies_file:
+        json.dump(injected, anomalies_file, indent=1)
+    return {'raw_path': raw_path, 'db_path': db_path, 'anomalies_path': anomalies_path, 'rows': len(dirlist),
+            'last_date': last_day.strftime('%Y-%m-%d')}
+
+
+def write_file_list(path, file_names):
+    """
+    Purpose:
+        Writes a list.txt in the format of DB_filelist.ps1.
+    Args:
+        path (str): output path
+        file_names (list): full file names expected by the database
+    Returns:
+        path
+    """
+    with open(path, 'w') as manifest:
+        manifest.write('\nFileList\n--------\n')
+        manifest.write(';'.join(file_names) + '\n')
+    return path
+
+
+def write_manifest(path, names, date=None):
+    """
+    Purpose:
+        Writes a list.txt in the format of DB_filelist.ps1 listing one file per name.
+    Args:
+        path (str): output path
+        names (list): normalized file names
+        date (datetime): timestamp used in the file name suffix, defaults to now
+    Returns:
+        path
+    """
+    stamp = (date or datetime.today()).strftime('_%Y%m%d%H%M%S.dat')
+    return write_file_list(path, [name + stamp for name in names])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes a synthetic DirList CSV, list.txt and anomalies.json')
+    parser.add_argument('--interfaces', type=int, default=10)
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--files-per-day', type=int, default=6, help='deliveries per file name per weekday')
+    parser.add_argument('--anomalies', type=int, default=20)
+    parser.add_argument('--start', default='2017-01-01')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_data')
+    args = parser.parse_args()
+    dataset = write_dataset(args.output, args.interfaces, args.days, args.files_per_day, args.anomalies,
+                            args.start, args.seed)
+    print(json.dumps(dataset, indent=1))
+
+
+if __name__ == '__main__':
+    main()
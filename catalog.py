@@ -0,0 +1,182 @@
+"""
+Interface Catalog
+---
+Persistent, append-only mapping of every normalized file name to a dense
+integer ID, with its interface code and the rest of its name parsed once
+when the name is first seen. The hourly cube columns and the snapshot
+arrays are indexed by these IDs, and the daily and hourly results hold the
+series of Outlier.ids, the IDs of the file names with rows in the history,
+in ID order. A file name or interface is looked up by array indexing instead
+of matching the interface pattern on every request. IDs are never reused or
+renumbered: a name whose rows left the history keeps its ID and is only left
+out of Outlier.ids. The model store stays keyed by file name, which is as
+stable as the ID and also covers names scored outside the catalog. Stored as
+JSON next to outlier.snapshot.
+"""
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# Interface part of a file name, e.g. SST1771 in SST1771_USC_VEHICLE_HEADER
+INTERFACE_PATTERN = r'([A-Z]{3}[0-9]{4})'
+
+
+def parse_names(names, interface_pattern=INTERFACE_PATTERN):
+    """
+    Purpose:
+        Splits file names into their interface and the rest of the name with
+        vectorized string operations, as Outlier.split_name does for one name.
+    Args:
+        names (list): file names from get_df()
+        interface_pattern (str): regular expression, its first group or whole
+            match is the interface
+    Returns:
+        (interfaces, file_names) lists, the interface is empty if the pattern does not match
+    """
+    names = pd.Series(list(names), dtype=object)
+    if not len(names):
+        return [], []
+    if not re.compile(interface_pattern).groups:
+        interface_pattern = '(' + interface_pattern + ')'
+    interfaces = names.str.extract(interface_pattern, expand=True)[0].fillna('')
+    file_names = names.str.replace(interface_pattern, '', n=1, regex=True)
+    return interfaces.tolist(), file_names.tolist()
+
+
+class InterfaceCatalog(object):
+
+    def __init__(self, path='outlier_catalog.json', interface_pattern=INTERFACE_PATTERN):
+        # A path of None keeps the catalog in memory only
+        self.path = os.path.abspath(path) if path else None
+        self.interface_pattern = interface_pattern
+        # ID -> file name, interface and the rest of the name
+        self.names = []
+        self.interfaces = []
+        self.file_names = []
+        # ID -> position in interface_codes, the distinct interfaces in order of first appearance
+        self.interface_ids = np.zeros(0, dtype=np.int32)
+        self.interface_codes = []
+        self.index = {}
+        self.interface_index = {}
+
+    @classmethod
+    def load(cls, path='outlier_catalog.json', interface_pattern=INTERFACE_PATTERN):
+        """
+        Purpose:
+            Opens a persisted catalog. Names are parsed again, so a changed
+            interface pattern regroups them without changing their IDs.
+        Args:
+            path (str): location of the catalog file
+            interface_pattern (str): see parse_names
+        Returns:
+            InterfaceCatalog, empty if nothing has been persisted yet
+        """
+        catalog = cls(path, interface_pattern)
+        if catalog.path and os.path.isfile(catalog.path):
+            with open(catalog.path) as catalog_file:
+                names = json.load(catalog_file)['names']
+            catalog._append(names, *parse_names(names, interface_pattern))
+        return catalog
+
+    @classmethod
+    def from_arrays(cls, names, interfaces, file_names, path=None, interface_pattern=INTERFACE_PATTERN):
+        """
+        Purpose:
+            Restores a catalog from already parsed arrays, e.g. a snapshot's.
+        Args:
+            names (list): file names in ID order
+            interfaces (list): interface of every name
+            file_names (list): rest of every name
+            path (str): file new names are saved to, None to keep them in memory
+            interface_pattern (str): see parse_names
+        Returns:
+            InterfaceCatalog
+        """
+        catalog = cls(None, interface_pattern)
+        catalog._append(names, interfaces, file_names)
+        catalog.path = os.path.abspath(path) if path else None
+        return catalog
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, names):
+        """
+        Purpose:
+            Assigns the next IDs to the names not in the catalog yet, in the
+            given order, and saves the catalog if any were added.
+        Args:
+            names (iterable): file names from get_df()
+        Returns:
+            self
+        """
+        new_names = [name for name in pd.unique(pd.Series(list(names), dtype=object)) if name not in self.index]
+        if new_names:
+            self._append(new_names, *parse_names(new_names, self.interface_pattern))
+            self.save()
+        return self
+
+    def ids(self, names):
+        """
+        Returns:
+            int32 array of the IDs of names, -1 for names not in the catalog
+        """
+        return pd.Index(self.names).get_indexer(list(names)).astype(np.int32)
+
+    def split(self, name):
+        """
+        Purpose:
+            Looks up the interface and the rest of a file name, parsing names
+            that are not in the catalog.
+        Args:
+            name (str): file name from get_df()
+        Returns:
+            (interface, file_name)
+        """
+        position = self.index.get(name)
+        if position is None:
+            interfaces, file_names = parse_names([name], self.interface_pattern)
+            return interfaces[0], file_names[0]
+        return self.interfaces[position], self.file_names[position]
+
+    def interface_rows(self, interfaces, ids=None):
+        """
+        Purpose:
+            Selects the IDs that belong to a set of interfaces.
+        Args:
+            interfaces (list): interface codes such as SST1771, unknown ones are ignored
+            ids (array): IDs to choose from, defaults to every ID
+        Returns:
+            int64 array of the matching IDs, in the order of ids
+        """
+        ids = np.arange(len(self.names)) if ids is None else np.asarray(ids, dtype=np.int64)
+        wanted = [self.interface_index[code] for code in interfaces if code in self.interface_index]
+        return ids[np.isin(self.interface_ids[ids], wanted)]
+
+    def save(self):
+        """
+        Purpose:
+            Writes the names in ID order to a temporary file and renames it over path.
+        """
+        if self.path is None:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as catalog_file:
+            json.dump({'interface_pattern': self.interface_pattern, 'names': self.names}, catalog_file)
+        os.replace(tmp_path, self.path)
+
+    def _append(self, names, interfaces, file_names):
+        ids = np.empty(len(names), dtype=np.int32)
+        for i, (name, interface) in enumerate(zip(names, interfaces)):
+            self.index[name] = len(self.names) + i
+            if interface not in self.interface_index:
+                self.interface_index[interface] = len(self.interface_codes)
+                self.interface_codes.append(interface)
+            ids[i] = self.interface_index[interface]
+        self.names.extend(names)
+        self.interfaces.extend(interfaces)
+        self.file_names.extend(file_names)
+        self.interface_ids = np.concatenate([self.interface_ids, ids])
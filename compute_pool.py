@@ -0,0 +1,98 @@
+"""
+Bounded Compute Pool
+---
+Runs the CPU-heavy hourly scoring of the Flask routes off the request
+threads, on a fixed number of threads with a bounded number of waiting jobs.
+A request that finds the pool and its queue full is rejected at once with
+ComputeBusy instead of piling up behind the running jobs, and a request whose
+job does not finish within the timeout gets a TimeoutError. A timed out job
+keeps running and stores its models, so a retry is usually answered from the
+model store. Configured with OUTLIER_COMPUTE_THREADS, OUTLIER_COMPUTE_QUEUE
+and OUTLIER_COMPUTE_TIMEOUT (seconds).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from metrics import sampled_call
+
+
+class ComputeBusy(Exception):
+    pass
+
+
+class ComputePool(object):
+
+    def __init__(self, threads=1, queue=8, timeout=30.0):
+        if threads < 1 or queue < 0:
+            raise ValueError('a compute pool needs at least one thread and a non-negative queue')
+        self.threads = threads
+        # Jobs allowed to wait for a thread, further jobs are rejected
+        self.queue = queue
+        # Seconds a request waits for its job
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(threads + queue)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.stats = {'submitted': 0, 'rejected': 0, 'timed_out': 0, 'failed': 0}
+
+    @classmethod
+    def from_environ(cls):
+        """
+        Purpose:
+            Creates the pool from OUTLIER_COMPUTE_THREADS (default 1),
+            OUTLIER_COMPUTE_QUEUE (default 8) and OUTLIER_COMPUTE_TIMEOUT (default 30).
+        Returns:
+            ComputePool
+        """
+        return cls(int(os.environ.get('OUTLIER_COMPUTE_THREADS', 1)), int(os.environ.get('OUTLIER_COMPUTE_QUEUE', 8)),
+                   float(os.environ.get('OUTLIER_COMPUTE_TIMEOUT', 30.0)))
+
+    def run(self, function, *args, profile=None):
+        """
+        Purpose:
+            Runs function(*args) on the pool and waits for its result.
+        Args:
+            function: callable
+            args: its arguments
+            profile: metrics.SlowRequestProfiler.start() result of the request,
+                the pool thread is sampled into it while the job runs
+        Returns:
+            function's result
+        Raises:
+            ComputeBusy if every thread and queue slot is taken,
+            TimeoutError if the result is not ready within the timeout
+        """
+        if not self._slots.acquire(blocking=False):
+            self.stats['rejected'] += 1
+            raise ComputeBusy('%d jobs running or queued' % (self.threads + self.queue))
+        try:
+            future = self._pool().submit(sampled_call, profile, function, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the job ends, also after its request timed out
+        future.add_done_callback(lambda done: self._slots.release())
+        self.stats['submitted'] += 1
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            self.stats['timed_out'] += 1
+            raise
+        except Exception:
+            self.stats['failed'] += 1
+            raise
+
+    def status(self):
+        """
+        Returns:
+            Dictionary with the pool size, queue bound, timeout and job counters
+        """
+        return dict(self.stats, threads=self.threads, queue=self.queue, timeout=self.timeout)
+
+    def _pool(self):
+        # Threads are started on first use
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='outlier-compute')
+            return self._executor
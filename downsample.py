@@ -0,0 +1,87 @@
+"""
+Chart Downsampling
+---
+Reduces long daily series to a point budget for the dashboard charts, either
+by summing calendar weeks or months, or with Largest-Triangle-Three-Buckets
+(LTTB), which keeps the points that shape each line. All series of a window
+are reduced together in one pass over the (series x days) arrays, and
+outlier points are always kept.
+"""
+import numpy as np
+import pandas as pd
+
+# Ways of reducing a window that exceeds its point budget
+AGGREGATES = ('lttb', 'week', 'month')
+# Pandas period of each calendar aggregate, weeks run Monday to Sunday
+PERIODS = {'week': 'W', 'month': 'M'}
+
+
+def lttb_mask(values, points):
+    """
+    Purpose:
+        Picks the Largest-Triangle-Three-Buckets points of every row: the first
+        and the last point, and from each of points - 2 equal buckets in between
+        the point forming the largest triangle with the previously kept point and
+        the average of the next bucket.
+    Args:
+        values (array): (series x points) values
+        points (int): number of points kept per row, at least 3
+    Returns:
+        bool array of the shape of values, True for kept points
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_rows, n_points = values.shape
+    points = max(points, 3)
+    if n_points <= points:
+        return np.ones(values.shape, dtype=bool)
+    keep = np.zeros(values.shape, dtype=bool)
+    keep[:, 0] = keep[:, -1] = True
+    rows = np.arange(n_rows)
+    # points - 2 buckets of at least one point between the first and the last
+    edges = np.linspace(1, n_points - 1, points - 1).astype(np.int64).tolist() + [n_points]
+    previous = np.zeros(n_rows, dtype=np.int64)
+    for low, high, next_high in zip(edges[:-2], edges[1:-1], edges[2:]):
+        next_x = (high + next_high - 1) / 2.0
+        next_y = values[:, high:next_high].mean(axis=1)
+        previous_y = values[rows, previous]
+        x = np.arange(low, high)
+        # Twice the triangle area, the constant factor does not change the choice
+        area = np.abs((previous[:, None] - next_x) * (values[:, low:high] - previous_y[:, None]) -
+                      (previous[:, None] - x) * (next_y - previous_y)[:, None])
+        previous = low + area.argmax(axis=1)
+        keep[rows, previous] = True
+    return keep
+
+
+def calendar_starts(dates, aggregate):
+    """
+    Purpose:
+        Finds where each calendar week or month starts in a run of days.
+    Args:
+        dates (list): consecutive days in YYYY-MM-DD format
+        aggregate (str): 'week' or 'month'
+    Returns:
+        int64 array of the position of the first day of every bucket
+    """
+    periods = pd.DatetimeIndex(dates).to_period(PERIODS[aggregate]).asi8
+    return np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+
+
+def aggregate_calendar(dates, counts, outliers, aggregate):
+    """
+    Purpose:
+        Sums the counts of every calendar week or month, a bucket is an outlier
+        if any of its days is.
+    Args:
+        dates (list): consecutive days in YYYY-MM-DD format
+        counts (array): (series x days) file counts
+        outliers (array): (series x days) outlier flags
+        aggregate (str): 'week' or 'month'
+    Returns:
+        (first day of every bucket, summed counts, outlier flags)
+    """
+    starts = calendar_starts(dates, aggregate)
+    if not counts.size:
+        return [dates[start] for start in starts], counts[:, starts], outliers[:, starts]
+    return ([dates[start] for start in starts], np.add.reduceat(counts, starts, axis=1),
+            np.logical_or.reduceat(outliers, starts, axis=1))
@@ -0,0 +1,98 @@
+"""
+Daily File Features
+---
+Multivariate description of every (file name, day): the number of files,
+their total bytes, the median and the latest arrival time and the weekday,
+built from get_df() with one grouped aggregation. Every feature is scaled by
+the median and median absolute deviation of the file name's days of the same
+weekday, as HourlyProfileScorer does for hourly counts, and the whole
+(file name, day) matrix is labeled in one vectorized pass. A day with the
+usual number of files is still flagged when they are truncated or arrive
+late.
+"""
+import numpy as np
+import pandas as pd
+
+from scorers import MAD_SCALE, WEEKDAYS
+
+FEATURES = ('count', 'bytes', 'median_arrival_hour', 'latest_arrival_minute', 'weekday')
+# Arrival features of days without files: as late as a day allows
+NO_ARRIVAL = {'median_arrival_hour': 24.0, 'latest_arrival_minute': 24 * 60.0}
+# Smallest scale of each scaled feature, so a perfectly regular feature does not flag every change.
+# A dropped last delivery moves the latest arrival back to the previous one, hours earlier
+MIN_SCALE = np.array([1.0, 1.0, 1.0, 4 * 60.0])
+
+
+def daily_features(df, dates, names):
+    """
+    Purpose:
+        Aggregates get_df() rows into one feature vector per file name and day.
+    Args:
+        df (DataFrame): get_df()
+        dates (DatetimeIndex): consecutive days, e.g. daily_counts['date']
+        names (list): file names, in output order
+    Returns:
+        float64 array of shape (names, days, len(FEATURES))
+    """
+    dates = pd.DatetimeIndex(dates)
+    features = np.zeros((len(names), len(dates), len(FEATURES)))
+    features[:, :, FEATURES.index('median_arrival_hour')] = NO_ARRIVAL['median_arrival_hour']
+    features[:, :, FEATURES.index('latest_arrival_minute')] = NO_ARRIVAL['latest_arrival_minute']
+    features[:, :, FEATURES.index('weekday')] = dates.dayofweek.values
+    if df.empty or not len(dates):
+        return features
+
+    grouped = df.groupby([pd.Categorical(df['name'], categories=names), 'date'], observed=True, sort=False)
+    daily = grouped.agg(count=('minute', 'size'), bytes=('size', 'sum'), median_minute=('minute', 'median'),
+                        latest=('minute', 'max'))
+    name_codes = pd.Categorical(daily.index.get_level_values(0), categories=names).codes
+    days = np.asarray((daily.index.get_level_values(1) - dates[0]).days)
+    inside = (days >= 0) & (days < len(dates))
+    name_codes, days, daily = name_codes[inside], days[inside], daily[inside]
+    features[name_codes, days, FEATURES.index('count')] = daily['count'].values
+    features[name_codes, days, FEATURES.index('bytes')] = daily['bytes'].values
+    features[name_codes, days, FEATURES.index('median_arrival_hour')] = daily['median_minute'].values / 60.0
+    features[name_codes, days, FEATURES.index('latest_arrival_minute')] = daily['latest'].values
+    return features
+
+
+def scale_features(features, min_scale=MIN_SCALE):
+    """
+    Purpose:
+        Turns every feature except the weekday into robust z-scores, each file
+        name scaled by the median and median absolute deviation of its own days
+        of the same weekday.
+    Args:
+        features (array): daily_features()
+        min_scale (array): smallest scale of each scaled feature
+    Returns:
+        float64 array of the same shape
+    """
+    scaled = features.copy()
+    weekdays = features[0, :, -1].astype(int) if len(features) else np.zeros(0, dtype=int)
+    for weekday in range(WEEKDAYS):
+        days = weekdays == weekday
+        if not days.any():
+            continue
+        values = features[:, days, :-1]
+        median = np.median(values, axis=1, keepdims=True)
+        scale = np.maximum(np.median(np.abs(values - median), axis=1, keepdims=True) * MAD_SCALE, min_scale)
+        scaled[:, days, :-1] = (values - median) / scale
+    return scaled
+
+
+def score_features(features, threshold=5.0):
+    """
+    Purpose:
+        Labels every (file name, day) with any scaled feature further than
+        threshold from its median.
+    Args:
+        features (array): daily_features()
+        threshold (float): distance in scaled median absolute deviations
+    Returns:
+        bool array of shape (names, days), True for outlier days
+    """
+    n_names, n_days, _ = features.shape
+    if not n_names or not n_days:
+        return np.zeros((n_names, n_days), dtype=bool)
+    return (np.abs(scale_features(features)[:, :, :-1]) > threshold).any(axis=2)
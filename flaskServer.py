@@ -1,243 +1,349 @@
-import cloudpickle
-import numpy as np
-import pandas as pd
-import random
-import re
-import copy
 import os
-from outlier import Outlier
-from datetime import date, datetime, timedelta
-from flask import Flask, render_template, request
-from sklearn.ensemble import IsolationForest
-
-# Generates a Outlier object if none exists in current directory
-if not os.path.isfile("outlier.pickle"):
-    a = Outlier()
-    outlier_file = open('outlier.pickle', 'wb')
-    cloudpickle.dump(a, outlier_file)
-    outlier_file.close()
+import functools
+import gzip
+import time
+import metrics
+from alerts import AlertEvaluator, counter_status
+from compute_pool import ComputeBusy, ComputePool
+from concurrent.futures import TimeoutError
+from model_store import fingerprint
+from response_cache import ResponseCache
+from sources import SourceRegistry
+from datetime import datetime, timedelta, timezone
+from flask import Flask, abort, before_render_template, g, jsonify, make_response, render_template, request, \
+    template_rendered
+
+# Monitored sources from sources.json, or the single default source. Importing the app only
+# maps existing snapshots, missing ones are built by start() or python snapshot.py
+registry = SourceRegistry.load('sources.json')
 
 app = Flask(__name__)
-
-
-@app.route('/')
-def home(chart_id='chart_ID', chart_type='line'):
+# API documents are sent without indentation, also in debug mode
+app.json.compact = True
+# Rendered pages and API documents of the current snapshot of each source
+response_caches = {name: ResponseCache(maxsize=256) for name in registry.sources}
+# Evaluates the counter of every source after each rebuild and once a minute, pushing alerts
+alert_evaluator = AlertEvaluator.from_config(registry, registry.alerts)
+registry.listeners.append(alert_evaluator.submit)
+# Hourly scoring runs on a bounded pool so slow requests cannot take every request thread
+compute_pool = ComputePool.from_environ()
+# Dumps the sampled stacks of requests slower than OUTLIER_PROFILE_SLOW_MS, if set
+profiler = metrics.SlowRequestProfiler.from_environ()
+# Points per series the dashboard asks /api/daily for, longer windows are downsampled. 0 sends every day
+CHART_POINTS = int(os.environ.get('OUTLIER_CHART_POINTS', 120))
+# Cached responses at least this large are also kept gzip compressed for clients that accept it
+COMPRESS_MIN_BYTES = 1024
+
+
+if metrics.ENABLED:
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.ROUTE_SECONDS.observe(time.perf_counter() - g.request_start, route=route,
+                                      method=request.method, status=response.status_code)
+        return response
+
+    @before_render_template.connect_via(app)
+    def start_render_timer(sender, template, context, **extra):
+        g.render_start = time.perf_counter()
+
+    @template_rendered.connect_via(app)
+    def observe_render(sender, template, context, **extra):
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - g.render_start, stage='render')
+
+
+if profiler is not None:
+    @app.before_request
+    def start_profile():
+        g.profile = profiler.start()
+
+    @app.teardown_request
+    def stop_profile(error=None):
+        if 'profile' in g:
+            profiler.stop(g.pop('profile'), request.full_path)
+
+
+@app.errorhandler(ComputeBusy)
+def compute_busy(error):
+    response = jsonify({'error': 'busy', 'message': str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+@app.errorhandler(TimeoutError)
+def compute_timeout(error):
+    response = jsonify({'error': 'timeout', 'message': 'scoring took longer than %ss' % compute_pool.timeout})
+    response.status_code = 504
+    return response
+
+
+def score_hourly(snapshot, date):
     """
     Purpose:
-        Displays Highcharts Outlier data to localhost:8080/
+        Scores a day's hourly outliers, run on the compute pool.
     Args:
-        /?days=### (Optional): How many days in the past to display
-        /?filter= (Optional): all, lower, item_header for specific interfaces
+        snapshot (Snapshot): current snapshot
+        date (str): target date in YYYY-MM-DD format
     Returns:
-        Renders all.html template with Outlier JSON data
-    @TODO:
-        UNCOMMENT OUT IF STATEMENTS IF DEPLOYED TO PRODUCTION
+        SeriesResults
     """
+    with snapshot.scoring_lock:
+        return snapshot.outlier.hourly_results(date, outliers_fraction=.06, n_estimate=24)
 
-    outlier_file = open('outlier.pickle', 'rb')
-    a = cloudpickle.load(outlier_file)
-    # if a.last_updated_hour != datetime.today().hour:
-    #     from outlier import Outlier
-    #     a = Outlier()
-    #     a.last_updated_hour = datetime.today().hour
-    #     outlier_file = open('outlier.pickle', 'wb')
-    #     cloudpickle.dump(a, outlier_file)
-    #     outlier_file.close()
-
-    trainingdf = a.get_df()
-
-    dates = [d.strftime('%Y-%m-%d') for d in
-             pd.date_range(trainingdf['date'][0], trainingdf['date'][len(trainingdf) - 1])]
-
-    # localhost:8080/?days=###, defaults to maximum days
-    days = request.args.get('days', str(len(dates)))
-    # localhost:8080/?filter={all, lower, item_header}, defaults to first interface
-    filter_flag = request.args.get('filter', 'all')
 
-    if days.isdigit():
-        days = int(days)
-        if days > len(dates) or days <= 0:
-            days = len(dates)
-    else:
-        days = len(dates)
-    dates = dates[len(dates) - days:]
-
-    outliers_dictionary = copy.deepcopy(a.outliers_dictionary)
-
-    for series in range(0, len(outliers_dictionary)):
+def requested_interfaces():
+    """
+    Purpose:
+        Reads the interface subset of an API request.
+    Args:
+        ?interface= (Optional): interface names such as SST1771, repeated or comma separated
+    Returns:
+        List of interface names, empty for all interfaces
+    """
+    return [interface for value in request.args.getlist('interface')
+            for interface in value.split(',') if interface]
 
-        min_index = len(outliers_dictionary[series]['data']) - days
 
-        outliers_dictionary[series]['data'] = outliers_dictionary[series]['data'][-days:]
+def cached(params=(), vary=None):
+    """
+    Purpose:
+        Serves a view from the response cache. Responses are keyed on the route,
+        the listed query arguments and the snapshot version, carry an ETag and
+        Last-Modified, and conditional requests are answered with 304 before
+        the view runs. Large responses are sent gzip compressed to clients that
+        accept it, compressed once per cache entry. The ?source= argument selects the source, whose name is
+        set as g.source, and the view is called with its snapshot as first argument.
+    Args:
+        params (tuple): query arguments the view reads, others do not split the cache
+        vary: callable taking the snapshot and returning other inputs of the view,
+            such as the current hour
+    Returns:
+        Decorator
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                g.source = registry.resolve(request.args.get('source'))
+            except KeyError:
+                abort(404)
+            snapshot = registry.snapshots[g.source].get()
+            response_cache = response_caches[g.source]
+            key = (g.source, request.path, tuple((param, tuple(request.args.getlist(param))) for param in params),
+                   vary(snapshot) if vary else None)
+            accepts_gzip = request.accept_encodings.quality('gzip') > 0
+            # Compressed and plain bodies are different representations with their own ETag
+            etag = fingerprint(snapshot.version, key) + ('-gzip' if accepts_gzip else '')
+            if etag in request.if_none_match:
+                response_cache.revalidated()
+                response = app.response_class(status=304)
+            else:
+                entry = response_cache.get(snapshot.version, key)
+                if entry is None:
+                    response = make_response(view(snapshot, *args, **kwargs))
+                    if response.status_code == 200:
+                        data = response.get_data()
+                        entry = (data, response.mimetype,
+                                 gzip.compress(data, 6) if len(data) >= COMPRESS_MIN_BYTES else None)
+                        response_cache.put(snapshot.version, key, entry)
+                else:
+                    response = app.response_class(entry[0], mimetype=entry[1])
+                if accepts_gzip and entry is not None and entry[2] is not None:
+                    response.set_data(entry[2])
+                    response.headers['Content-Encoding'] = 'gzip'
+            response.vary.add('Accept-Encoding')
+            response.set_etag(etag)
+            response.last_modified = datetime.fromtimestamp(snapshot.version[0] / 1e9, timezone.utc)
+            # Clients may keep the response but must revalidate it
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+def requested_date(snapshot):
+    """
+    Returns:
+        The validated ?date= argument, today if it is missing or invalid
+    """
+    return snapshot.outlier.validate_date(request.args.get('date'))
 
-        for outlier in range(0, len(outliers_dictionary[series]['number_of_outliers'])):
-            outliers_dictionary[series]['number_of_outliers'][outlier] -= min_index
-        outliers_dictionary[series]['number_of_outliers'] = [
-            x for x in outliers_dictionary[series]['number_of_outliers'] if x >= 0]
 
-    series_list = [{'name': outliers_dictionary[i]['interface'] + outliers_dictionary[i]
-                    ['file_name'], 'data': outliers_dictionary[i]['data']} for i in range(len(outliers_dictionary))]
-    outliers_list = [outliers_dictionary[i]['number_of_outliers']
-                     for i in range(len(outliers_dictionary))]
+def previous_hour(snapshot):
+    """
+    Returns:
+        The last complete hour in YYYY-MM-DD HH format
+    """
+    return (datetime.now() - timedelta(hours=1)).strftime('%Y-%m-%d %H')
 
-    series = series_list
-    title = {"text": 'All SST Feeds'}
-    xAxis = {"categories": dates}
-    yAxis = {"title": {"text": 'File Count'}}
-    chart = {"type": chart_type,
-             "series": series_list, "xAxis": xAxis,
-             "yAxis": yAxis, "title": title}
 
-    outlier_file.close()
-    return render_template('all.html', chart_id=chart_id, chart=chart,
-                           series=series, title=title, xAxis=xAxis,
-                           yAxis=yAxis, outliers=outliers_list,
-                           filter_flag="\"" + filter_flag + "\"")
+@app.route('/')
+@cached(params=('days', 'filter', 'aggregate'))
+def home(snapshot, chart_id='chart_ID', chart_type='line'):
+    """
+    Purpose:
+        Displays Highcharts Outlier data to localhost:8080/, the series are
+        fetched from /api/daily with a budget of CHART_POINTS points
+    Args:
+        /?days=### (Optional): How many days in the past to display
+        /?filter= (Optional): all, lower, item_header for specific interfaces
+        /?aggregate= (Optional): lttb (default), week or month, how long windows are reduced
+        /?source= (Optional): source name from sources.json, defaults to the first
+    Returns:
+        Renders all.html template
+    """
+    return render_template('all.html', chart_id=chart_id, chart_type=chart_type,
+                           days=request.args.get('days', ''),
+                           filter_flag=request.args.get('filter', 'all'),
+                           points=CHART_POINTS, aggregate=request.args.get('aggregate', 'lttb'))
 
 
 @app.route('/date')
-def date_page():
+@cached(vary=requested_date)
+def date_page(snapshot):
     """
     Purpose:
-        Displays Highcharts outliers for a specific day per hour
+        Displays Highcharts outliers for a specific day per hour, the series
+        are fetched from /api/hourly
     Args:
         /date?date=YYYY-MM-DD: If invalid date format, defaults to today
+        /date?source= (Optional): source name from sources.json, defaults to the first
     Returns: 
-        Renders hourly.html template with Outlier JSON data
+        Renders hourly.html template
     """
+    return render_template('hourly.html', date=requested_date(snapshot))
 
-    outlier_file = open('outlier.pickle', 'rb')
-    a = cloudpickle.load(outlier_file)
 
-    # if (a.last_updated_hour != datetime.today().hour) | (a.full_hour_traindata == ''):
-    #     a = Outlier()
-    #     a.last_updated_hour = datetime.today().hour
-    #     a.full_hour_traindata = a.create_full_hour_traindata(a.trainingdf)
-    #     outlier_file = open('outlier.pickle', 'wb')
-    #     cloudpickle.dump(a, outlier_file)
-    #     outlier_file.close()
+@app.route('/counter')
+@cached()
+def counter(snapshot):
+    """
+    Purpose:
+        Displays numbers of days since last outlier and if any files are missing
+        from the DB, fetched from /api/counter
+    """
+    return render_template('counter.html')
 
-    raw_data = a.trainingdf
 
-    date = a.validate_date(request.args.get('date'))
-    calculated_day_data = a.hourly_to_json(
-        a.hourly_df(date, raw_data), raw_data, date)
+@app.route('/api/daily')
+@cached(params=('days', 'filter', 'interface', 'model', 'points', 'aggregate'))
+def api_daily(snapshot):
+    """
+    Purpose:
+        Daily file counts and outliers per file name.
+    Args:
+        /api/daily?days=### (Optional): How many days in the past to return
+        /api/daily?filter= (Optional): all, lower, item_header
+        /api/daily?interface= (Optional): interfaces to return, e.g. SST1771,SST1862
+        /api/daily?model=features (Optional): outliers of the file count, bytes and
+            arrival time features instead of the file count alone
+        /api/daily?points=### (Optional): point budget per series, longer windows are reduced
+        /api/daily?aggregate= (Optional): lttb (default) keeps the points that shape each
+            line and lists their day positions as x, week or month sum calendar buckets.
+            Outliers are always kept
+        /api/daily?source= (Optional): source name from sources.json, defaults to the first
+    Returns:
+        JSON with categories (dates) and series of name, interface, file_name,
+        data and outliers (positions in data)
+    """
+    results = snapshot.outlier.daily_results
+    if request.args.get('model') == 'features':
+        results = snapshot.outlier.feature_results
+        if results is None:
+            abort(404)
+    points = request.args.get('points', '')
+    return jsonify(results.to_json(request.args.get('days'), request.args.get('filter', 'all'),
+                                   requested_interfaces(), int(points) if points.isdigit() else None,
+                                   request.args.get('aggregate', 'lttb')))
+
+
+@app.route('/api/hourly')
+@cached(params=('filter', 'interface'), vary=requested_date)
+def api_hourly(snapshot):
+    """
+    Purpose:
+        Hourly file counts and outliers per file name for a day.
+    Args:
+        /api/hourly?date=YYYY-MM-DD: If invalid date format, defaults to today
+        /api/hourly?filter= (Optional): all, lower, item_header
+        /api/hourly?interface= (Optional): interfaces to return, e.g. SST1771,SST1862
+        /api/hourly?source= (Optional): source name from sources.json, defaults to the first
+    Returns:
+        JSON with categories (hours), date, weekday and series as in /api/daily
+    """
+    date = requested_date(snapshot)
+    results = compute_pool.run(score_hourly, snapshot, date, profile=g.get('profile'))
+    document = results.to_json(None, request.args.get('filter', 'all'), requested_interfaces())
+    document.update({'date': date, 'weekday': datetime.strptime(date, '%Y-%m-%d').weekday()})
+    return jsonify(document)
 
-    outlier_dic_list = a.get_hourly_outliers(
-        date, outliers_fraction=.06, n_estimate=24)
 
-    outliers_list = [i['number_of_outliers'] for i in outlier_dic_list]
+@app.route('/api/counter')
+@cached(vary=previous_hour)
+def api_counter(snapshot):
+    """
+    Purpose:
+        Days since the last outlier day, status of the previous hour and
+        files missing from the DB.
+    Returns:
+        JSON with count, anomaly, anomaly_flag, date, hour, percent and files
+    """
+    return jsonify(compute_pool.run(counter_status, snapshot, profile=g.get('profile')))
 
-    xAxis = {"categories": ['00:00', '01:00', '02:00', '03:00', '04:00',
-                            '05:00', '06:00', '07:00', '08:00', '09:00',
-                            '10:00', '11:00', '12:00', '13:00', '14:00',
-                            '15:00', '16:00', '17:00', '18:00', '19:00',
-                            '20:00', '21:00', '22:00', '23:00']}
 
-    yAxis = {"title": {"text": 'File count'}}
-    title = str(date)
+@app.route('/metrics')
+def metrics_page():
+    """
+    Purpose:
+        Exposes route latency and pipeline stage histograms, fitted and reused
+        model counters and per source gauges for Prometheus.
+    Returns:
+        Prometheus text exposition format
+    """
+    for name in registry.sources:
+        snapshot = registry.snapshots[name].get()
+        metrics.HISTORY_ROWS.set(snapshot.outlier.row_count, source=name)
+        metrics.INTERFACES.set(len(set(snapshot.outlier.daily_results.interfaces)), source=name)
+        metrics.FILE_NAMES.set(len(snapshot.outlier.daily_results.file_names), source=name)
+        metrics.SNAPSHOT_AGE.set(time.time() - snapshot.version[0] / 1e9, source=name)
+    return app.response_class(metrics.REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
-    chart = {"type": 'lines',
-             "series": calculated_day_data['series_list'], "xAxis": xAxis,
-             "yAxis": yAxis, "title": title}
 
-    return render_template('hourly.html',
-                           calculated_day_date=calculated_day_data,
-                           series=calculated_day_data['series_list'],
-                           date=[str(date)],
-                           chart=chart,
-                           outliers=outliers_list
-                           )
+@app.route('/status')
+def status():
+    """
+    Purpose:
+        Reports the last snapshot build time, build duration, staleness, the
+        response cache counters and the latest hourly check of every source,
+        the alert counters and the compute pool counters.
+    Returns:
+        JSON status of each source's refresher and response cache
+    """
+    status = registry.status()
+    for name in status:
+        status[name]['response_cache'] = response_caches[name].stats()
+        status[name]['hourly_check'] = alert_evaluator.states.get(name)
+    status['alerts'] = alert_evaluator.status()
+    status['compute'] = compute_pool.status()
+    return jsonify(status)
 
 
-@app.route('/counter')
-def counter():
+def start():
     """
     Purpose:
-        Displays numbers of days since last outlier and if any files are missing from the DB.
-    """
-
-    outlier_file = open('outlier.pickle', 'rb')
-    a = cloudpickle.load(outlier_file)
-
-    # if (a.last_updated_hour != datetime.today().hour) | (a.full_hour_traindata == ''):
-    #     a = Outlier()
-    #     a.last_updated_hour = datetime.today().hour
-    #     a.full_hour_traindata = a.create_full_hour_traindata(a.trainingdf)
-    #     outlier_file = open('outlier.pickle', 'wb')
-    #     cloudpickle.dump(a, outlier_file)
-    #     outlier_file.close()
-
-    df = a.get_df()
-    outliers_dictionary = copy.deepcopy(a.outliers_dictionary)
-
-    outliers_list = [outliers_dictionary[i]['number_of_outliers']
-                     for i in range(len(outliers_dictionary))]
-    combined_outlier_list = sum(outliers_list, [])
-    is_outlier_day_list = []
-    temp_percents = []
-    count = 0
-
-    # days_length = max(combined_outlier_list)
-    days_length = (df['date'][len(df['date']) - 1] - df['date'][0]).days
-    for e in range(0, days_length):
-        temp = combined_outlier_list.count(e) / len(outliers_list)
-        temp_percents.append(temp)
-        if temp >= .2:
-            is_outlier_day_list.append(1)
-        else:
-            is_outlier_day_list.append(0)
-    for w in reversed(is_outlier_day_list):
-        if w == 0:
-            count += 1
-        else:
-            break
-
-    date = datetime.today().strftime('%Y-%m-%d')
-
-    outlier_dic_list = a.get_hourly_outliers(
-        date, outliers_fraction=.06, n_estimate=24)
-
-    outliers_list = [i['number_of_outliers'] for i in outlier_dic_list]
-
-    hour_now = datetime.now().hour - 1
-
-    db_filelist = a.check_DB()
-    if len(db_filelist) == 0:
-        files = 0
-    else:
-        files = str(db_filelist)
-
-    if datetime.now().hour == 0:
-        date = datetime.today().strftime('%Y-%m-%d') - datetime.timedelta(days=1)
-        hour_now = 23
-
-    counter = 0
-    for i in outliers_list:
-        for x in i:
-            if x == hour_now:
-                counter += 1
-
-    percent = counter / len(outliers_list)
-
-    if percent >= 0.35:
-        # print("Current hour " + str(hour_now) + " is an anomaly")
-        anomaly = "Interface anomaly between " + str(hour_now) + ":00 - " + str(
-            hour_now + 1) + ":00 detected, please check the files."
-        anomaly_flag = 1
-    else:
-        # print("Current hour " + str(hour_now) + " is okay")
-        anomaly = "Between " + \
-            str(hour_now) + ":00 - " + str(hour_now + 1) + \
-            ":00 interface status is normal."
-        anomaly_flag = 0
-
-    outlier_file.close()
-
-    return render_template('counter.html', count=count,
-                           anomaly="\"" + anomaly + "\"",
-                           anomaly_flag=anomaly_flag, files=files)
+        Builds or converts the snapshot of every source that has none yet and
+        starts the refresher and alert threads of the serving process.
+    """
+    registry.ensure_snapshots()
+    alert_evaluator.start()
+    registry.start()
 
 
 if __name__ == "__main__":
+    start()
     app.run(host='0.0.0.0', port=8080)
@@ -0,0 +1,137 @@
+"""
+Columnar History Store
+---
+Day-partitioned Parquet store of normalized DirList rows with typed columns:
+date (datetime64), hour (int8), minute (int16), size (int64) and name
+(categorical). Each CSV snapshot only rewrites the days whose rows changed,
+days that are no longer in the CSV are kept, and the whole history is read
+back in one call. A store without a path keeps the day partitions in
+memory instead. Requires pyarrow.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['date', 'hour', 'minute', 'size', 'name']
+
+
+class HistoryStore(object):
+
+    def __init__(self, path='outlier_history'):
+        # A path of None keeps the history in memory only
+        self.path = os.path.abspath(path) if path else None
+        self.manifest_path = os.path.join(self.path, 'manifest.json') if path else None
+        # Day (YYYY-MM-DD) -> digest of the rows stored for that day
+        self.digests = {}
+        # Day (YYYY-MM-DD) -> typed rows of that day, only for a store kept in memory
+        self.frames = {}
+
+    @classmethod
+    def load(cls, path='outlier_history'):
+        """
+        Purpose:
+            Opens a store, creating its directory if needed.
+        Args:
+            path (str): directory of the day partitions
+        Returns:
+            HistoryStore
+        """
+        store = cls(path)
+        if store.path is None:
+            return store
+        if not os.path.isdir(store.path):
+            os.makedirs(store.path)
+        if os.path.isfile(store.manifest_path):
+            with open(store.manifest_path) as manifest_file:
+                store.digests = json.load(manifest_file)
+        return store
+
+    @property
+    def days(self):
+        """
+        Returns:
+            Sorted list of the stored days in YYYY-MM-DD format
+        """
+        return sorted(self.digests)
+
+    def update(self, frame):
+        """
+        Purpose:
+            Appends a CSV snapshot, rewriting only the days whose rows changed.
+        Args:
+            frame (DataFrame): DirListIngestor.frame, get_df() rows with a row_hash column
+        Returns:
+            List of the days that were written
+        """
+        if frame.empty:
+            return []
+        frame = frame.sort_values('date', kind='mergesort')
+        dates = frame['date'].values
+        starts = np.flatnonzero(np.r_[True, dates[1:] != dates[:-1]])
+        hashes = frame['row_hash'].values.astype(np.uint64)
+        # Order independent digest of each day's rows: row count and xor of their line hashes
+        xors = np.bitwise_xor.reduceat(hashes, starts)
+        sizes = np.diff(np.r_[starts, len(frame)])
+        days = pd.DatetimeIndex(dates[starts]).strftime('%Y-%m-%d')
+
+        written = []
+        for day, start, size, xor in zip(days, starts, sizes, xors):
+            digest = '%d:%016x' % (size, xor)
+            if self.digests.get(day) == digest:
+                continue
+            self._write_day(day, self.typed(frame.iloc[start:start + size]))
+            self.digests[day] = digest
+            written.append(day)
+        if written and self.path is not None:
+            tmp_path = self.manifest_path + '.tmp'
+            with open(tmp_path, 'w') as manifest_file:
+                json.dump(self.digests, manifest_file)
+            os.replace(tmp_path, self.manifest_path)
+        return written
+
+    def read(self, start=None, end=None):
+        """
+        Purpose:
+            Reads the stored history, optionally limited to a range of days.
+        Args:
+            start (str): first day in YYYY-MM-DD format, defaults to the first stored day
+            end (str): last day in YYYY-MM-DD format, defaults to the last stored day
+        Returns:
+            DataFrame with columns: date, hour, minute, size, name sorted by date
+        """
+        days = [day for day in self.days if (start is None or day >= start) and (end is None or day <= end)]
+        if not days:
+            return self.typed(pd.DataFrame({column: [] for column in COLUMNS}))
+        if self.path is None:
+            return self.typed(pd.concat([self.frames[day] for day in days], ignore_index=True))
+        frame = pd.read_parquet([self._day_path(day) for day in days])
+        return frame[COLUMNS]
+
+    def typed(self, frame):
+        """
+        Purpose:
+            Converts get_df() rows to the store's column types.
+        Args:
+            frame (DataFrame): get_df() rows
+        Returns:
+            DataFrame with columns: date, hour, minute, size, name
+        """
+        return pd.DataFrame({'date': pd.to_datetime(frame['date'].values),
+                             'hour': np.asarray(frame['hour'], dtype=np.int8),
+                             'minute': np.asarray(frame['minute'], dtype=np.int16),
+                             'size': np.asarray(frame['size'], dtype=np.int64),
+                             'name': frame['name'].astype('category').cat.remove_unused_categories().values},
+                            columns=COLUMNS)
+
+    def _day_path(self, day):
+        return os.path.join(self.path, day + '.parquet')
+
+    def _write_day(self, day, frame):
+        if self.path is None:
+            self.frames[day] = frame
+            return
+        tmp_path = self._day_path(day) + '.tmp'
+        frame.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self._day_path(day))
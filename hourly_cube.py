@@ -0,0 +1,317 @@
+"""
+Hourly File Count Cube
+---
+Dense (date x hour x file name) array of file counts built from get_df() with
+a single grouped count. The counts are stored as raw int32 bytes with a JSON
+header next to outlier.snapshot, and the file is memory-mapped on load. Only
+new days and days whose rows changed are counted, but every save writes a
+new generation of the count file and then renames the header over the old
+one, so a file that a snapshot or a serving process has mapped is never
+changed and a header always matches the counts it names.
+"""
+import glob
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+HOURS = 24
+DTYPE = np.int32
+
+
+class HourlyCube(object):
+
+    def __init__(self, path='outlier_hourly.bin'):
+        # A path of None keeps the cube in memory only
+        self.path = os.path.abspath(path) if path else None
+        self.meta_path = os.path.splitext(self.path)[0] + '.json' if path else None
+        # Count file generation named by the header, see _save
+        self.generation = 0
+        # Identifies the counts, renewed by every update that counts days
+        self.version = None
+        # Days recounted by the last update, see update
+        self.delta = None
+        self.start = None
+        self.names = []
+        self.name_index = {}
+        self.counts = np.zeros((0, HOURS, 0), dtype=DTYPE)
+
+    @classmethod
+    def load(cls, path='outlier_hourly.bin'):
+        """
+        Purpose:
+            Opens a persisted cube, memory-mapping its counts.
+        Args:
+            path (str): location of the count file
+        Returns:
+            HourlyCube, empty if nothing has been persisted yet
+        """
+        cube = cls(path)
+        if cube.path is not None and os.path.isfile(cube.meta_path):
+            cube._open()
+        return cube
+
+    @classmethod
+    def from_df(cls, df):
+        """
+        Purpose:
+            Builds an in-memory cube for an arbitrary get_df() DataFrame.
+        Args:
+            df (DataFrame): get_df()
+        Returns:
+            HourlyCube that is not persisted
+        """
+        return cls(None).update(df)
+
+    @property
+    def dates(self):
+        """
+        Returns:
+            DatetimeIndex of the days held in the cube
+        """
+        if self.start is None:
+            return pd.DatetimeIndex([])
+        return pd.date_range(self.start, periods=len(self.counts))
+
+    def update(self, df, names=None, days=None):
+        """
+        Purpose:
+            Brings the cube up to date with df. The last stored day, which may
+            have been partial, the days after it and the given changed days are
+            counted, unless df starts before the cube, which rebuilds it, or adds
+            file names, which widens the stored history. The result is saved as
+            a new generation, and delta records the recounted days for state
+            kept in step with the cube, such as the hourly profiles: the version
+            they were counted on top of, their dates, and the counts they
+            replaced and now hold. It is None after a full count or when nothing
+            was counted.
+        Args:
+            df (DataFrame): get_df()
+            names (list): every file name in column order, e.g. InterfaceCatalog.names,
+                defaults to the stored names followed by the new ones of df
+            days (list): earlier days whose rows changed, e.g. the days
+                HistoryStore.update wrote for a late row
+        Returns:
+            self
+        """
+        self.delta = None
+        if df.empty:
+            return self
+        previous_version = self.version
+        first_day = df['date'].min()
+        last_day = df['date'].max()
+        if names is None:
+            new_names = [name for name in df['name'].unique() if name not in self.name_index]
+        else:
+            if list(names[:len(self.names)]) != self.names:
+                # The stored columns do not follow names, the history is counted again
+                self.start = None
+                self._set_names([])
+            new_names = list(names[len(self.names):])
+
+        full = self.start is None or first_day < self.start
+        if full:
+            self.start = first_day
+            self.counts = np.zeros((0, HOURS, len(self.names) + len(new_names)), dtype=DTYPE)
+        elif new_names:
+            # New file names widen every stored day, so the file is rewritten
+            padding = np.zeros(self.counts.shape[:2] + (len(new_names),), dtype=DTYPE)
+            self.counts = np.concatenate([self.counts, padding], axis=2)
+        self._set_names(self.names + new_names)
+        resume = max(len(self.counts) - 1, 0)
+
+        n_days = (last_day - self.start).days + 1
+        tail = list(range(resume, n_days))
+        # Stored days before the last one are only recounted when their rows changed
+        stale = []
+        if not full and days is not None and len(days):
+            stale = (pd.DatetimeIndex(pd.to_datetime(list(days))).normalize() - self.start).days
+            stale = sorted(set(stale[(stale >= 0) & (stale < resume)].tolist()))
+        if not tail and not stale:
+            return self
+        recount = stale + tail
+        block = self._count(df, recount)
+        kept = self.counts[:resume] if tail else self.counts
+        if stale:
+            kept = np.array(kept)
+            kept[stale] = block[:len(stale)]
+        if not full:
+            # The recounted days that were stored come first, as delta['removed'] holds them
+            stored = [day for day in recount if day < len(self.counts)]
+            self.delta = {'since': previous_version, 'dates': self.start + pd.to_timedelta(recount, unit='D'),
+                          'removed': np.array(self.counts[stored]), 'added': block}
+        self.version = uuid.uuid4().hex
+        if self.path is None:
+            self.counts = np.concatenate([kept, block[len(stale):]])
+        else:
+            self._save(kept, block[len(stale):], len(kept) + len(tail))
+        return self
+
+    def day(self, date):
+        """
+        Purpose:
+            Returns the hour x name counts of a single day.
+        Args:
+            date (str or datetime): target date
+        Returns:
+            Array of shape (24, names), zeros for days outside the cube
+        """
+        index = self.day_index(date)
+        if index is None:
+            return np.zeros((HOURS, len(self.names)), dtype=DTYPE)
+        return self.counts[index]
+
+    def day_index(self, date):
+        """
+        Returns:
+            Position of date along the first axis, or None if it is not held
+        """
+        if self.start is None:
+            return None
+        index = (pd.Timestamp(date).normalize() - self.start).days
+        if 0 <= index < len(self.counts):
+            return index
+        return None
+
+    def training_rows(self, name):
+        """
+        Purpose:
+            Returns every stored hour of a file name as model input rows.
+        Args:
+            name (str): file name from get_df()
+        Returns:
+            Array of [day of week, hour, file count] rows, ordered by date then hour
+        """
+        return next(self.iter_training_rows([name]))
+
+    def iter_training_rows(self, names):
+        """
+        Purpose:
+            Yields training_rows for each name, sharing the day of week and hour columns.
+        Args:
+            names (list): file names from get_df()
+        Returns:
+            Generator of arrays of [day of week, hour, file count] rows
+        """
+        return self.iter_training_columns(self.name_index[name] for name in names)
+
+    def iter_training_columns(self, columns):
+        """
+        Purpose:
+            Yields training_rows for each column, e.g. InterfaceCatalog IDs.
+        Args:
+            columns (iterable): positions along the last axis
+        Returns:
+            Generator of arrays of [day of week, hour, file count] rows
+        """
+        weekdays = np.repeat(self.dates.dayofweek.values, HOURS)
+        hours = np.tile(np.arange(HOURS), len(self.counts))
+        for column in columns:
+            yield np.column_stack([weekdays, hours, self.counts[:, :, column].ravel()])
+
+    def block_rows(self, dates, block, column):
+        """
+        Purpose:
+            Returns a column of a block of days, such as delta['added'], as model input rows.
+        Args:
+            dates (DatetimeIndex): days of the block, at least as many as it holds
+            block (array): (days x 24 x names) counts
+            column (int): position along the last axis
+        Returns:
+            Array of [day of week, hour, file count] rows, ordered by date then hour
+        """
+        weekdays = np.repeat(dates.dayofweek.values[:len(block)], HOURS)
+        return np.column_stack([weekdays, np.tile(np.arange(HOURS), len(block)), block[:, :, column].ravel()])
+
+    def _count(self, df, days):
+        # Dense grouped count over the flattened (day, hour, name) key of the
+        # rows on the given sorted day positions
+        if days[0] > 0:
+            df = df[df['date'] >= self.start + pd.Timedelta(days=days[0])]
+        day = (df['date'] - self.start).dt.days.values
+        positions = np.full(days[-1] + 2, -1)
+        positions[days] = np.arange(len(days))
+        # Rows after the last recounted day map to its -1 sentinel
+        day = positions[np.minimum(day, days[-1] + 1)]
+        recounted = day >= 0
+        hour = df['hour'].astype(int).values[recounted]
+        name = pd.Categorical(df['name'], categories=self.names).codes[recounted]
+        key = (day[recounted] * HOURS + hour) * len(self.names) + name
+        counts = np.bincount(key, minlength=len(days) * HOURS * len(self.names))
+        return counts.reshape(len(days), HOURS, len(self.names)).astype(DTYPE)
+
+    def _set_names(self, names):
+        self.names = list(names)
+        self.name_index = {name: i for i, name in enumerate(self.names)}
+
+    def _open(self, attempts=3):
+        for attempt in range(attempts):
+            with open(self.meta_path) as meta_file:
+                meta = json.load(meta_file)
+            # Headers written before generations name no file, their counts are at path
+            data_path = os.path.join(os.path.dirname(self.path), meta.get('file', os.path.basename(self.path)))
+            if os.path.isfile(data_path) or not (meta['days'] and meta['names']):
+                break
+            # A newer save removed the generation between reading the header and mapping it
+            time.sleep(.05)
+        self.generation = meta.get('generation', 0)
+        self.version = meta.get('version')
+        self.start = pd.Timestamp(meta['start'])
+        self._set_names(meta['names'])
+        shape = (meta['days'], HOURS, len(self.names))
+        if meta['days'] and self.names:
+            self.counts = np.memmap(data_path, dtype=DTYPE, mode='r', shape=shape)
+        else:
+            self.counts = np.zeros(shape, dtype=DTYPE)
+
+    def _save(self, stored, block, n_days):
+        # The counts go to a file no process has mapped yet and the header is
+        # renamed over the old one last, readers see either generation whole
+        generation = self.generation + 1
+        root, extension = os.path.splitext(self.path)
+        data_path = '%s.%d%s' % (root, generation, extension)
+        tmp_path = data_path + '.tmp'
+        with open(tmp_path, 'wb') as count_file:
+            count_file.write(np.ascontiguousarray(stored).tobytes())
+            count_file.write(np.ascontiguousarray(block).tobytes())
+        os.replace(tmp_path, data_path)
+        meta = {'start': self.start.strftime('%Y-%m-%d'), 'days': n_days, 'names': self.names,
+                'generation': generation, 'file': os.path.basename(data_path), 'version': self.version}
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(tmp_path, self.meta_path)
+        self._open()
+        self._remove_generations(generation - 1)
+
+    def _remove_generations(self, keep):
+        # Generations before keep are no longer named by any header. Open mappings
+        # stay valid on POSIX, where the file is mapped elsewhere it is removed by a later save
+        root, extension = os.path.splitext(self.path)
+        stale = [self.path] if os.path.isfile(self.meta_path) else []
+        for data_path in glob.glob(glob.escape(root) + '.*' + extension):
+            generation = data_path[len(root) + 1:-len(extension) or None]
+            if generation.isdigit() and int(generation) < keep:
+                stale.append(data_path)
+        for data_path in stale:
+            try:
+                os.remove(data_path)
+            except OSError:
+                pass
+
+    def __getstate__(self):
+        # Persisted cubes are re-mapped from disk instead of being pickled
+        state = self.__dict__.copy()
+        if self.path is not None:
+            state['counts'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.counts is None:
+            self.counts = np.zeros((0, HOURS, len(self.names)), dtype=DTYPE)
+            if self.path is not None and os.path.isfile(self.meta_path):
+                self._open()
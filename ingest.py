@@ -0,0 +1,173 @@
+"""
+Incremental DirList Ingestion
+---
+Keeps the normalized rows of a DirList CSV in memory together with a
+checkpoint of the file (path, identity, size, parsed offset and a hash of
+every parsed line), so that each read only parses rows that are new:
+    * appended rows are read from the checkpoint offset,
+    * a rewritten file, as CSVGetter.ps1 produces every 5 minutes, is diffed
+      line by line and only unknown lines are parsed,
+    * a truncated file, which lost most known rows, or a rotated file (new
+      DirList_MM_dd_yyyy name) is reparsed in full.
+"""
+import hashlib
+import io
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from metrics import ROWS_INGESTED
+
+# Bytes before the checkpoint offset compared to detect an append-only change
+SIGNATURE_BYTES = 65536
+
+
+def concat_rows(frames):
+    """
+    Purpose:
+        Concatenates normalized row blocks, merging the categories of categorical
+        columns so they are not widened to object columns.
+    Args:
+        frames (list): DataFrames with the same columns
+    Returns:
+        DataFrame
+    """
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype) and len(frames) > 1:
+            categories = union_categoricals([frame[column] for frame in frames]).categories
+            frames = [frame.assign(**{column: frame[column].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+class DirListIngestor(object):
+
+    def __init__(self, normalize, chunksize=200000, observers=None):
+        # Function turning a raw CSV DataFrame into get_df() format, extra columns are kept
+        self.normalize = normalize
+        self.chunksize = chunksize
+        # Functions called with every block of newly parsed raw rows, e.g. ManifestIndex.observe
+        self.observers = list(observers or [])
+        self.checkpoint = None
+        self.checkpoint_offset = 0
+        # Sorted hashes of every parsed line, also the ones the name filter dropped
+        self.checkpoint_hashes = np.zeros(0, dtype=np.uint64)
+        self.frame = None
+        self.stats = {'full': 0, 'appended': 0, 'diffed': 0, 'unchanged': 0, 'parsed_rows': 0}
+
+    def read(self, path):
+        """
+        Purpose:
+            Brings the in-memory rows up to date with the CSV at path.
+        Args:
+            path (str): DirList CSV
+        Returns:
+            DataFrame in get_df() format sorted by date
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        checkpoint = self.checkpoint
+        with open(path, 'rb') as csv_file:
+            header = csv_file.readline()
+            if checkpoint is None or checkpoint['path'] != path:
+                self._full(csv_file, header)
+            elif (stat.st_size, stat.st_mtime_ns, stat.st_ino) == \
+                    (checkpoint['size'], checkpoint['mtime'], checkpoint['inode']):
+                self.stats['unchanged'] += 1
+            elif self._signature(csv_file, header, checkpoint['offset']) == checkpoint['signature']:
+                self._append(csv_file, checkpoint['offset'], header)
+            else:
+                self._diff(csv_file, header)
+            offset = self.checkpoint_offset
+            self.checkpoint = {'path': path, 'inode': stat.st_ino, 'size': stat.st_size,
+                               'mtime': stat.st_mtime_ns, 'offset': offset,
+                               'signature': self._signature(csv_file, header, offset)}
+        return self.frame.drop(columns='row_hash')
+
+    def poll(self):
+        """
+        Purpose:
+            CSV changes are detected from the file's stamp, see refresher.Refresher.
+        Returns:
+            None
+        """
+        return None
+
+    def _full(self, csv_file, header):
+        csv_file.seek(len(header))
+        lines, self.checkpoint_offset = self._lines(csv_file.read(), len(header), True)
+        hashes = self._hash(lines)
+        self.frame = self._sort(self._parse(header, lines, hashes))
+        self.checkpoint_hashes = np.sort(hashes)
+        self.stats['full'] += 1
+
+    def _append(self, csv_file, offset, header):
+        csv_file.seek(offset)
+        lines, self.checkpoint_offset = self._lines(csv_file.read(), offset, False)
+        if lines:
+            hashes = self._hash(lines)
+            new_rows = self._parse(header, lines, hashes)
+            self.frame = self._sort(concat_rows([self.frame, new_rows]))
+            self.checkpoint_hashes = np.sort(np.concatenate([self.checkpoint_hashes, hashes]))
+        self.stats['appended'] += 1
+
+    def _diff(self, csv_file, header):
+        csv_file.seek(len(header))
+        lines, self.checkpoint_offset = self._lines(csv_file.read(), len(header), True)
+        hashes = self._hash(lines)
+        known = np.isin(hashes, self.checkpoint_hashes)
+        if known.sum() * 2 < len(self.checkpoint_hashes):
+            # Most known rows are gone, the file was truncated and is reparsed
+            self.frame = self._sort(self._parse(header, lines, hashes))
+            self.checkpoint_hashes = np.sort(hashes)
+            self.stats['full'] += 1
+            return
+        # Rows whose line is gone are dropped, lines not seen before are parsed
+        kept = self.frame[np.isin(self.frame['row_hash'].values, hashes)]
+        new_lines = [line for line, seen in zip(lines, known) if not seen]
+        new_rows = self._parse(header, new_lines, hashes[~known])
+        self.frame = self._sort(concat_rows([kept, new_rows]))
+        self.checkpoint_hashes = np.sort(hashes)
+        self.stats['diffed'] += 1
+
+    def _parse(self, header, lines, hashes):
+        chunks = []
+        for start in range(0, len(lines), self.chunksize):
+            block = header + b'\n'.join(lines[start:start + self.chunksize])
+            raw_df = pd.read_csv(io.BytesIO(block))
+            raw_df['row_hash'] = hashes[start:start + self.chunksize]
+            for observer in self.observers:
+                observer(raw_df)
+            chunks.append(self.normalize(raw_df))
+        self.stats['parsed_rows'] += len(lines)
+        ROWS_INGESTED.inc(len(lines))
+        if not chunks:
+            return self.normalize(pd.read_csv(io.BytesIO(header)).assign(row_hash=np.zeros(0, dtype=np.uint64)))
+        return concat_rows(chunks)
+
+    def _sort(self, frame):
+        return frame.sort_values('date', kind='mergesort').reset_index(drop=True)
+
+    def _lines(self, data, start, complete):
+        # An appended line still being written has no newline yet and is left for the next read
+        end = len(data) if complete else data.rfind(b'\n') + 1
+        lines = [line for line in data[:end].split(b'\n') if line.strip()]
+        return lines, start + end
+
+    def _hash(self, lines):
+        if not lines:
+            return np.zeros(0, dtype=np.uint64)
+        return pd.util.hash_array(np.array([line.rstrip(b'\r') for line in lines], dtype=object))
+
+    def _signature(self, csv_file, header, offset):
+        csv_file.seek(max(offset - SIGNATURE_BYTES, 0))
+        return hashlib.blake2b(header + csv_file.read(min(offset, SIGNATURE_BYTES))).hexdigest()
+
+    def __getstate__(self):
+        # The rows duplicate the Outlier's trainingdf, a restored ingestor starts with a full parse
+        state = self.__dict__.copy()
+        state['frame'] = None
+        state['checkpoint'] = None
+        state['checkpoint_hashes'] = np.zeros(0, dtype=np.uint64)
+        return state
@@ -0,0 +1,144 @@
+"""
+Expected File Manifest Index
+---
+Indexes list.txt, the DB_filelist.ps1 export of the files the database
+expects, by the day in each file name, and keeps the names of the files
+received over the recent days as the DirList rows are ingested. The missing
+files are kept as a set that is updated as files arrive, so check_DB is a
+lookup instead of a rescan of both files. The refresher thread updates the
+index while request threads read it, so both hold its lock.
+"""
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+# Day a file was generated, e.g. SST1771_USC_VEHICLE_HEADER_20170511060137.dat
+NAME_DAY = re.compile(r'_(20[0-9]{6})')
+
+
+class ManifestIndex(object):
+
+    def __init__(self, db_path="./data/list.txt", days=2, name_filter='SST'):
+        self.db_path = db_path
+        # Only file names containing name_filter are monitored
+        self.name_filter = name_filter
+        # Received files count for the last `days` days, including today
+        self.days = days
+        # (mtime in ns, size, inode) of the parsed list.txt
+        self.stamp = None
+        # Day (YYYY-MM-DD, None if the name has no date) -> expected file names
+        self.expected = {}
+        self.expected_names = set()
+        # Day (YYYY-MM-DD) -> received file names, only days inside the window are kept
+        self.received = {}
+        self.window_start = None
+        self.missing_names = set()
+        # Guards the index against the refresher observing rows while a request reads it
+        self._lock = threading.RLock()
+
+    def refresh(self, today=None):
+        """
+        Purpose:
+            Reparses list.txt if it changed and moves the received window at midnight.
+        Args:
+            today (datetime): current day, defaults to datetime.today()
+        Returns:
+            self
+        """
+        window_start = self._window_start(today)
+        stat = os.stat(self.db_path)
+        stamp = stat.st_mtime_ns, stat.st_size, stat.st_ino
+        with self._lock:
+            if stamp != self.stamp:
+                self.stamp = stamp
+                self.expected = self.parse(self.db_path)
+                self.expected_names = set().union(*self.expected.values())
+            elif window_start == self.window_start:
+                return self
+            if window_start != self.window_start:
+                self.window_start = window_start
+                self.received = {day: names for day, names in self.received.items() if day >= window_start}
+            self.missing_names = self.expected_names.difference(*self.received.values())
+        return self
+
+    def parse(self, db_path):
+        """
+        Purpose:
+            Parses a DB_filelist.ps1 export, one row of ';' separated file
+            names per database entry.
+        Args:
+            db_path (str): list.txt
+        Returns:
+            Dictionary of day (YYYY-MM-DD) to the set of expected file names
+            containing name_filter
+        """
+        expected = {}
+        with open(db_path, encoding='utf-8-sig') as db_file:
+            for line in db_file:
+                for name in line.split(';'):
+                    name = name.strip()
+                    if self.name_filter not in name:
+                        continue
+                    match = NAME_DAY.search(name)
+                    day = None
+                    if match:
+                        day = '%s-%s-%s' % (match.group(1)[:4], match.group(1)[4:6], match.group(1)[6:])
+                    expected.setdefault(day, set()).add(name)
+        return expected
+
+    def observe(self, raw_df):
+        """
+        Purpose:
+            Records newly ingested DirList rows, called by DirListIngestor with
+            each block of rows before normalization.
+        Args:
+            raw_df (DataFrame): rows as read by pd.read_csv
+        """
+        with self._lock:
+            if self.window_start is None:
+                self.window_start = self._window_start()
+            days = pd.to_datetime(raw_df['date'], format='%m.%d.%Y').dt.strftime('%Y-%m-%d')
+            recent = (days >= self.window_start).values & \
+                raw_df['name'].astype(str).str.contains(self.name_filter, regex=False).values
+            if not recent.any():
+                return
+            for day, names in pd.Series(raw_df['name'].values[recent]).groupby(days.values[recent]):
+                names = set(names)
+                self.received.setdefault(day, set()).update(names)
+                self.missing_names = self.missing_names - names
+
+    def missing(self, today=None):
+        """
+        Purpose:
+            Lists the expected files that have not been received in the window.
+        Args:
+            today (datetime): current day, defaults to datetime.today()
+        Returns:
+            List of file names, a copy taken under the lock
+        """
+        with self._lock:
+            return list(self.refresh(today).missing_names)
+
+    def received_items(self):
+        """
+        Returns:
+            Sorted list of the (day, file name) pairs received in the window, a copy taken under the lock
+        """
+        with self._lock:
+            return [(day, name) for day, names in sorted(self.received.items()) for name in sorted(names)]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _window_start(self, today=None):
+        today = today or datetime.today()
+        return (today - timedelta(days=self.days - 1)).strftime('%Y-%m-%d')
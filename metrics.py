@@ -0,0 +1,310 @@
+"""
+Metrics
+---
+In-process counters, gauges and histograms rendered in the Prometheus text
+exposition format by the /metrics route, and a sampling profiler that dumps
+the stacks of slow requests. The Outlier pipeline stages are timed with
+stage(name). Setting OUTLIER_METRICS=0 turns stage() into a shared no-op
+context manager and leaves the Flask request hooks unregistered.
+"""
+import math
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+
+# Metrics are recorded unless OUTLIER_METRICS=0
+ENABLED = os.environ.get('OUTLIER_METRICS', '1') != '0'
+# Upper bounds in seconds of the latency buckets
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError('%s takes the labels %s' % (self.name, ', '.join(self.labels)))
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('%s="%s"' % (name, escape(value)) for name, value in pairs) + '}'
+
+    def samples(self):
+        """
+        Returns:
+            List of (suffix, label text, value) tuples
+        """
+        with self._lock:
+            return [('', self._label_text(key), value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, escape(self.documentation)), '# TYPE %s %s' % (self.name, self.kind)]
+        for suffix, label_text, value in self.samples():
+            lines.append('%s%s%s %s' % (self.name, suffix, label_text, format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def remove(self, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values.pop(key, None)
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per bucket counts, sum and count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append(('_bucket', self._label_text(key, [('le', format_value(bound))]), cumulative))
+                samples.append(('_bucket', self._label_text(key, [('le', '+Inf')]), count))
+                samples.append(('_sum', self._label_text(key), total))
+                samples.append(('_count', self._label_text(key), count))
+        return samples
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Returns:
+            Every metric in the Prometheus text exposition format 0.0.4
+        """
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(Histogram('outlier_stage_duration_seconds',
+                                            'Duration of Outlier pipeline stages', ('stage',)))
+ROUTE_SECONDS = REGISTRY.register(Histogram('outlier_http_request_duration_seconds',
+                                            'Latency of the Flask routes', ('route', 'method', 'status')))
+MODELS = REGISTRY.register(Counter('outlier_models_total',
+                                   'Per file name models, fitted or reused from the model store', ('kind', 'result')))
+ROWS_INGESTED = REGISTRY.register(Counter('outlier_rows_ingested_total', 'DirList rows parsed by the ingestors'))
+HISTORY_ROWS = REGISTRY.register(Gauge('outlier_history_rows', 'Rows in the served history', ('source',)))
+INTERFACES = REGISTRY.register(Gauge('outlier_interfaces', 'Interfaces tracked', ('source',)))
+FILE_NAMES = REGISTRY.register(Gauge('outlier_file_names', 'File names tracked', ('source',)))
+SNAPSHOT_AGE = REGISTRY.register(Gauge('outlier_snapshot_age_seconds', 'Age of the served snapshot', ('source',)))
+
+
+class Timer(object):
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class NoTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_TIMER = NoTimer()
+
+
+def stage(name):
+    """
+    Purpose:
+        Times a pipeline stage into outlier_stage_duration_seconds.
+    Args:
+        name (str): stage label, e.g. ingest or model_fit
+    Returns:
+        Context manager
+    """
+    if not ENABLED:
+        return NO_TIMER
+    return Timer(STAGE_SECONDS, {'stage': name})
+
+
+class SlowRequestProfiler(object):
+
+    def __init__(self, threshold, directory='profiles', interval=.005):
+        # Requests slower than threshold seconds have their samples written
+        self.threshold = threshold
+        self.directory = directory
+        # Seconds between samples of the request's stack
+        self.interval = interval
+        self.dumps = 0
+
+    @classmethod
+    def from_environ(cls):
+        """
+        Purpose:
+            Creates the profiler if OUTLIER_PROFILE_SLOW_MS is set, writing to
+            OUTLIER_PROFILE_DIR (default profiles).
+        Returns:
+            SlowRequestProfiler or None
+        """
+        threshold = os.environ.get('OUTLIER_PROFILE_SLOW_MS')
+        if not threshold:
+            return None
+        return cls(float(threshold) / 1000.0, os.environ.get('OUTLIER_PROFILE_DIR', 'profiles'))
+
+    def start(self):
+        """
+        Purpose:
+            Starts sampling the calling thread's stack in a daemon thread, and the
+            stacks of the threads a job of the request runs on, see sampled_call.
+        Returns:
+            Sampling state passed to stop()
+        """
+        # Threads working for the request, changed by sampled_call under the lock
+        state = {'threads': {threading.get_ident()}, 'threads_lock': threading.Lock(), 'stacks': StackCounter(),
+                 'done': threading.Event(), 'start': time.perf_counter()}
+        sampler = threading.Thread(target=self._sample, args=(state,), name='outlier-profiler')
+        sampler.daemon = True
+        sampler.start()
+        state['sampler'] = sampler
+        return state
+
+    def stop(self, state, label):
+        """
+        Purpose:
+            Stops sampling and writes the collapsed stacks, one "frame;frame count"
+            line per stack as flame graph tools read them, if the request was slow.
+        Args:
+            state: start() result
+            label (str): request description used in the file name
+        Returns:
+            Path of the written profile, or None
+        """
+        state['done'].set()
+        state['sampler'].join()
+        elapsed = time.perf_counter() - state['start']
+        if elapsed < self.threshold or not state['stacks']:
+            return None
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, '%s-%s-%dms.folded' % (
+            time.strftime('%Y%m%d-%H%M%S'), re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_') or 'root',
+            elapsed * 1000))
+        with open(path, 'w') as profile_file:
+            for stack, count in state['stacks'].most_common():
+                profile_file.write('%s %d\n' % (stack, count))
+        self.dumps += 1
+        return path
+
+    def _sample(self, state):
+        while not state['done'].wait(self.interval):
+            with state['threads_lock']:
+                threads = list(state['threads'])
+            frames = sys._current_frames()
+            for thread in threads:
+                frame = frames.get(thread)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno))
+                    frame = frame.f_back
+                if stack:
+                    state['stacks'][';'.join(reversed(stack))] += 1
+
+
+def sampled_call(state, function, *args):
+    """
+    Purpose:
+        Calls function(*args) with the calling thread's stack sampled into a
+        request's profile, e.g. on a compute_pool.ComputePool thread while the
+        request thread only waits for the result.
+    Args:
+        state: SlowRequestProfiler.start() result, None to call function alone
+        function: callable
+        args: its arguments
+    Returns:
+        function's result
+    """
+    if state is None:
+        return function(*args)
+    thread = threading.get_ident()
+    with state['threads_lock']:
+        state['threads'].add(thread)
+    try:
+        return function(*args)
+    finally:
+        with state['threads_lock']:
+            state['threads'].discard(thread)
@@ -0,0 +1,134 @@
+"""
+Per File Name Model Store
+---
+Keeps the fitted Isolation Forest and the predictions of every file name,
+keyed by the kind of model and the file name, together with a fingerprint of
+the series it was fitted on. Models are only refitted when their series
+changes, and the store is pickled next to outlier.snapshot so rebuilds reuse it.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+
+import numpy as np
+
+
+def fingerprint(*parts):
+    """
+    Purpose:
+        Hashes model inputs, arrays by dtype, shape and content.
+    Args:
+        parts: arrays and parameters
+    Returns:
+        Hex digest string
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            digest.update((part.dtype.str + str(part.shape)).encode('utf-8'))
+            digest.update(np.ascontiguousarray(part).tobytes())
+        else:
+            digest.update(repr(part).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ModelStore(object):
+
+    def __init__(self, path='outlier_models.pickle'):
+        # A path of None keeps the store in memory only
+        self.path = os.path.abspath(path) if path else None
+        self.entries = {}
+        self.fitted = 0
+        self.reused = 0
+        self.changed = False
+
+    @classmethod
+    def load(cls, path='outlier_models.pickle'):
+        """
+        Purpose:
+            Opens a persisted store.
+        Args:
+            path (str): location of the pickle
+        Returns:
+            ModelStore, empty if nothing has been persisted yet
+        """
+        store = cls(path)
+        store.entries = None
+        return store
+
+    def get(self, kind, name, series_fingerprint):
+        """
+        Purpose:
+            Looks up the model of a file name.
+        Args:
+            kind (str): 'daily' or 'hourly'
+            name (str): file name from get_df()
+            series_fingerprint (str): fingerprint of the training series
+        Returns:
+            Entry dictionary with estimator, target and result, or None if the
+            name is unknown or its series has changed
+        """
+        entry = self._entries().get((kind, name))
+        if entry is None or entry['fingerprint'] != series_fingerprint:
+            return None
+        return entry
+
+    def put(self, kind, name, series_fingerprint, estimator, target_fingerprint, result):
+        """
+        Purpose:
+            Stores a freshly fitted model and its predictions.
+        Args:
+            kind (str): 'daily' or 'hourly'
+            name (str): file name from get_df()
+            series_fingerprint (str): fingerprint of the training series
+            estimator: fitted IsolationForest
+            target_fingerprint (str): fingerprint of the data that was predicted
+            result: (y_pred_test, number_of_outlier)
+        """
+        self._entries()[(kind, name)] = {'fingerprint': series_fingerprint, 'estimator': estimator,
+                                         'target': target_fingerprint, 'result': result}
+        self.changed = True
+
+    def evict(self, kind, names):
+        """
+        Purpose:
+            Drops the models of file names that are no longer in the data.
+        Args:
+            kind (str): 'daily' or 'hourly'
+            names (list): current file names
+        """
+        names = set(names)
+        entries = self._entries()
+        for key in [key for key in entries if key[0] == kind and key[1] not in names]:
+            del entries[key]
+            self.changed = True
+
+    def save(self):
+        """
+        Purpose:
+            Atomically writes the store if it changed since it was loaded.
+        """
+        if self.path is None or not self.changed:
+            return
+        handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix='.tmp')
+        with os.fdopen(handle, 'wb') as store_file:
+            pickle.dump(self._entries(), store_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+    def _entries(self):
+        if self.entries is None:
+            self.entries = {}
+            if self.path is not None and os.path.isfile(self.path):
+                with open(self.path, 'rb') as store_file:
+                    self.entries = pickle.load(store_file)
+        return self.entries
+
+    def __getstate__(self):
+        # Persisted entries are read back lazily instead of being pickled with the Outlier
+        state = self.__dict__.copy()
+        if self.path is not None:
+            state['entries'] = None
+            state['changed'] = False
+        return state
@@ -8,35 +8,277 @@ uses is generated by a PowerShell script to retrieve filename and timestamps
 of a directory. This was developed for Porsche Cars North America to detect
 inconsistent file transfers.
 """
-import re
-from datetime import datetime, timedelta
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from itertools import repeat
 
 import numpy as np
 import pandas as pd
-from sklearn.ensemble import IsolationForest
+
+from catalog import INTERFACE_PATTERN, InterfaceCatalog
+from features import daily_features, score_features
+from history_store import HistoryStore
+from hourly_cube import HourlyCube
+from ingest import DirListIngestor
+from manifest_index import ManifestIndex
+from metrics import MODELS, stage
+from model_store import ModelStore, fingerprint
+from results import SeriesResults
+from scorers import DAILY_SCORER, SCORERS, fit_model, label_outliers
+from watcher import DirectoryIngestor
+
+# Ways of running the independent per file name model fits
+EXECUTORS = ('serial', 'threads', 'processes')
+# Worker pools shared by every Outlier in the process, keyed by executor and size
+WORKER_POOLS = {}
+WORKER_POOLS_LOCK = threading.Lock()
+# Every per file name seed is derived from the original RandomState(42)
+BASE_SEED = int(np.random.RandomState(42).randint(np.iinfo(np.int32).max))
+
+
+def name_seed(name):
+    """
+    Purpose:
+        Derives a file name's model seed from BASE_SEED so results do not depend
+        on the order or executor the models are fitted in.
+    Args:
+        name (str): file name from get_df()
+    Returns:
+        int seed
+    """
+    return (BASE_SEED + zlib.crc32(name.encode('utf-8'))) % np.iinfo(np.int32).max
+
+
+def fit_outliers(full_training_array, val_data, outliers_fraction=0.3, n_estimators=4, random_state=42):
+    """
+    Purpose:
+        Using training data to detect outliers with Isolation Forest from Scikit-learn.
+        Module level so it can run in a process pool, see Outlier.calculate_outliers.
+    Args:
+        full_training_array: array of training data
+        val_data: array of target data
+        outliers_fraction: estimated outlier percentage
+        n_estimators (int): estimated number of outlier groups
+        random_state (int): seed of the forest
+    Returns:
+        y_pred_test: array of [1 for not outliers and -1 for outliers]
+        number_of_outlier: array of outlier positions in the array
+    """
+    return label_outliers(fit_model(full_training_array, outliers_fraction, n_estimators, random_state), val_data)
+
+
+def fit_hourly_model(training_array, target_array, outliers_fraction=.06, n_estimate=24, random_state=42):
+    """
+    Purpose:
+        Fits one file name's hourly Isolation Forest and scores the target day.
+    Args:
+        training_array: array of [day of week, hour, file count] training rows
+        target_array: array of [day of week, hour, file count] target rows
+        outliers_fraction (float): estimated outlier percentage
+        n_estimate (int): estimated number of outlier groups
+        random_state (int): seed of the forest
+    Returns:
+        (fitted IsolationForest, (y_pred_test, number_of_outlier))
+    """
+    return SCORERS['forest'](training_array, target_array, outliers_fraction, n_estimate, random_state)
+
+
+def fit_daily_model(training_array, target_array, outliers_fraction=.3, n_estimate=8, random_state=42):
+    """
+    Purpose:
+        Scores one file name's daily counts, falling back to a noise padded refit
+        and then to a median rule when every value is labeled an outlier, see
+        scorers.DAILY_SCORER.
+    Args:
+        training_array: array of [file count] per training day
+        target_array: array of [file count] per target day
+        outliers_fraction (float): estimated outlier percentage
+        n_estimate (int): estimated number of outlier groups
+        random_state (int): seed of the forests
+    Returns:
+        (last fitted model, (y_pred_test, number_of_outlier))
+    """
+    return DAILY_SCORER(training_array, target_array, outliers_fraction, n_estimate, random_state)
+
+
+def label_hours(scorer, training_array, target_array, outliers_fraction, n_estimate, random_state, model=None):
+    """
+    Purpose:
+        Labels many hours of one file name with a single model, fitting it unless
+        a stored one is given. Module level so it can run in a process pool, see
+        Outlier.backfill_hourly.
+    Args:
+        scorer: scorers.Scorer
+        training_array: array of [day of week, hour, file count] training rows
+        target_array: array of [day of week, hour, file count] rows to label
+        outliers_fraction (float): estimated outlier percentage
+        n_estimate (int): estimated number of outlier groups
+        random_state (int): seed of the model
+        model: fitted model from the model store, or None
+    Returns:
+        (model, True if fitted here, boolean array with True for outlier rows)
+    """
+    fitted = model is None
+    if fitted:
+        model = scorer.fit(training_array, outliers_fraction, n_estimate, random_state)
+    return model, fitted, np.asarray(model.predict(target_array)) == -1
+
+
+def create_ingestor(raw_path, name_filter='SST'):
+    """
+    Purpose:
+        Creates the ingestor of a source: the monitored directory is watched
+        directly if today's raw_path is one, otherwise CSVGetter.ps1's listing
+        of it is read.
+    Args:
+        raw_path (str): DirList CSV or directory, may be a strftime pattern
+        name_filter (str): only file names containing this string are kept
+    Returns:
+        DirectoryIngestor or DirListIngestor
+    """
+    normalize = partial(normalize_dirlist, name_filter=name_filter)
+    directory = datetime.today().strftime(raw_path)
+    if os.path.isdir(directory):
+        # Watched at once, a snapshot's ingestor is otherwise only read on the next rebuild
+        return DirectoryIngestor(normalize).start(directory)
+    return DirListIngestor(normalize)
+
+
+def worker_pool(executor, max_workers=None):
+    """
+    Purpose:
+        Returns the process-wide pool of an executor type, so that every
+        monitored source shares the same model fitting workers.
+    Args:
+        executor (str): 'threads' or 'processes'
+        max_workers (int): pool size, None for the executor's default
+    Returns:
+        ThreadPoolExecutor or ProcessPoolExecutor
+    """
+    with WORKER_POOLS_LOCK:
+        pool = WORKER_POOLS.get((executor, max_workers))
+        if pool is None:
+            pool_type = ThreadPoolExecutor if executor == 'threads' else ProcessPoolExecutor
+            pool = WORKER_POOLS[(executor, max_workers)] = pool_type(max_workers=max_workers)
+        return pool
+
+
+def normalize_dirlist(raw_df, name_filter='SST'):
+    """
+    Purpose:
+        Normalizes rows parsed from a DirList CSV into get_df() format with
+        vectorized string operations. Columns other than date, time, size and
+        name, such as the ingestor's row_hash, are carried through.
+    Args:
+        raw_df (DataFrame): rows as read by pd.read_csv
+        name_filter (str): only file names containing this string are kept
+    Returns:
+        DataFrame with columns: date, hour (int8), minute (int16 minute of the
+        day), size (int64), name (categorical)
+    """
+    # Keeps interface files and removes all unique ID tails from their names
+    keep = raw_df['name'].astype(str).str.contains(name_filter, regex=False).values
+    raw_df = raw_df[keep].reset_index(drop=True)
+    names = raw_df['name'].astype(str).str.replace(r"_20[0-9]*.*$", "", regex=True)
+    # Splits hh:mm into the hour and the minute of the day, parsing each of the
+    # at most 1440 distinct times once
+    codes, times = pd.factorize(raw_df['time'].astype(str))
+    clock = np.array([time.split(':', 1) for time in times], dtype=np.int64).reshape(-1, 2)
+    hours = clock[:, 0][codes]
+    minutes = hours * 60 + clock[:, 1][codes]
+
+    df = pd.DataFrame({'date': pd.to_datetime(raw_df['date'], format='%m.%d.%Y'),
+                       'hour': hours.astype(np.int8),
+                       'minute': minutes.astype(np.int16),
+                       'size': raw_df['size'].values.astype(np.int64),
+                       'name': names.astype('category')})
+    for column in raw_df.columns.difference(['date', 'time', 'size', 'name'], sort=False):
+        df[column] = raw_df[column].values
+    return df
 
 
 class Outlier(object):
 
-    def __init__(self):
+    def __init__(self, raw_path="./data/DirList_06_26_2017.csv", db_path="./data/list.txt",
+                 hourly_path=None, executor='serial', max_workers=None,
+                 model_path=None, ingestor=None, history_path=None, manifest=None,
+                 name_filter='SST', interface_pattern=INTERFACE_PATTERN, scorer='forest',
+                 catalog_path=None):
         # Replace hostname with servername where the files are located and generated
 
-        # date_string = str(datetime.today().strftime('%m_%d_%Y'))
-        # self.raw_path = '\\\\hostname\Summary\DirList_' + date_string + '.csv'
-        # self.raw_db = pd.read_csv("\\\\hostname\\Summary\\list.txt")
-        self.raw_path = "./data/DirList_06_26_2017.csv"
-        self.raw_db = pd.read_csv("./data/list.txt")
+        # raw_path may be a strftime pattern that is resolved to today's file, e.g.
+        # Outlier('\\\\hostname\\Summary\\DirList_%m_%d_%Y.csv', '\\\\hostname\\Summary\\list.txt')
+        # or the monitored directory itself, e.g. Outlier('/srv/files', '/srv/Summary/list.txt')
+        # The hourly cube, model store, history and catalog are only persisted where a path is given,
+        # sources.Source.build keeps them in the source's state directory
+        if executor not in EXECUTORS:
+            raise ValueError('executor must be one of ' + ', '.join(EXECUTORS))
+        if scorer not in SCORERS:
+            raise ValueError('scorer must be one of ' + ', '.join(sorted(SCORERS)))
+        # Per file name model fits run serially, on a thread pool or on a process pool
+        self.executor = executor
+        self.max_workers = max_workers
+        # Files whose name contains name_filter are monitored, grouped by the interface_pattern match
+        self.name_filter = name_filter
+        self.interface_pattern = interface_pattern
+        # Dense file name IDs with their parsed interface and file name, see catalog.py
+        self.catalog = InterfaceCatalog.load(catalog_path, interface_pattern)
+        # Hourly scorer, see scorers.SCORERS
+        self.scorer = scorer
+        # Fitted per file name models, only refitted when their series changes
+        self.model_store = ModelStore.load(model_path)
+        # Only rows that changed since the ingestor's last read are parsed. A directory
+        # is watched directly instead of reading CSVGetter.ps1's listing of it
+        self.ingestor = ingestor or create_ingestor(raw_path, name_filter)
+        # Expected files from list.txt and the recently received ones, fed by the ingestor
+        self.manifest = manifest or ManifestIndex(db_path, name_filter=name_filter)
+        if self.manifest.observe not in self.ingestor.observers:
+            self.ingestor.observers.append(self.manifest.observe)
+        # Typed, day-partitioned history that keeps days after they leave the CSV
+        self.history = HistoryStore.load(history_path)
+        self.raw_path_pattern = raw_path
+        self.raw_path = datetime.today().strftime(raw_path)
+        self.db_path = db_path
+        self.manifest.refresh()
         self.last_updated_hour = ''
         self.last_updated_day = ''
         self.trainingdf = self.get_df()
+        # Date x hour x file name counts persisted next to outlier.snapshot, only new days are counted.
+        # Its columns are the catalog IDs, a cube written before the catalog keeps its column order
+        with stage('hourly_cube'):
+            hourly_cube = HourlyCube.load(hourly_path)
+            present = self.trainingdf['name'].unique()
+            self.catalog.add(hourly_cube.names).add(present)
+            self.hourly_cube = hourly_cube.update(self.trainingdf, self.catalog.names, self.history_days)
+        # Catalog IDs of the file names with rows in the history, in ID order. Names that left the
+        # history keep their ID but are not served, so the series positions only cover names with data
+        self.ids = np.sort(self.catalog.ids(present))
+        # File names of ids, the series order of the daily and hourly results
+        self.names = [self.catalog.names[i] for i in self.ids.tolist()]
+        with stage('hourly_profiles'):
+            self.update_profiles()
+        self.row_count = len(self.trainingdf)
+        # Shared day x file name count cube, read by get_daily_outliers and the Flask routes
+        with stage('aggregate'):
+            self.daily_counts = self.accumulate_sum_per_day_per_name(self.trainingdf, self.names)
         self.outliers_dictionary = self.get_daily_outliers(self.trainingdf,
                                                            self.trainingdf, outliers_fraction=.3,
                                                            n_estimate=8)
+        # Read-only arrays of the daily outliers served by the JSON API
+        self.daily_results = SeriesResults.from_outliers(self.daily_counts['date'].dt.strftime('%Y-%m-%d'),
+                                                         self.outliers_dictionary, self.catalog.interface_ids[self.ids])
+        # Count, bytes, arrival times and weekday of every file name and day, scored together
+        with stage('features'):
+            self.features = daily_features(self.trainingdf, self.daily_counts['date'], self.names)
+            self.feature_results = self.score_daily_features(self.features)
         self.full_hour_traindata = ''
-        # Due to performance issues, hourly outlier calculations will only be done ad hoc
-        # self.full_hour_traindata = self.create_full_hour_traindata(self.trainingdf)
+        self.model_store.save()
 
-    def accumulate_sum_per_day_per_name(self, df):
+    def accumulate_sum_per_day_per_name(self, df, names=None):
         """
         Purpose:
             Generates a DataFrame that counts the amount of a particular file
@@ -44,34 +286,42 @@ class Outlier(object):
         Args:
             df (Pandas DataFrame): A very specifically formatted DataFrame
                 dataframe from csv with columns: date, time, hour, size, name
+            names (list): file name columns in output order, defaults to the names of df
         Returns:
             DataFrame with rows of each day and columns of file count for each
             file category.
         """
-        unique_names = df['name'].unique()
+        unique_names = df['name'].unique() if names is None else names
         # Calculates true date range regardless of missing or zero file days
-        dates = pd.date_range(df['date'][0], df['date'][len(df) - 1])
+        dates = pd.date_range(df['date'].min(), df['date'].max())
         # Establish base dataframe with dates and day of week
         daily = pd.DataFrame(index=dates)
         daily.insert(0, "date", dates)
-        days = []
-        unique_dates = daily['date'].unique()
-
-        for val in range(len(daily)):
-            days.append(daily['date'][val].dayofweek)
-        daily.insert(1, "day", days)
+        daily.insert(1, "day", dates.dayofweek)
 
-        # Populates dataframe with count of filename per day
-        for name in unique_names:
-            temp = []
-            for date in unique_dates:
-                temp.append(df[(df['name'] == name) & (
-                    df['date'] == date)].date.count())
-            daily.insert(len(daily.columns), name, temp)
+        # Counts every (date, filename) pair in one pass and fills missing days with zero
+        counts = df.groupby(['date', 'name'], sort=False).size().unstack('name', fill_value=0)
+        counts = counts.reindex(index=dates, columns=unique_names, fill_value=0)
+        daily = pd.concat([daily, counts], axis=1)
 
         return daily
 
-    def calculate_outliers(self, full_training_array, val_data, outliers_fraction=0.3, n_estimators=4):
+    def get_daily_counts(self, df):
+        """
+        Purpose:
+            Returns the shared daily count cube when df is the training data,
+            otherwise builds a new one.
+        Args:
+            df (DataFrame): get_df()
+        Returns:
+            DataFrame in accumulate_sum_per_day_per_name format
+        """
+        if df is self.trainingdf and hasattr(self, 'daily_counts'):
+            return self.daily_counts
+        return self.accumulate_sum_per_day_per_name(df)
+
+    def calculate_outliers(self, full_training_array, val_data, outliers_fraction=0.3, n_estimators=4,
+                           random_state=42):
         """
         Purpose:
             Using training data to detect outliers with Isolation Forest from Scikit-learn.
@@ -82,29 +332,171 @@ class Outlier(object):
                 Format: Same as above
             outliers_fraction: estimated outlier percentage
             n_estimators (int): estimated number of outlier groups
+            random_state (int): seed of the forest, name_seed(name) for per name models
         Returns:
             y_pred_test: array of [1 for not outliers and -1 for outliers]
             number_of_outlier: array of outlier positions in the array
         """
-        rng = np.random.RandomState(42)
-        # Generate train data
-        x_train = full_training_array
-        x_test = val_data
-        # fit the model
-        clf = IsolationForest(n_estimators=n_estimators,
-                              random_state=rng,
-                              contamination=outliers_fraction)
-        clf.fit(x_train)
-        y_pred_train = clf.predict(x_train)
-        y_pred_test = clf.predict(x_test)
-        # y_pred_outliers = clf.predict(X_outliers)
-        count = 0
-        number_of_outlier = []
-        for i in y_pred_test:
-            if i == -1:
-                number_of_outlier.append(count)
-            count += 1
-        return y_pred_test, number_of_outlier
+        return fit_outliers(full_training_array, val_data, outliers_fraction, n_estimators, random_state)
+
+    def calculate_outliers_batch(self, training_arrays, target_arrays, outliers_fraction=0.3, n_estimators=4,
+                                 seeds=None):
+        """
+        Purpose:
+            Fits one Isolation Forest per pair of training and target arrays in a single pass.
+        Args:
+            training_arrays: iterable of calculate_outliers full_training_array
+            target_arrays: iterable of calculate_outliers val_data, in the same order
+            outliers_fraction: estimated outlier percentage
+            n_estimators (int): estimated number of outlier groups
+            seeds: iterable of random_state per pair, defaults to 42 for all
+        Returns:
+            List of calculate_outliers (y_pred_test, number_of_outlier) in input order
+        """
+        return self.map_models(fit_outliers, training_arrays, target_arrays, repeat(outliers_fraction),
+                               repeat(n_estimators), repeat(42) if seeds is None else seeds)
+
+    def map_models(self, function, *iterables):
+        """
+        Purpose:
+            Runs independent per file name model fits with the configured executor,
+            on the worker pool shared by every Outlier in the process.
+        Args:
+            function: module level function, so it can be sent to a process pool
+            iterables: argument iterables, zipped as with map()
+        Returns:
+            List of results in input order, identical for every executor
+        """
+        if self.executor == 'serial' or self.max_workers == 1:
+            return list(map(function, *iterables))
+        return list(worker_pool(self.executor, self.max_workers).map(function, *iterables, chunksize=8))
+
+    def score_models(self, kind, names, function, training_arrays, target_arrays, outliers_fraction,
+                     n_estimate, predict=False, fingerprints=None):
+        """
+        Purpose:
+            Scores every file name, refitting only the names whose series changed
+            since their model was stored and evicting names that disappeared.
+        Args:
+            kind (str): model store kind, 'daily' or 'hourly'
+            names (list): file names, in output order
+            function: scorers.Scorer, e.g. DAILY_SCORER or a value of SCORERS
+            training_arrays: iterable of training arrays, in names order, or with
+                fingerprints a function returning the training array of a position
+                in names, only called for the names that are refitted
+            target_arrays: iterable of target arrays, in names order
+            outliers_fraction (float): estimated outlier percentage
+            n_estimate (int): estimated number of outlier groups
+            predict (bool): if the stored model may predict a new target without a
+                refit, otherwise the target is part of the fingerprint
+            fingerprints (list): series fingerprints in names order, e.g. of the
+                hourly profiles, None to fingerprint the training arrays
+        Returns:
+            List of (y_pred_test, number_of_outlier) in names order
+        """
+        results = []
+        refit = []
+        if fingerprints is None:
+            training_arrays = iter(training_arrays)
+        for name, target_array in zip(names, target_arrays):
+            target_fingerprint = fingerprint(target_array)
+            if fingerprints is None:
+                training_array = next(training_arrays)
+                series_fingerprint = fingerprint(training_array, outliers_fraction, n_estimate, function,
+                                                 None if predict else target_fingerprint)
+            else:
+                training_array = None
+                series_fingerprint = fingerprints[len(results)]
+            entry = self.model_store.get(kind, name, series_fingerprint)
+            if entry is not None and entry['target'] != target_fingerprint:
+                # Relabelling a new target is kept in memory only, the stored model did not change
+                entry['result'] = label_outliers(entry['estimator'], target_array)
+                entry['target'] = target_fingerprint
+            if entry is None:
+                refit.append((len(results), name, series_fingerprint, target_fingerprint,
+                              training_array, target_array))
+            else:
+                self.model_store.reused += 1
+            results.append(None if entry is None else entry['result'])
+
+        if fingerprints is not None:
+            refit = [job[:4] + (training_arrays(job[0]),) + job[5:] for job in refit]
+        with stage('model_fit'):
+            fitted = self.map_models(function, [job[4] for job in refit], [job[5] for job in refit],
+                                     repeat(outliers_fraction), repeat(n_estimate),
+                                     [name_seed(job[1]) for job in refit])
+        for (position, name, series_fingerprint, target_fingerprint, _, _), (clf, result) in zip(refit, fitted):
+            self.model_store.put(kind, name, series_fingerprint, clf, target_fingerprint, result)
+            results[position] = result
+        self.model_store.fitted += len(refit)
+        MODELS.inc(len(refit), kind=kind, result='fitted')
+        MODELS.inc(len(results) - len(refit), kind=kind, result='reused')
+        self.model_store.evict(kind, names)
+        return results
+
+    def profile_fingerprint(self, version=None):
+        """
+        Purpose:
+            Fingerprints the hourly models of a scorer that is updated in step
+            with the hourly cube, such as the 'profile' scorer, by the cube's
+            version instead of its whole history.
+        Args:
+            version (str): HourlyCube.version, defaults to the current one
+        Returns:
+            Fingerprint, None if the scorer is not incremental or the cube has no version
+        """
+        scorer = SCORERS[self.scorer]
+        version = self.hourly_cube.version if version is None else version
+        if not scorer.incremental or version is None:
+            return None
+        return fingerprint(version, scorer)
+
+    def hourly_training_column(self, position):
+        """
+        Returns:
+            Hourly training rows of the file name at a position in names
+        """
+        return next(self.hourly_cube.iter_training_columns([self.ids[position]]))
+
+    def update_profiles(self):
+        """
+        Purpose:
+            Brings the stored hourly models of an incremental scorer up to date
+            with the hourly cube. The hours the last cube update recounted are
+            removed from and added to the model of every file name, so a rebuild
+            costs the new hours instead of the history. File names without a
+            model of the previous cube version are fitted on their whole column.
+        Args:
+            None.
+        Returns:
+            None.
+        """
+        current = self.profile_fingerprint()
+        if current is None:
+            return
+        scorer = SCORERS[self.scorer]
+        delta = self.hourly_cube.delta
+        previous = None
+        if delta is not None and delta['since'] is not None:
+            previous = self.profile_fingerprint(delta['since'])
+        refit = []
+        for i, name in enumerate(self.names):
+            if self.model_store.get('hourly', name, current) is not None:
+                continue
+            entry = None if previous is None else self.model_store.get('hourly', name, previous)
+            if entry is None:
+                refit.append(i)
+                continue
+            model = entry['estimator']
+            model.add_rows(self.hourly_cube.block_rows(delta['dates'], delta['removed'], self.ids[i]), -1)
+            model.add_rows(self.hourly_cube.block_rows(delta['dates'], delta['added'], self.ids[i]))
+            self.model_store.put('hourly', name, current, model, None, None)
+        for i, training_array in zip(refit, self.hourly_cube.iter_training_columns(self.ids[refit])):
+            self.model_store.put('hourly', self.names[i], current,
+                                 scorer.fit(training_array, .06, 24, name_seed(self.names[i])), None, None)
+        self.model_store.fitted += len(refit)
+        MODELS.inc(len(refit), kind='hourly', result='fitted')
+        MODELS.inc(len(self.names) - len(refit), kind='hourly', result='reused')
 
     def get_daily_outliers(self, trainingdf, df, outliers_fraction=.3, n_estimate=8):
         """
@@ -119,52 +511,51 @@ class Outlier(object):
         Returns:
             Dictionary with interface name, file name, file count, and outlier sequence number
         """
-        training_df = self.accumulate_sum_per_day_per_name(trainingdf)
-        target_df = self.accumulate_sum_per_day_per_name(df)
-        unique_names = df['name'].unique()
+        training_df = self.get_daily_counts(trainingdf)
+        target_df = self.get_daily_counts(df)
+        # The training data's series follow the catalog IDs
+        unique_names = self.names if df is self.trainingdf else df['name'].unique()
         outlier_list = []
-        for name in unique_names:
-            training_array = [[x] for x in training_df[name].tolist()]
-            target_array = [[x] for x in target_df[name].tolist()]
-
-            y_pred_test, number_of_outlier = (
-                self.calculate_outliers(training_array, target_array, outliers_fraction, n_estimate))
-            # If the model determines all the values as outliers, noise will be added to the data and retrained
-            if (len(np.unique(y_pred_test)) == 1) & (np.unique(y_pred_test)[0] == -1):
-                mean = np.median(training_array)
-                for noise in range(35):
-                    training_array.append([int(mean)])
-                y_pred_test, number_of_outlier = self.calculate_outliers(
-                    training_array, target_array, .1, 4)
-                number_of_outlier = [
-                    i for i in number_of_outlier if i < len(target_array)]
-                # If the model still determines all the values as outliers, all values beyond the median will be labeled as outliers
-                if (len(np.unique(y_pred_test)) == 1) & (np.unique(y_pred_test)[0] == -1):
-                    y_pred_test = []
-                    for x in target_array:
-                        if x[0] != mean:
-                            y_pred_test.append(-1)
-                        else:
-                            y_pred_test.append(1)
-                    count = 0
-                    number_of_outlier = []
-                    for i in y_pred_test:
-                        if i == -1:
-                            number_of_outlier.append(count)
-                        count += 1
-
-                    # Failed attempt at tupling day of week and filecount
-                    # train_arr = [tuple(x) for x in training_df[[name,'day']].values]
-                    # real_arr = [tuple(x) for x in data[[name,'day']].values]
-                    # y_pred_test, number_of_outlier = self.calculate_outliers(train_arr, real_arr, .05, 8)
-
-            interface = re.search(r'([A-Z]{3}[0-9]{4})', name).group(1)
-            file_name = re.sub(r'([A-Z]{3}[0-9]{4})', '', name)
+
+        with stage('daily_outliers'):
+            results = self.score_models('daily', unique_names, DAILY_SCORER,
+                                        (training_df[name].values.reshape(-1, 1) for name in unique_names),
+                                        (target_df[name].values.reshape(-1, 1) for name in unique_names),
+                                        outliers_fraction, n_estimate)
+
+        for name, (y_pred_test, number_of_outlier) in zip(unique_names, results):
+            interface, file_name = self.catalog.split(name)
             outlier_list.append({"interface": interface, "file_name": file_name, 'data': target_df[name].tolist(),
                                  "number_of_outliers": number_of_outlier})
 
         return outlier_list
 
+    def score_daily_features(self, features, threshold=5.0):
+        """
+        Purpose:
+            Labels outlier days from the multivariate daily features of every file
+            name in one vectorized pass, see features.score_features.
+        Args:
+            features (array): features.daily_features() in names order
+            threshold (float): distance in scaled median absolute deviations
+        Returns:
+            SeriesResults with the daily counts and the feature outliers
+        """
+        return SeriesResults(self.daily_results.categories, self.daily_results.interfaces,
+                             self.daily_results.file_names, self.daily_results.counts,
+                             score_features(features, threshold), self.daily_results.interface_ids)
+
+    def split_name(self, name):
+        """
+        Purpose:
+            Splits a file name into its interface and the rest of the name.
+        Args:
+            name (str): file name from get_df()
+        Returns:
+            (interface, file_name), the interface is empty if the pattern does not match
+        """
+        return self.catalog.split(name)
+
     def get_hourly_outliers(self, date, outliers_fraction=.3, n_estimate=8):
         """
         Purpose:
@@ -177,75 +568,148 @@ class Outlier(object):
         Returns:
             Dictionary with interface name, file name, file count, and outlier sequence number
         """
-        raw_data = self.trainingdf
-        unique_names = self.trainingdf['name'].unique()
+        date = str(date)[:10]
+        unique_names = self.names
         outlier_list = []
 
-        for name in unique_names:
-            validation_data = []
-            calculated_day_data = self.hourly_to_json(self.hourly_df(
-                str(date)[:10], raw_data), raw_data, str(date)[:10])
-            validation_data.append(calculated_day_data)
-
-            tmp = []
-            for element in validation_data:
-                for series in element['series_list']:
-                    if series['name'] == name:
-                        for i in range(24):
-                            tmp.append([element['day'], i, series['data'][i]])
-
-            test_data = tmp
-
-            training_tmp = []
-            for i in self.full_hour_traindata:
-                if i['name'] == name:
-                    training_tmp.append(i['data'])
-
-            y_pred_test, number_of_outlier = (
-                self.calculate_outliers(training_tmp, test_data, outliers_fraction, n_estimate))
-
-            interface = re.search(r'([A-Z]{3}[0-9]{4})', name).group(1)
-            file_name = re.sub(r'([A-Z]{3}[0-9]{4})', '', name)
-
-            data = []
-            for i in calculated_day_data['series_list']:
-                if i['name'] == name:
-                    data = i['data']
-
-            outlier_list.append({"interface": interface, "file_name": file_name, 'data': data,
-                                 "number_of_outliers": number_of_outlier})
+        # Target day is aggregated once, every name reads the cube column of its catalog ID
+        day = self.hourly_cube.day(date)[:, self.ids]
+        weekday = datetime.strptime(date, '%Y-%m-%d').weekday()
+        hours = np.arange(24)
+        test_arrays = (np.column_stack([np.full(24, weekday), hours, day[:, i]]) for i in range(len(unique_names)))
+
+        with stage('hourly_outliers'):
+            profile = self.profile_fingerprint()
+            if profile is None:
+                training_arrays = self.hourly_cube.iter_training_columns(self.ids)
+                fingerprints = None
+            else:
+                # The profiles kept in step by update_profiles are looked up without reading the history
+                training_arrays = self.hourly_training_column
+                fingerprints = [profile] * len(unique_names)
+            results = self.score_models('hourly', unique_names, SCORERS[self.scorer], training_arrays,
+                                        test_arrays, outliers_fraction, n_estimate, predict=True,
+                                        fingerprints=fingerprints)
+        # Not saved on the request path: models fitted here live as long as the snapshot, and
+        # serving processes sharing the store would overwrite each other's file
+
+        for i, (catalog_id, (y_pred_test, number_of_outlier)) in enumerate(zip(self.ids.tolist(), results)):
+            outlier_list.append({"interface": self.catalog.interfaces[catalog_id],
+                                 "file_name": self.catalog.file_names[catalog_id],
+                                 'data': day[:, i].tolist(), "number_of_outliers": number_of_outlier})
 
         return outlier_list
 
+    def backfill_hourly(self, first_day, n_days, outliers_fraction=.06, n_estimate=24):
+        """
+        Purpose:
+            Labels every hour of a range of days at once, with the labels
+            get_hourly_outliers gives each day: every file name's stored or newly
+            fitted model predicts all rows of the range in one call, and the
+            file names run on the configured executor. New models are stored
+            for the server to reuse.
+        Args:
+            first_day (int): position of the first day in the hourly cube
+            n_days (int): number of days
+            outliers_fraction (float): estimated outlier percentage
+            n_estimate (int): estimated number of outlier groups
+        Returns:
+            (counts, outliers) arrays of shape (names, days, 24) in names order
+        """
+        scorer = SCORERS[self.scorer]
+        training_arrays = list(self.hourly_cube.iter_training_columns(self.ids))
+        profile = self.profile_fingerprint()
+        fingerprints = [fingerprint(training_array, outliers_fraction, n_estimate, scorer, None)
+                        if profile is None else profile for training_array in training_arrays]
+        models = []
+        for name, series_fingerprint in zip(self.names, fingerprints):
+            entry = self.model_store.get('hourly', name, series_fingerprint)
+            models.append(None if entry is None else entry['estimator'])
+        rows = slice(first_day * 24, (first_day + n_days) * 24)
+
+        with stage('backfill_hourly'):
+            labeled = self.map_models(label_hours, repeat(scorer), training_arrays,
+                                      [training_array[rows] for training_array in training_arrays],
+                                      repeat(outliers_fraction), repeat(n_estimate),
+                                      [name_seed(name) for name in self.names], models)
+        counts = np.zeros((len(self.names), n_days, 24), dtype=np.int32)
+        outliers = np.zeros(counts.shape, dtype=bool)
+        for i, (name, series_fingerprint, training_array, (model, fitted, labels)) in enumerate(
+                zip(self.names, fingerprints, training_arrays, labeled)):
+            counts[i] = training_array[rows, 2].reshape(n_days, 24)
+            outliers[i] = labels.reshape(n_days, 24)
+            if fitted:
+                # Stored without a target, the next get_hourly_outliers labels its day with it
+                self.model_store.put('hourly', name, series_fingerprint, model, None, None)
+        self.model_store.fitted += sum(fitted for _, fitted, _ in labeled)
+        self.model_store.save()
+        return counts, outliers
+
+    def hourly_results(self, date, outliers_fraction=.3, n_estimate=8):
+        """
+        Purpose:
+            Packs get_hourly_outliers into read-only arrays for the JSON API.
+        Args:
+            date (str): target date in YYYY-MM-DD format
+            outliers_fraction (float): estimated outlier percentage
+            n_estimate (int): estimated number of outlier groups
+        Returns:
+            SeriesResults with one point per hour, labelled 00:00-23:00
+        """
+        return SeriesResults.from_outliers(['%02d:00' % hour for hour in range(24)],
+                                           self.get_hourly_outliers(date, outliers_fraction, n_estimate),
+                                           self.catalog.interface_ids[self.ids])
+
     def get_df(self):
         """
         Purpose:
-            Generates a Pandas DataFrame from parsing the CSV specified in the
-            class constructor.
+            Generates a Pandas DataFrame from the columnar history store after
+            appending the CSV specified in the class constructor to it. Only
+            rows that changed since the previous call are parsed, see
+            ingest.DirListIngestor, and only days whose rows changed are
+            rewritten, see history_store.HistoryStore.
             CSV Format: date(dd.mm.yyyy), time(hh:mm), size(bytes), file name
         Args:
             None.
         Returns:
-            DataFrame with columns: date, time, hour, size, name
-        """
-        # Reads CSV file to local
-        raw_df = pd.read_csv(self.raw_path)
-        # Removes all unique ID tails from filenames and converts date string to datetime datatype
-        raw_df = raw_df[raw_df.name.str.match(
-            '.*SST.*')].reset_index(drop=True)
-        raw_df['name'] = raw_df['name'].str.replace(r"_20[0-9]*.*$", "")
-        raw_df['date'] = raw_df['date'].str.replace(".", "")
-        raw_df['date'] = pd.to_datetime(raw_df['date'], format='%m%d%Y')
-        # Inserts raw hour column
-        temp_hours = []
-
-        for x in range(len(raw_df)):
-            temp_hours.append(
-                raw_df['time'][x][0:raw_df['time'][x].index(":")])
-        raw_df.insert(2, "hour", temp_hours)
-        raw_df = raw_df.sort_values('date').reset_index(drop=True)
-
-        return raw_df
+            DataFrame with columns: date, hour, minute, size, name
+        """
+        # Parses the rows of the CSV that are new since the last call
+        with stage('ingest'):
+            self.ingestor.read(self.raw_path)
+        # Days the history rewrote, also earlier ones that gained a late row, are recounted by the
+        # hourly cube, whose delta moves them in the hourly profiles
+        with stage('history_update'):
+            self.history_days = self.history.update(self.ingestor.frame)
+        with stage('history_read'):
+            return self.history.read()
+
+    def source_paths(self):
+        """
+        Purpose:
+            Lists the files this object is built from, for change detection.
+        Args:
+            None.
+        Returns:
+            List of today's DirList CSV and list.txt paths
+        """
+        return [datetime.today().strftime(self.raw_path_pattern), self.db_path]
+
+    def refreshed(self):
+        """
+        Purpose:
+            Builds a new Outlier from the same sources, reusing this object's
+            ingestion state, manifest index, persisted hourly cube, model store
+            and history. Requests keep reading the manifest index while the build
+            feeds it new rows, see manifest_index.ManifestIndex for its lock.
+        Args:
+            None.
+        Returns:
+            Outlier
+        """
+        return Outlier(self.raw_path_pattern, self.db_path, self.hourly_cube.path, self.executor, self.max_workers,
+                       self.model_store.path, self.ingestor, self.history.path, self.manifest,
+                       self.name_filter, self.interface_pattern, self.scorer, self.catalog.path)
 
     def hourly_df(self, date, raw_data):
         """
@@ -258,32 +722,18 @@ class Outlier(object):
             DataFrame with day, hours 00-23, file count, interface name
         """
         parsed_date = datetime.strptime(date, '%Y-%m-%d')
-        #   Isolate dataframe to user input day
-        raw_data = raw_data[raw_data['date'] == parsed_date]
-        raw_data = raw_data.groupby(
-            ['date', 'hour', 'name']).count().reset_index()
-        unique_names = raw_data['name'].unique()
-
-        #   Generate dataframe with zeroes
-        labels = ['Date', 'Day', 'Name', 'Count']
-        all_df = pd.DataFrame(columns=labels)
-        hours = []
-        names = []
-        for hour in range(0, 24):
-            for name in unique_names:
-                hours.append(hour)
-                names.append(name)
-        all_df.insert(2, 'Hour', hours)
-        all_df['Date'] = parsed_date
-        all_df['Day'] = parsed_date.weekday()
-        all_df['Name'] = names
-        all_df['Count'] = 0
-
-        for i in range(0, len(raw_data)):
-            all_df_row = all_df.loc[
-                (all_df['Name'] == raw_data['name'][i]) & (all_df['Hour'] == int(raw_data['hour'][i]))]
-            all_df.set_value(
-                all_df_row.index[0], 'Count', raw_data.loc[i].time)
+        cube = self.get_hourly_cube(raw_data)
+        #   Isolate cube to user input day and the names that have files that day
+        day = cube.day(parsed_date)
+        present = np.flatnonzero(day.sum(axis=0))
+        names = np.array(cube.names, dtype=object)[present]
+
+        labels = ['Date', 'Day', 'Hour', 'Name', 'Count']
+        all_df = pd.DataFrame({'Date': parsed_date,
+                               'Day': parsed_date.weekday(),
+                               'Hour': np.repeat(np.arange(24), len(names)),
+                               'Name': np.tile(names, 24),
+                               'Count': day[:, present].ravel()}, columns=labels)
 
         return all_df
 
@@ -292,37 +742,31 @@ class Outlier(object):
         Purpose:
             Outputs a JSON String for Highcharts to read
         Args:
-            Input: create_full_hour_traindata(trainingdf), trainingdf, a date in YYYY-MM-DD format
-            full_hour_data (DataFrame): create_full_hour_traindata(trainingdf)
+            Input: hourly_df(date, trainingdf) or None, trainingdf, a date in YYYY-MM-DD format
+            full_hour_data (DataFrame): hourly_df(date, trainingdf), or None to read the
+                day straight from the hourly cube
             raw_data (DataFrame): trainingdf
             date_get (str): target date in YYYY-MM-DD format from GET request
         Returns:
             Dictionary with day, hours 00-23, file count, interface name
         """
         date_get = datetime.strptime(date_get, '%Y-%m-%d')
-        names = raw_data['name'].unique()
         hours = []
         series_list = []
         result = {}
         for hour in range(0, 24):
             hours.append(str(hour) + ':00')
 
-        if full_hour_data.empty:
-
-            for name in names:
-                temp = {'name': name, 'data': [0] * 24}
-                series_list.append(temp)
+        if full_hour_data is None:
+            cube = self.get_hourly_cube(raw_data)
+            day = cube.day(date_get)
+            for i, name in enumerate(cube.names):
+                series_list.append({'name': name, 'data': day[:, i].tolist()})
 
         else:
-            for name in names:
-
-                if not full_hour_data[full_hour_data['Name'] == name]['Count'].tolist():
-                    temp = {'name': name, 'data': [0] * 24}
-                    series_list.append(temp)
-                else:
-                    temp = {
-                        'name': name, 'data': full_hour_data[full_hour_data['Name'] == name]['Count'].tolist()}
-                    series_list.append(temp)
+            counts = {name: group['Count'].tolist() for name, group in full_hour_data.groupby('Name', sort=False)}
+            for name in raw_data['name'].unique():
+                series_list.append({'name': name, 'data': counts.get(name, [0] * 24)})
 
         result['day'] = date_get.weekday()
         result['hours'] = hours
@@ -337,27 +781,30 @@ class Outlier(object):
             raw_data (DataFrame): Trainingdf
         Returns:
             Dictionary with interface name, [day of week, hour, file count]
-        WARNING:
-            TAKES A LONG TIME TO CALCULATE
         """
-        dates = [d.strftime('%Y-%m-%d') for d in
-                 pd.date_range(raw_data['date'][0], raw_data['date'][len(raw_data) - 1])]
-        full_hour_traindata = []
-
-        for date in dates:
-            calculated_day_data = self.hourly_to_json(self.hourly_df(str(date)[:10], raw_data), raw_data,
-                                                      str(date)[:10])
-            full_hour_traindata.append(calculated_day_data)
-
+        cube = self.get_hourly_cube(raw_data)
         tmp_training = []
-        for element in full_hour_traindata:
-            for series in element['series_list']:
-                for i in range(24):
-                    tmp_training.append({'name': series['name'], 'data': [
-                                        element['day'], i, series['data'][i]]})
+        for day, weekday in enumerate(cube.dates.dayofweek.tolist()):
+            for i, name in enumerate(cube.names):
+                for hour, count in enumerate(cube.counts[day, :, i].tolist()):
+                    tmp_training.append({'name': name, 'data': [weekday, hour, count]})
 
         return tmp_training
 
+    def get_hourly_cube(self, raw_data):
+        """
+        Purpose:
+            Returns the persisted hourly cube when raw_data is the training data,
+            otherwise builds an in-memory one.
+        Args:
+            raw_data (DataFrame): get_df()
+        Returns:
+            HourlyCube
+        """
+        if raw_data is self.trainingdf and hasattr(self, 'hourly_cube'):
+            return self.hourly_cube
+        return HourlyCube.from_df(raw_data)
+
     def check_DB(self):
         """
         Purpose:
@@ -367,19 +814,12 @@ class Outlier(object):
         Args:
             None.
         Returns:
-            List of files that are in the database but not in the CSV.
-        """
-        result = []
-        for line in range(len(self.raw_db)):
-            result += (self.raw_db.loc[line][0] + ';').split(';')
-        result = [x.strip(' ') for x in result]
-        result = [x for x in result if "SST" in x]
-        dirlist = pd.read_csv(self.raw_path)
-        dirlist['date'] = dirlist['date'].str.replace(".", "")
-        dirlist['date'] = pd.to_datetime(dirlist['date'], format='%m%d%Y')
-        namelist = dirlist[(dirlist['date'] > datetime.today(
-        ) - timedelta(days=2))]['name'].tolist()
-        return list(set(result) - (set(result) & set(namelist)))
+            List of files that are in the database but not in the CSV over
+            the last two days, see manifest_index.ManifestIndex.
+        """
+        # Constant-cost lookup, list.txt is only reparsed when it changes
+        with stage('check_db'):
+            return self.manifest.missing()
 
     def validate_date(self, date):
         """
@@ -392,6 +832,6 @@ class Outlier(object):
         """
         try:
             datetime.strptime(date, '%Y-%m-%d')
-        except ValueError:
+        except (TypeError, ValueError):
             return datetime.today().strftime('%Y-%m-%d')
         return date
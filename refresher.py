@@ -0,0 +1,131 @@
+"""
+Background Outlier Refresher
+---
+Thread that watches the DirList CSV and list.txt of the current snapshot and
+rebuilds the Outlier object off the request path when either changes. The
+rebuild reuses the ingestion state, persisted hourly cube and model store, and the new object
+is published to the SnapshotHolder with an atomic rename of outlier.snapshot.
+"""
+import logging
+import os
+import threading
+import time
+
+from metrics import stage
+
+log = logging.getLogger(__name__)
+
+
+class Refresher(object):
+
+    def __init__(self, snapshots, build=None, interval=30.0):
+        self.snapshots = snapshots
+        # Callable taking the served Outlier and returning a new one
+        self.build = build or (lambda outlier: outlier.refreshed())
+        # Seconds between checks of the source files
+        self.interval = interval
+        self.last_build = None
+        self.build_duration = None
+        self.last_error = None
+        self.builds = 0
+        self.building = False
+        self._stamps = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='outlier-refresher')
+        self._thread.daemon = True
+
+    def start(self):
+        """
+        Purpose:
+            Starts watching in a daemon thread.
+        """
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Purpose:
+            Stops the thread after its current check or build.
+        """
+        self._stop.set()
+        self._thread.join()
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                log.exception('Outlier refresh failed')
+            self._stop.wait(self.interval)
+
+    def refresh(self, force=False):
+        """
+        Purpose:
+            Rebuilds and publishes the Outlier object if its source files changed.
+        Args:
+            force (bool): rebuild even if nothing changed
+        Returns:
+            True if a new snapshot was published
+        """
+        snapshot = self.snapshots.get()
+        stamps = self.source_stamps(snapshot.outlier)
+        if self._stamps is None and not force:
+            # A snapshot newer than both sources is already up to date
+            newest = max([stamp[0] for stamp in stamps if isinstance(stamp, tuple)] or [0])
+            if snapshot.version[0] >= newest:
+                self._stamps = stamps
+        if not force and stamps == self._stamps:
+            return False
+
+        self.building = True
+        start = time.time()
+        try:
+            with stage('rebuild'):
+                outlier = self.build(snapshot.outlier)
+            self.snapshots.publish(outlier)
+        except Exception as error:
+            self.last_error = repr(error)
+            raise
+        finally:
+            self.building = False
+        self.build_duration = time.time() - start
+        self.last_build = time.time()
+        self.last_error = None
+        self.builds += 1
+        self._stamps = stamps
+        return True
+
+    def source_stamps(self, outlier):
+        """
+        Returns:
+            (mtime in ns, size) of the CSV and list.txt, None for missing files,
+            followed by the change count of a watched directory, see
+            watcher.DirectoryIngestor.poll
+        """
+        stamps = []
+        for path in outlier.source_paths():
+            try:
+                stat = os.stat(path)
+                stamps.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                stamps.append(None)
+        stamps.append(outlier.ingestor.poll())
+        return tuple(stamps)
+
+    def status(self):
+        """
+        Purpose:
+            Reports the state of the refresher and the served snapshot.
+        Returns:
+            Dictionary with last build time, build duration and staleness in seconds
+        """
+        snapshot = self.snapshots.get()
+        built = self.last_build or snapshot.version[0] / 1e9
+        return {'running': self._thread.is_alive(),
+                'building': self.building,
+                'builds': self.builds,
+                'last_build': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(built)),
+                'build_duration': self.build_duration,
+                'staleness': time.time() - built,
+                'snapshot_loaded': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot.loaded_at)),
+                'last_error': self.last_error}
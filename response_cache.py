@@ -0,0 +1,89 @@
+"""
+Response Cache
+---
+Bounded LRU cache of rendered responses keyed by route, normalized query
+arguments and the version of the snapshot they were rendered from. A new
+snapshot version drops every entry, so cached pages never outlive the data
+they show.
+"""
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache(object):
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Snapshot version the cached entries were rendered from
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    def get(self, version, key):
+        """
+        Purpose:
+            Looks up a rendered response, dropping all entries when the
+            snapshot version changed.
+        Args:
+            version: snapshot version the response must be rendered from
+            key (tuple): route, normalized query arguments and other inputs
+        Returns:
+            Cached value, or None on a miss
+        """
+        with self._lock:
+            if version != self.version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self.version = version
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, version, key, value):
+        """
+        Purpose:
+            Stores a rendered response, evicting the least recently used one
+            when the cache is full.
+        Args:
+            version: snapshot version the response was rendered from
+            key (tuple): route, normalized query arguments and other inputs
+            value: rendered response
+        """
+        with self._lock:
+            # A response rendered from a snapshot that was replaced meanwhile is not kept
+            if version != self.version:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def revalidated(self):
+        """
+        Purpose:
+            Counts a conditional request answered with 304 Not Modified.
+        """
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        """
+        Returns:
+            Dictionary with size, maxsize, hits, misses, not_modified,
+            invalidations and hit_ratio
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits,
+                    'misses': self.misses, 'not_modified': self.not_modified,
+                    'invalidations': self.invalidations,
+                    'hit_ratio': self.hits / float(lookups) if lookups else 0.0}
@@ -0,0 +1,162 @@
+"""
+Array-Backed Outlier Results
+---
+Read-only (series x points) arrays of file counts and outlier flags built
+once from get_daily_outliers or get_hourly_outliers. The JSON API slices
+series and trailing windows of points out of these arrays instead of
+deep-copying and shifting the outlier dictionaries on every request, and
+reduces windows longer than a point budget, see downsample.py.
+"""
+import numpy as np
+import pandas as pd
+
+from downsample import AGGREGATES, aggregate_calendar, lttb_mask
+
+# Series positions shown by the dashboard's ?filter= flag
+FILTERS = {'all': lambda n: np.arange(n),
+           'lower': lambda n: np.setdiff1d(np.arange(n), [0, 1, 2, 3, 14, 15]),
+           'item_header': lambda n: np.arange(min(n, 4))}
+
+
+class SeriesResults(object):
+
+    def __init__(self, categories, interfaces, file_names, counts, outliers, interface_ids=None):
+        # x axis labels: dates for daily results, hours for hourly results
+        self.categories = list(categories)
+        self.interfaces = list(interfaces)
+        self.file_names = list(file_names)
+        # Dense interface ID of every series, e.g. catalog.InterfaceCatalog.interface_ids
+        if interface_ids is None:
+            interface_ids = pd.factorize(pd.Series(self.interfaces, dtype=object))[0]
+        self.interface_ids = np.asarray(interface_ids, dtype=np.int32)
+        self.interface_index = {}
+        for interface, interface_id in zip(self.interfaces, self.interface_ids.tolist()):
+            self.interface_index.setdefault(interface, interface_id)
+        self.counts = np.asarray(counts, dtype=np.int64).reshape(len(self.interfaces), len(self.categories))
+        self.outliers = np.asarray(outliers, dtype=bool).reshape(self.counts.shape)
+        self.counts.setflags(write=False)
+        self.outliers.setflags(write=False)
+
+    @classmethod
+    def from_outliers(cls, categories, outlier_list, interface_ids=None):
+        """
+        Purpose:
+            Packs the output of get_daily_outliers or get_hourly_outliers.
+        Args:
+            categories (list): x axis labels, one per data point
+            outlier_list (list): dictionaries with interface, file_name, data and
+                number_of_outliers
+            interface_ids (array): catalog interface ID of every series, None to
+                number the interfaces here
+        Returns:
+            SeriesResults
+        """
+        counts = np.zeros((len(outlier_list), len(categories)), dtype=np.int64)
+        outliers = np.zeros(counts.shape, dtype=bool)
+        for i, series in enumerate(outlier_list):
+            counts[i] = series['data']
+            outliers[i, series['number_of_outliers']] = True
+        return cls(categories, [series['interface'] for series in outlier_list],
+                   [series['file_name'] for series in outlier_list], counts, outliers, interface_ids)
+
+    def window(self, days=None):
+        """
+        Purpose:
+            Normalizes a ?days= value to the number of trailing points shown.
+        Args:
+            days (str or int): requested number of points
+        Returns:
+            int between 1 and the number of points, all points if days is invalid
+        """
+        total = len(self.categories)
+        days = str(days) if days is not None else ''
+        if days.isdigit() and 0 < int(days) <= total:
+            return int(days)
+        return total
+
+    def select(self, filter_flag='all', interfaces=None):
+        """
+        Purpose:
+            Chooses the series shown for a filter flag and interface subset.
+        Args:
+            filter_flag (str): key of FILTERS, unknown flags show all series
+            interfaces (list): interface names such as SST1771, None for all
+        Returns:
+            Array of series positions
+        """
+        rows = FILTERS.get(filter_flag, FILTERS['all'])(len(self.interfaces))
+        if interfaces:
+            wanted = [self.interface_index[interface] for interface in interfaces if interface in self.interface_index]
+            rows = rows[np.isin(self.interface_ids[rows], wanted)]
+        return rows
+
+    def to_json(self, days=None, filter_flag='all', interfaces=None, points=None, aggregate='lttb'):
+        """
+        Purpose:
+            Builds the JSON document of the API endpoints.
+        Args:
+            days (str or int): trailing number of points, all if omitted
+            filter_flag (str): key of FILTERS
+            interfaces (list): interface names, None for all
+            points (int): point budget of a series, windows beyond it are reduced
+                with aggregate, None or 0 for every point
+            aggregate (str): 'lttb', 'week' or 'month', see downsample.py. Weeks and
+                months need dates as categories
+        Returns:
+            Dictionary with categories, the aggregate applied (None if the window fits
+            the budget) and series of name, interface, file_name, data and outlier
+            positions in data. LTTB series also have x, the category position of
+            every count in data
+        """
+        start = len(self.categories) - self.window(days)
+        rows = self.select(filter_flag, interfaces)
+        categories = self.categories[start:]
+        # A contiguous run of rows, such as every series, is sliced as a view of the arrays.
+        # Other selections are gathered into a copy of just the selected rows
+        if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+            counts = self.counts[rows[0]:rows[-1] + 1, start:]
+            outliers = self.outliers[rows[0]:rows[-1] + 1, start:]
+        else:
+            counts = self.counts[rows, start:]
+            outliers = self.outliers[rows, start:]
+        if not points or len(categories) <= points or aggregate not in AGGREGATES:
+            aggregate = None
+        kept = None
+        if aggregate == 'lttb':
+            # Outliers are kept in addition to the budget
+            kept = lttb_mask(counts, points) | outliers
+        elif aggregate is not None:
+            categories, counts, outliers = aggregate_calendar(categories, counts, outliers, aggregate)
+
+        series = []
+        for i, row in enumerate(rows):
+            document = {'name': self.interfaces[row] + self.file_names[row],
+                        'interface': self.interfaces[row],
+                        'file_name': self.file_names[row]}
+            if kept is None:
+                document['data'] = counts[i].tolist()
+                document['outliers'] = np.flatnonzero(outliers[i]).tolist()
+            else:
+                x = np.flatnonzero(kept[i])
+                document['x'] = x.tolist()
+                document['data'] = counts[i, x].tolist()
+                document['outliers'] = np.flatnonzero(outliers[i, x]).tolist()
+            series.append(document)
+        return {'categories': categories, 'aggregate': aggregate, 'series': series}
+
+    def outlier_share(self):
+        """
+        Returns:
+            Fraction of the series flagged as outliers at each point
+        """
+        if not len(self.interfaces):
+            return np.zeros(len(self.categories))
+        return self.outliers.sum(axis=0) / float(len(self.interfaces))
+
+    def __setstate__(self, state):
+        # Unpickled arrays are writeable again, and results pickled before the interface IDs get them
+        self.__dict__.update(state)
+        if 'interface_ids' not in state:
+            self.__init__(self.categories, self.interfaces, self.file_names, self.counts, self.outliers)
+        self.counts.setflags(write=False)
+        self.outliers.setflags(write=False)
@@ -0,0 +1,279 @@
+"""
+Outlier Scorers
+---
+Pluggable scoring engines used by Outlier.score_models. A scorer is called
+with one file name's training and target arrays and returns the fitted model
+and (y_pred_test, number_of_outlier). The model's predict() labels later
+targets, so the model store can reuse it without a refit.
+    * IsolationForestScorer fits the original Isolation Forest.
+    * PaddedScorer, MedianScorer and FallbackScorer express the noise padded
+      refit and the median rule get_daily_outliers falls back to when every
+      value is labeled an outlier.
+    * HourlyProfileScorer keeps per (weekday, hour) histograms of hourly file
+      counts and flags counts far from their median in units of the median
+      absolute deviation. No forest is fitted, and a rebuild only moves the
+      hours the hourly cube recounted in and out of each stored profile, see
+      Outlier.update_profiles.
+"""
+import numpy as np
+from sklearn.ensemble import IsolationForest
+
+WEEKDAYS = 7
+HOURS = 24
+# Scales a median absolute deviation to the standard deviation of a normal distribution
+MAD_SCALE = 1.4826
+
+
+def fit_model(full_training_array, outliers_fraction=0.3, n_estimators=4, random_state=42):
+    """
+    Purpose:
+        Fits an Isolation Forest from Scikit-learn on training data.
+    Args:
+        full_training_array: array of training data
+        outliers_fraction: estimated outlier percentage
+        n_estimators (int): estimated number of outlier groups
+        random_state (int): seed of the forest
+    Returns:
+        Fitted IsolationForest
+    """
+    rng = np.random.RandomState(random_state)
+    clf = IsolationForest(n_estimators=n_estimators,
+                          random_state=rng,
+                          contamination=outliers_fraction)
+    clf.fit(full_training_array)
+    return clf
+
+
+def label_outliers(clf, val_data):
+    """
+    Purpose:
+        Predicts target data with a fitted model.
+    Args:
+        clf: fitted model with a predict() method, e.g. fit_model()
+        val_data: array of target data
+    Returns:
+        y_pred_test: array of [1 for not outliers and -1 for outliers]
+        number_of_outlier: array of outlier positions in the array
+    """
+    y_pred_test = clf.predict(val_data)
+    number_of_outlier = np.flatnonzero(y_pred_test == -1).tolist()
+    return y_pred_test, number_of_outlier
+
+
+def all_outliers(y_pred_test):
+    """
+    Returns:
+        True if every value of a non-empty prediction is labeled an outlier
+    """
+    return len(y_pred_test) > 0 and bool(np.all(np.asarray(y_pred_test) == -1))
+
+
+class Scorer(object):
+
+    # Whether fitted models can be updated with added and removed rows, see HourlyProfile.add_rows
+    incremental = False
+
+    def fit(self, training_array, outliers_fraction, n_estimate, random_state):
+        """
+        Purpose:
+            Fits a model on one file name's training data.
+        Args:
+            training_array: array of training rows
+            outliers_fraction (float): estimated outlier percentage
+            n_estimate (int): estimated number of outlier groups
+            random_state (int): seed
+        Returns:
+            Model with a predict() method
+        """
+        raise NotImplementedError
+
+    def __call__(self, training_array, target_array, outliers_fraction=.3, n_estimate=8, random_state=42):
+        """
+        Purpose:
+            Fits a model and scores the target data, see Outlier.score_models.
+        Returns:
+            (model, (y_pred_test, number_of_outlier))
+        """
+        model = self.fit(training_array, outliers_fraction, n_estimate, random_state)
+        return model, label_outliers(model, target_array)
+
+    def __repr__(self):
+        # Part of the model store fingerprint, so it only holds the parameters
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join('%s=%r' % item for item in sorted(self.__dict__.items())))
+
+
+class IsolationForestScorer(Scorer):
+
+    def __init__(self, outliers_fraction=None, n_estimate=None):
+        # Fixed parameters, None uses the ones the scorer is called with
+        self.outliers_fraction = outliers_fraction
+        self.n_estimate = n_estimate
+
+    def fit(self, training_array, outliers_fraction, n_estimate, random_state):
+        if self.outliers_fraction is not None:
+            outliers_fraction = self.outliers_fraction
+        if self.n_estimate is not None:
+            n_estimate = self.n_estimate
+        return fit_model(training_array, outliers_fraction, n_estimate, random_state)
+
+
+class PaddedScorer(Scorer):
+
+    def __init__(self, scorer, rows=35):
+        self.scorer = scorer
+        # Number of median rows added to the training data
+        self.rows = rows
+
+    def fit(self, training_array, outliers_fraction, n_estimate, random_state):
+        training_array = np.asarray(training_array)
+        median = np.median(training_array)
+        padding = np.full((self.rows, training_array.shape[1]), int(median))
+        return self.scorer.fit(np.vstack([training_array, padding]), outliers_fraction, n_estimate, random_state)
+
+
+class MedianModel(object):
+
+    def __init__(self, median):
+        self.median = median
+
+    def predict(self, val_data):
+        """
+        Returns:
+            -1 for every value of the first column that differs from the median, 1 otherwise
+        """
+        return np.where(np.asarray(val_data)[:, 0] != self.median, -1, 1)
+
+
+class MedianScorer(Scorer):
+
+    def fit(self, training_array, outliers_fraction, n_estimate, random_state):
+        return MedianModel(np.median(training_array))
+
+
+class FallbackScorer(Scorer):
+
+    def __init__(self, *scorers):
+        # Tried in order until one does not label every target value an outlier
+        self.scorers = list(scorers)
+
+    def __call__(self, training_array, target_array, outliers_fraction=.3, n_estimate=8, random_state=42):
+        for scorer in self.scorers:
+            model, result = scorer(training_array, target_array, outliers_fraction, n_estimate, random_state)
+            if not all_outliers(result[0]):
+                break
+        return model, result
+
+
+class HourlyProfile(object):
+
+    def __init__(self, threshold=3.0, min_scale=1.0):
+        # Counts further than threshold scales from the median are outliers
+        self.threshold = threshold
+        # Smallest scale, hourly counts often have a zero median absolute deviation
+        self.min_scale = min_scale
+        # weekday x hour x file count histogram of the observed hours
+        self.histogram = np.zeros((WEEKDAYS, HOURS, 1), dtype=np.int64)
+        self.median = np.zeros((WEEKDAYS, HOURS))
+        self.scale = np.full((WEEKDAYS, HOURS), float(min_scale))
+        # (weekday, hour) cells whose median and scale are out of date
+        self.dirty = np.zeros((WEEKDAYS, HOURS), dtype=bool)
+
+    def add_rows(self, rows, weight=1):
+        """
+        Purpose:
+            Adds many observed hours at once. A weight of -1 removes them, e.g.
+            a partial day that is replaced by its final counts.
+        Args:
+            rows: array of [day of week, hour, file count] rows
+            weight (int): 1 to add, -1 to remove
+        """
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1, 3)
+        if not len(rows):
+            return
+        self._grow(rows[:, 2].max())
+        np.add.at(self.histogram, (rows[:, 0], rows[:, 1], rows[:, 2]), weight)
+        self.dirty[rows[:, 0], rows[:, 1]] = True
+
+    def predict(self, val_data):
+        """
+        Purpose:
+            Labels target hours.
+        Args:
+            val_data: array of [day of week, hour, file count] rows
+        Returns:
+            Array of [1 for not outliers and -1 for outliers]
+        """
+        rows = np.asarray(val_data, dtype=np.int64).reshape(-1, 3)
+        self._refresh()
+        weekday, hour = rows[:, 0], rows[:, 1]
+        deviation = np.abs(rows[:, 2] - self.median[weekday, hour])
+        return np.where(deviation > self.threshold * self.scale[weekday, hour], -1, 1)
+
+    def _grow(self, count):
+        if count >= self.histogram.shape[2]:
+            bins = max(int(count) + 1, 2 * self.histogram.shape[2])
+            padding = np.zeros((WEEKDAYS, HOURS, bins - self.histogram.shape[2]), dtype=np.int64)
+            self.histogram = np.concatenate([self.histogram, padding], axis=2)
+
+    def _refresh(self):
+        if not self.dirty.any():
+            return
+        cells = np.nonzero(self.dirty)
+        histogram = self.histogram[cells]
+        values = np.arange(histogram.shape[1])
+        median = weighted_median(np.broadcast_to(values, histogram.shape), histogram)
+        deviation = np.abs(values - median[:, None])
+        mad = weighted_median(deviation, histogram)
+        self.median[cells] = median
+        self.scale[cells] = np.maximum(MAD_SCALE * mad, self.min_scale)
+        self.dirty[cells] = False
+
+
+def weighted_median(values, weights):
+    """
+    Purpose:
+        Row-wise median of values repeated by integer weights, as np.median
+        of the expanded rows.
+    Args:
+        values: (rows x bins) array
+        weights: (rows x bins) array of non-negative integer counts
+    Returns:
+        Array of one median per row, 0 for rows without weight
+    """
+    order = np.argsort(values, axis=1, kind='stable')
+    values = np.take_along_axis(values, order, axis=1)
+    cumulative = np.cumsum(np.take_along_axis(weights, order, axis=1), axis=1)
+    total = cumulative[:, -1]
+    lower = (cumulative <= ((total - 1) // 2)[:, None]).sum(axis=1)
+    upper = (cumulative <= (total // 2)[:, None]).sum(axis=1)
+    last = values.shape[1] - 1
+    lower_value = np.take_along_axis(values, np.minimum(lower, last)[:, None], axis=1)[:, 0]
+    upper_value = np.take_along_axis(values, np.minimum(upper, last)[:, None], axis=1)[:, 0]
+    return np.where(total > 0, (lower_value + upper_value) / 2.0, 0.0)
+
+
+class HourlyProfileScorer(Scorer):
+
+    incremental = True
+
+    def __init__(self, threshold=3.0, min_scale=1.0):
+        self.threshold = threshold
+        self.min_scale = min_scale
+
+    def fit(self, training_array, outliers_fraction, n_estimate, random_state):
+        profile = HourlyProfile(self.threshold, self.min_scale)
+        profile.add_rows(training_array)
+        return profile
+
+
+# get_daily_outliers: if the forest labels every day an outlier, noise (median rows) is added to the
+# training data and a smaller forest is refitted; if that still labels every day an outlier, all
+# values other than the median are labeled outliers
+DAILY_SCORER = FallbackScorer(IsolationForestScorer(),
+                              PaddedScorer(IsolationForestScorer(.1, 4), rows=35),
+                              MedianScorer())
+
+# Hourly scorers selectable with Outlier(scorer=...)
+SCORERS = {'forest': IsolationForestScorer(),
+           'profile': HourlyProfileScorer()}
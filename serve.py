@@ -0,0 +1,162 @@
+"""
+Multi-Process Server
+---
+Production serving mode of flaskServer.py. A supervisor process binds the
+port, refreshes the sources and runs the alert evaluator, and starts worker
+processes that accept connections on the inherited listening socket. Workers
+never rebuild: they map the outlier.snapshot files the supervisor publishes,
+so every process reads the same pages instead of holding its own copy of
+the history. Each worker answers requests on threads and scores hours on its
+bounded compute pool, see compute_pool.ComputePool. Dead workers are
+restarted. Response caches and /metrics are per worker.
+
+Workers inherit the socket by file descriptor, which only works on POSIX
+systems. Elsewhere the supervisor serves the routes itself in one process.
+
+    python serve.py --workers 4 --port 8080 --compute-threads 1 --compute-queue 8 --compute-timeout 30
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+log = logging.getLogger(__name__)
+
+# Seconds between checks of the worker processes
+SUPERVISE_INTERVAL = 1.0
+# Seconds given to workers to exit before they are killed
+STOP_TIMEOUT = 10.0
+
+
+class Supervisor(object):
+
+    def __init__(self, host='0.0.0.0', port=8080, workers=2, backlog=128):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.backlog = backlog
+        self.socket = None
+        self.processes = []
+        self.restarts = 0
+        self.stopping = False
+
+    def start(self):
+        """
+        Purpose:
+            Binds the listening socket and starts the worker processes.
+        Returns:
+            self
+        """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(self.backlog)
+        self.socket.set_inheritable(True)
+        self.processes = [self.spawn() for _ in range(self.workers)]
+        log.info('Serving on %s:%d with %d workers', self.host, self.port, self.workers)
+        return self
+
+    def spawn(self):
+        """
+        Returns:
+            Popen of a new worker serving the listening socket
+        """
+        command = [sys.executable, os.path.abspath(__file__), '--host', self.host, '--port', str(self.port),
+                   '--worker-fd', str(self.socket.fileno())]
+        return subprocess.Popen(command, pass_fds=(self.socket.fileno(),))
+
+    def run(self):
+        """
+        Purpose:
+            Restarts workers that exited until stop() is called.
+        """
+        while not self.stopping:
+            for i, process in enumerate(self.processes):
+                if process.poll() is not None and not self.stopping:
+                    log.warning('Worker %d exited with %s, restarting it', process.pid, process.returncode)
+                    self.processes[i] = self.spawn()
+                    self.restarts += 1
+            time.sleep(SUPERVISE_INTERVAL)
+
+    def stop(self, *args):
+        """
+        Purpose:
+            Terminates the workers and closes the socket, usable as a signal handler.
+        """
+        self.stopping = True
+        for process in self.processes:
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.time() + STOP_TIMEOUT
+        for process in self.processes:
+            try:
+                process.wait(max(deadline - time.time(), 0))
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.socket is not None:
+            self.socket.close()
+
+
+def run_worker(host, port, fd):
+    """
+    Purpose:
+        Serves flaskServer.app on threads from an inherited listening socket.
+        The registry and alert threads only run in the supervisor, and the
+        snapshots are loaded without an ingestor watching the sources.
+    Args:
+        host (str): address the socket is bound to
+        port (int): port the socket is bound to
+        fd (int): listening socket
+    """
+    from werkzeug.serving import make_server
+
+    import flaskServer
+    for holder in flaskServer.registry.snapshots.values():
+        holder.ingest = False
+    server = make_server(host, port, flaskServer.app, threaded=True, fd=fd)
+    # The default SIGTERM action would skip closing the socket
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves flaskServer.py from several worker processes.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--compute-threads', type=int, help='scoring threads per worker (OUTLIER_COMPUTE_THREADS)')
+    parser.add_argument('--compute-queue', type=int, help='scoring jobs waiting per worker (OUTLIER_COMPUTE_QUEUE)')
+    parser.add_argument('--compute-timeout', type=float, help='seconds a request waits for scoring '
+                                                              '(OUTLIER_COMPUTE_TIMEOUT)')
+    parser.add_argument('--worker-fd', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(process)d %(name)s %(message)s')
+
+    # Workers inherit the compute pool settings through the environment
+    for name, value in (('OUTLIER_COMPUTE_THREADS', args.compute_threads), ('OUTLIER_COMPUTE_QUEUE', args.compute_queue),
+                        ('OUTLIER_COMPUTE_TIMEOUT', args.compute_timeout)):
+        if value is not None:
+            os.environ[name] = str(value)
+    if args.worker_fd is not None:
+        run_worker(args.host, args.port, args.worker_fd)
+        return
+
+    # Builds or converts the missing snapshots before any worker maps them
+    import flaskServer
+    flaskServer.start()
+    if os.name != 'posix':
+        log.warning('Worker processes need POSIX socket inheritance, serving from this process')
+        flaskServer.app.run(args.host, args.port, threaded=True)
+        return
+    supervisor = Supervisor(args.host, args.port, args.workers).start()
+    signal.signal(signal.SIGTERM, supervisor.stop)
+    signal.signal(signal.SIGINT, supervisor.stop)
+    supervisor.run()
+
+
+if __name__ == '__main__':
+    main()
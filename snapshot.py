@@ -0,0 +1,491 @@
+"""
+Outlier Snapshot
+---
+Versioned on-disk snapshot of the served Outlier results, and the
+process-wide in-memory copy of it. The file starts with a fixed header
+(magic, schema version and length of a JSON description) followed by 64
+byte aligned numpy arrays: the dates, the daily counts and outlier masks,
+the daily features and their outlier mask, the file name and interface
+catalog, the catalog IDs of the served file names and the files received in
+the manifest window. It is written to a
+temporary file and renamed over the old one, mapped read-only on load, and
+only reloaded when its modification stamp changes. A loaded snapshot is a
+StoredOutlier whose arrays are views of the mapping; its hourly cube, model
+store and history are reopened from their own files. Pickles of the Outlier object written by earlier versions are
+converted by migrate_pickle.
+
+    python snapshot.py                 builds every source's snapshot and reports the write and load times
+    python snapshot.py --migrate       converts every source's outlier.pickle instead of building
+    python snapshot.py --time FILE     only times loading FILE
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import cloudpickle
+import numpy as np
+import pandas as pd
+
+from catalog import InterfaceCatalog
+from features import daily_features
+from history_store import HistoryStore
+from hourly_cube import HourlyCube
+from manifest_index import ManifestIndex
+from metrics import stage
+from model_store import ModelStore
+from outlier import INTERFACE_PATTERN, Outlier, create_ingestor
+from results import SeriesResults
+
+log = logging.getLogger(__name__)
+
+# Magic, schema version and length of the JSON description
+HEADER = struct.Struct('<8sII')
+MAGIC = b'GFMSNAP\n'
+# Version of the array layout, readers refuse newer files. 2 added features and feature_outliers
+SCHEMA_VERSION = 2
+# Byte alignment of the description end and of every array
+ALIGNMENT = 64
+
+
+def aligned(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def snapshot_arrays(outlier):
+    """
+    Purpose:
+        Collects what the Flask routes and the refresher read from an Outlier.
+    Args:
+        outlier (Outlier): built or restored object
+    Returns:
+        (dictionary of array name to array, JSON description without the arrays)
+    """
+    results = outlier.daily_results
+    catalog = outlier.catalog
+    manifest = outlier.manifest
+    received = manifest.received_items()
+    arrays = {'dates': np.array(results.categories, dtype='datetime64[D]'),
+              'counts': results.counts,
+              'outliers': results.outliers,
+              'features': outlier.features,
+              'feature_outliers': outlier.feature_results.outliers,
+              'names': np.array(catalog.names, dtype=str),
+              'file_names': np.array(catalog.file_names, dtype=str),
+              'interfaces': np.array(catalog.interface_codes, dtype=str),
+              'interface_ids': catalog.interface_ids,
+              'ids': outlier.ids,
+              'received_days': np.array([day for day, _ in received], dtype='U10'),
+              'received_names': np.array([name for _, name in received], dtype=str)}
+    description = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'rows': int(outlier.row_count),
+                   'config': {'raw_path': outlier.raw_path_pattern, 'db_path': outlier.db_path,
+                              'hourly_path': outlier.hourly_cube.path, 'catalog_path': outlier.catalog.path,
+                              'model_path': outlier.model_store.path,
+                              'history_path': outlier.history.path, 'executor': outlier.executor,
+                              'max_workers': outlier.max_workers, 'name_filter': outlier.name_filter,
+                              'interface_pattern': outlier.interface_pattern, 'scorer': outlier.scorer},
+                   'manifest': {'days': manifest.days, 'window_start': manifest.window_start}}
+    return arrays, description
+
+
+def write_snapshot(outlier, path='outlier.snapshot'):
+    """
+    Purpose:
+        Writes the snapshot of an Outlier to a temporary file and renames it over
+        path, so readers never see a partially written snapshot.
+    Args:
+        outlier (Outlier): object to persist
+        path (str): destination snapshot
+    Returns:
+        None.
+    """
+    arrays, description = snapshot_arrays(outlier)
+    description['schema'] = SCHEMA_VERSION
+    description['arrays'] = {}
+    offset = 0
+    for name, array in arrays.items():
+        arrays[name] = array = np.ascontiguousarray(array)
+        description['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += aligned(array.nbytes)
+    header = json.dumps(description).encode('utf-8')
+    prefix = HEADER.pack(MAGIC, SCHEMA_VERSION, len(header)) + header
+
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as snapshot_file:
+            snapshot_file.write(prefix.ljust(aligned(len(prefix)), b'\0'))
+            for array in arrays.values():
+                snapshot_file.write(array.tobytes())
+                snapshot_file.write(b'\0' * (aligned(array.nbytes) - array.nbytes))
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def read_snapshot(path):
+    """
+    Purpose:
+        Maps a snapshot file without copying its arrays.
+    Args:
+        path (str): snapshot written by write_snapshot
+    Returns:
+        (JSON description, dictionary of array name to read-only array)
+    Raises:
+        ValueError if the file is not a snapshot or has a newer schema
+    """
+    mapping = np.memmap(path, dtype=np.uint8, mode='r')
+    if len(mapping) < HEADER.size:
+        raise ValueError(path + ' is not an outlier snapshot')
+    magic, schema, length = HEADER.unpack_from(mapping, 0)
+    if magic != MAGIC:
+        raise ValueError(path + ' is not an outlier snapshot')
+    if schema > SCHEMA_VERSION:
+        raise ValueError('%s has snapshot schema %d, this version reads up to %d' % (path, schema, SCHEMA_VERSION))
+    description = json.loads(mapping[HEADER.size:HEADER.size + length].tobytes().decode('utf-8'))
+    start = aligned(HEADER.size + length)
+    arrays = {}
+    for name, spec in description['arrays'].items():
+        arrays[name] = np.ndarray(tuple(spec['shape']), dtype=np.dtype(spec['dtype']), buffer=mapping,
+                                  offset=start + spec['offset'])
+    return description, arrays
+
+
+def migrate_pickle(pickle_path, path='outlier.snapshot'):
+    """
+    Purpose:
+        Converts an Outlier pickle of an earlier version into a snapshot. State
+        that older pickles do not have is derived from their training data or
+        takes the Outlier defaults. The pickle itself is left in place.
+    Args:
+        pickle_path (str): outlier.pickle
+        path (str): destination snapshot
+    Returns:
+        None.
+    """
+    with open(pickle_path, 'rb') as outlier_file:
+        outlier = cloudpickle.load(outlier_file)
+    state_dir = os.path.dirname(os.path.abspath(pickle_path))
+    defaults = {'name_filter': 'SST', 'interface_pattern': INTERFACE_PATTERN, 'scorer': 'forest',
+                'executor': 'serial', 'max_workers': None}
+    for name, value in defaults.items():
+        if not hasattr(outlier, name):
+            setattr(outlier, name, value)
+    if 'minute' not in outlier.trainingdf.columns:
+        # Training rows of versions before the vectorized get_df(), with hh:mm times and string hours
+        outlier.trainingdf = upgrade_training_rows(outlier.trainingdf)
+    if not hasattr(outlier, 'names'):
+        outlier.names = list(outlier.trainingdf['name'].unique())
+        outlier.row_count = len(outlier.trainingdf)
+    if not hasattr(outlier, 'catalog'):
+        # IDs in the series order of the pickled results
+        outlier.catalog = InterfaceCatalog(os.path.join(state_dir, 'outlier_catalog.json'), outlier.interface_pattern)
+        outlier.catalog.add(outlier.names)
+    if not hasattr(outlier, 'ids'):
+        outlier.ids = outlier.catalog.ids(outlier.names)
+    if not hasattr(outlier, 'raw_path_pattern'):
+        outlier.raw_path_pattern = outlier.raw_path
+    if not hasattr(outlier, 'db_path'):
+        outlier.db_path = pickled_db_path(outlier, state_dir)
+    if not hasattr(outlier, 'daily_counts'):
+        outlier.daily_counts = outlier.accumulate_sum_per_day_per_name(outlier.trainingdf, outlier.names)
+    if not hasattr(outlier, 'hourly_cube'):
+        outlier.hourly_cube = HourlyCube.load(os.path.join(state_dir, 'outlier_hourly.bin'))
+        outlier.hourly_cube.update(outlier.trainingdf, outlier.catalog.names)
+    if not hasattr(outlier, 'model_store'):
+        outlier.model_store = ModelStore.load(os.path.join(state_dir, 'outlier_models.pickle'))
+    if not hasattr(outlier, 'daily_results'):
+        outlier.daily_results = SeriesResults.from_outliers(outlier.daily_counts['date'].dt.strftime('%Y-%m-%d'),
+                                                            outlier.outliers_dictionary)
+    if not hasattr(outlier, 'feature_results'):
+        outlier.features = daily_features(outlier.trainingdf, outlier.daily_counts['date'], outlier.names)
+        outlier.feature_results = outlier.score_daily_features(outlier.features)
+    if not hasattr(outlier, 'history'):
+        outlier.history = HistoryStore(os.path.join(state_dir, 'outlier_history'))
+    if not hasattr(outlier, 'manifest'):
+        # The received files are recounted by the first rebuild
+        outlier.manifest = ManifestIndex(outlier.db_path, name_filter=outlier.name_filter)
+    write_snapshot(outlier, path)
+    log.info('Converted %s to %s', pickle_path, path)
+
+
+def upgrade_training_rows(df):
+    """
+    Purpose:
+        Converts get_df() rows of the first version, with columns date, time
+        (hh:mm), hour (str), size and name, into the current get_df() format.
+    Args:
+        df (DataFrame): pickled trainingdf
+    Returns:
+        DataFrame with columns: date, hour (int8), minute (int16 minute of the
+        day), size (int64), name (categorical)
+    """
+    clock = df['time'].astype(str).str.split(':', n=1, expand=True).astype(np.int64).values.reshape(-1, 2)
+    return pd.DataFrame({'date': pd.to_datetime(df['date']).values,
+                         'hour': clock[:, 0].astype(np.int8),
+                         'minute': (clock[:, 0] * 60 + clock[:, 1]).astype(np.int16),
+                         'size': df['size'].values.astype(np.int64),
+                         'name': df['name'].astype(str).astype('category').values})
+
+
+def pickled_db_path(outlier, state_dir):
+    """
+    Purpose:
+        Finds list.txt for a pickle that only kept its contents as raw_db. The
+        first version read it from the directory of the DirList CSV; if it is
+        not there anymore, the pickled contents are written to state_dir.
+    Args:
+        outlier (Outlier): unpickled object with raw_path and raw_db
+        state_dir (str): directory of the pickle
+    Returns:
+        Path of list.txt
+    """
+    db_path = os.path.join(os.path.dirname(outlier.raw_path), 'list.txt')
+    if os.path.isfile(db_path):
+        return db_path
+    db_path = os.path.join(state_dir, 'list.txt')
+    if not os.path.isfile(db_path):
+        outlier.raw_db.to_csv(db_path, index=False)
+    return db_path
+
+
+class StoredOutlier(Outlier):
+
+    def __init__(self, path='outlier.snapshot', ingest=True):
+        """
+        Purpose:
+            Restores an Outlier from a snapshot. The daily results are views of the
+            mapped file, hourly results are scored from the reopened hourly cube
+            and model store, and the training data is only read from the history
+            store if a method needs it.
+        Args:
+            path (str): snapshot written by write_snapshot
+            ingest (bool): False for a read-only copy that is never rebuilt, which
+                has no ingestor and so does not watch the monitored directory
+        """
+        description, arrays = read_snapshot(path)
+        config = description['config']
+        self.path = path
+        self.schema = description['schema']
+        self.executor = config['executor']
+        self.max_workers = config['max_workers']
+        self.name_filter = config['name_filter']
+        self.interface_pattern = config['interface_pattern']
+        self.scorer = config['scorer']
+        self.model_store = ModelStore.load(config['model_path'])
+        self.manifest = ManifestIndex(config['db_path'], description['manifest']['days'], config['name_filter'])
+        self.manifest.window_start = description['manifest']['window_start']
+        for day, name in zip(arrays['received_days'].tolist(), arrays['received_names'].tolist()):
+            self.manifest.received.setdefault(day, set()).add(name)
+        # The ingestor starts with a full read on the first rebuild, as an unpickled one did
+        self.ingestor = None
+        if ingest:
+            self.ingestor = create_ingestor(config['raw_path'], config['name_filter'])
+            self.ingestor.observers.append(self.manifest.observe)
+        self.history = HistoryStore.load(config['history_path'])
+        self.raw_path_pattern = config['raw_path']
+        self.raw_path = datetime.today().strftime(config['raw_path'])
+        self.db_path = config['db_path']
+        self.last_updated_hour = ''
+        self.last_updated_day = ''
+        self.row_count = description['rows']
+        interfaces = arrays['interfaces'].tolist()
+        # Snapshots written before the catalog file keep theirs next to the hourly cube
+        if 'catalog_path' in config:
+            catalog_path = config['catalog_path']
+        else:
+            catalog_path = os.path.join(os.path.dirname(config['hourly_path']), 'outlier_catalog.json')
+        self.catalog = InterfaceCatalog.from_arrays(arrays['names'].tolist(),
+                                                    [interfaces[i] for i in arrays['interface_ids'].tolist()],
+                                                    arrays['file_names'].tolist(), catalog_path,
+                                                    self.interface_pattern)
+        # Snapshots written before the served IDs serve every name of the catalog
+        self.ids = arrays['ids'] if 'ids' in arrays else np.arange(len(self.catalog), dtype=np.int32)
+        ids = self.ids.tolist()
+        self.names = [self.catalog.names[i] for i in ids]
+        self.daily_results = SeriesResults(np.datetime_as_string(arrays['dates']).tolist(),
+                                           [self.catalog.interfaces[i] for i in ids],
+                                           [self.catalog.file_names[i] for i in ids], arrays['counts'],
+                                           arrays['outliers'], self.catalog.interface_ids[self.ids])
+        # Snapshots of schema 1 have no features, sources.SourceRegistry.ensure_snapshots rebuilds them
+        self.features = arrays.get('features')
+        self.feature_results = None
+        if self.features is not None:
+            self.feature_results = SeriesResults(self.daily_results.categories, self.daily_results.interfaces,
+                                                 self.daily_results.file_names, arrays['counts'],
+                                                 arrays['feature_outliers'], self.daily_results.interface_ids)
+        self.full_hour_traindata = ''
+        self.hourly_cube = HourlyCube.load(config['hourly_path'])
+        self._trainingdf = None
+        self._trainingdf_lock = threading.Lock()
+
+    @property
+    def trainingdf(self):
+        """
+        Returns:
+            get_df() rows of the history store, read on first use
+        """
+        with self._trainingdf_lock:
+            if self._trainingdf is None:
+                self._trainingdf = self.history.read()
+            return self._trainingdf
+
+
+class Snapshot(object):
+
+    def __init__(self, outlier, version, loaded_at):
+        self.outlier = outlier
+        # (mtime in ns, size, inode) of the file this snapshot was loaded from
+        self.version = version
+        self.loaded_at = loaded_at
+        # Serializes the hourly scoring, which updates the Outlier's model store
+        self.scoring_lock = threading.Lock()
+
+
+class SnapshotHolder(object):
+
+    def __init__(self, path='outlier.snapshot', check_interval=1.0, ingest=True):
+        self.path = path
+        # Seconds between stat() calls on the snapshot file
+        self.check_interval = check_interval
+        # False in processes that only serve the snapshot, see StoredOutlier
+        self.ingest = ingest
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked = 0.0
+
+    def get(self):
+        """
+        Purpose:
+            Returns the current snapshot, loading the file the first time and
+            swapping in a new snapshot when the file has been replaced.
+        Args:
+            None.
+        Returns:
+            Snapshot
+        """
+        snapshot = self._snapshot
+        now = time.time()
+        if snapshot is not None and now - self._checked < self.check_interval:
+            return snapshot
+        version = self.stamp()
+        if snapshot is not None and snapshot.version == version:
+            self._checked = now
+            return snapshot
+        with self._lock:
+            # Another request may have loaded the same version while this one waited
+            if self._snapshot is None or self._snapshot.version != version:
+                self._snapshot = self.load(version)
+            self._checked = now
+            return self._snapshot
+
+    def publish(self, outlier):
+        """
+        Purpose:
+            Atomically writes a freshly built Outlier to the snapshot file and swaps
+            it in as the current snapshot without reloading it from disk.
+        Args:
+            outlier (Outlier): newly built object
+        Returns:
+            Snapshot
+        """
+        with self._lock, stage('snapshot_publish'):
+            write_snapshot(outlier, self.path)
+            self._snapshot = Snapshot(outlier, self.stamp(), time.time())
+            self._checked = time.time()
+            return self._snapshot
+
+    def stamp(self):
+        """
+        Returns:
+            Version stamp of the snapshot file on disk
+        """
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def load(self, version):
+        """
+        Purpose:
+            Maps the snapshot file.
+        Args:
+            version: stamp() of the file
+        Returns:
+            Snapshot
+        """
+        with stage('snapshot_load'):
+            outlier = StoredOutlier(self.path, self.ingest)
+        return Snapshot(outlier, version, time.time())
+
+
+def time_load(path, repeat=5):
+    """
+    Purpose:
+        Times loading a snapshot and serving its daily results, the first time
+        in this process (cold start) and again (reload).
+    Args:
+        path (str): snapshot file
+        repeat (int): number of timed reloads
+    Returns:
+        Dictionary with cold_load_s, cold_first_request_s and reload_s (median)
+    """
+    def load():
+        start = time.perf_counter()
+        outlier = StoredOutlier(path)
+        loaded = time.perf_counter()
+        outlier.daily_results.to_json()
+        return loaded - start, time.perf_counter() - start
+
+    cold_load, cold_request = load()
+    reloads = [load()[0] for _ in range(repeat)]
+    return {'cold_load_s': cold_load, 'cold_first_request_s': cold_request, 'reload_s': statistics.median(reloads)}
+
+
+def report(name, timings):
+    print('%-12s %-34s %10.4fs' % (name, 'cold load', timings['cold_load_s']))
+    print('%-12s %-34s %10.4fs' % (name, 'cold load + /api/daily document', timings['cold_first_request_s']))
+    print('%-12s %-34s %10.4fs' % (name, 'reload (median)', timings['reload_s']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes the snapshot of every source and times loading it.')
+    parser.add_argument('--config', default='sources.json', help='sources.json, the default source without one')
+    parser.add_argument('--migrate', action='store_true', help='convert outlier.pickle instead of building')
+    parser.add_argument('--time', metavar='FILE', help='only time loading a snapshot file')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.time:
+        report(os.path.basename(args.time), time_load(args.time, args.repeat))
+        return
+
+    from sources import SourceRegistry
+    registry = SourceRegistry.load(args.config)
+    for name, source in registry.sources.items():
+        path = registry.snapshots[name].path
+        start = time.perf_counter()
+        if args.migrate:
+            pickle_path = source.state_path('outlier.pickle')
+            with open(pickle_path, 'rb') as outlier_file:
+                cloudpickle.load(outlier_file)
+            print('%-12s %-34s %10.4fs' % (name, 'pickle load (previous format)', time.perf_counter() - start))
+            start = time.perf_counter()
+            migrate_pickle(pickle_path, path)
+            print('%-12s %-34s %10.4fs' % (name, 'migrate', time.perf_counter() - start))
+        else:
+            outlier = source.build(registry.executor, registry.max_workers)
+            print('%-12s %-34s %10.4fs' % (name, 'build', time.perf_counter() - start))
+            start = time.perf_counter()
+            write_snapshot(outlier, path)
+            print('%-12s %-34s %10.4fs' % (name, 'write', time.perf_counter() - start))
+        print('%-12s %-34s %9.2fMB' % (name, path, os.path.getsize(path) / 2.0 ** 20))
+        report(name, time_load(path, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
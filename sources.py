@@ -0,0 +1,278 @@
+"""
+Monitored Sources
+---
+Registry of named DirList sources served by one process. Every source has its
+own CSV, list.txt, file name filter and interface pattern, and keeps its
+snapshot, hourly cube, model store and history in its own state directory.
+All sources are refreshed by one background thread and fit their models on
+the process-wide worker pools, so a new source costs its data instead of
+another Python process with its own copy of pandas and scikit-learn.
+
+sources.json:
+    {"executor": "threads", "max_workers": 4, "interval": 30,
+     "sources": [{"name": "sst", "raw_path": "\\\\hostname\\Summary\\DirList_%m_%d_%Y.csv",
+                  "db_path": "\\\\hostname\\Summary\\list.txt"},
+                 {"name": "dealer", "raw_path": "...", "db_path": "...",
+                  "name_filter": "DLR", "interface_pattern": "(DLR[0-9]{3})",
+                  "scorer": "profile"}]}
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from outlier import INTERFACE_PATTERN, Outlier
+from refresher import Refresher
+from snapshot import SCHEMA_VERSION, SnapshotHolder, migrate_pickle, read_snapshot, write_snapshot
+from watcher import wait_for_changes
+
+log = logging.getLogger(__name__)
+
+# State directory of sources other than the first, under the working directory
+SOURCES_DIR = 'outlier_sources'
+# Seconds to let a burst of file events settle before rebuilding
+SETTLE_SECONDS = 0.5
+
+
+class Source(object):
+
+    def __init__(self, name, raw_path="./data/DirList_06_26_2017.csv", db_path="./data/list.txt",
+                 name_filter='SST', interface_pattern=INTERFACE_PATTERN, state_dir=None, scorer='forest'):
+        self.name = name
+        # raw_path may be a strftime pattern, see Outlier
+        self.raw_path = raw_path
+        self.db_path = db_path
+        self.name_filter = name_filter
+        self.interface_pattern = interface_pattern
+        # Hourly scorer, see scorers.SCORERS
+        self.scorer = scorer
+        # Directory of the source's outlier.snapshot, hourly cube, catalog, model store and history
+        self.state_dir = state_dir or os.path.join(SOURCES_DIR, name)
+
+    @classmethod
+    def from_dict(cls, config):
+        """
+        Purpose:
+            Creates a source from its sources.json entry.
+        Args:
+            config (dict): name and optionally raw_path, db_path, name_filter,
+                interface_pattern, state_dir and scorer
+        Returns:
+            Source
+        """
+        return cls(**config)
+
+    def state_path(self, file_name):
+        """
+        Returns:
+            Path of a state file of this source
+        """
+        return os.path.join(self.state_dir, file_name)
+
+    def build(self, executor='serial', max_workers=None):
+        """
+        Purpose:
+            Builds the source's Outlier object from scratch.
+        Args:
+            executor (str): see outlier.EXECUTORS
+            max_workers (int): size of the shared worker pool
+        Returns:
+            Outlier
+        """
+        if not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir)
+        return Outlier(self.raw_path, self.db_path, hourly_path=self.state_path('outlier_hourly.bin'),
+                       executor=executor, max_workers=max_workers,
+                       model_path=self.state_path('outlier_models.pickle'),
+                       history_path=self.state_path('outlier_history'),
+                       name_filter=self.name_filter, interface_pattern=self.interface_pattern,
+                       scorer=self.scorer, catalog_path=self.state_path('outlier_catalog.json'))
+
+
+class SourceRegistry(object):
+
+    def __init__(self, sources, executor='serial', max_workers=None, interval=30.0, alerts=None):
+        if not sources:
+            raise ValueError('at least one source is required')
+        self.sources = OrderedDict()
+        for source in sources:
+            if source.name in self.sources:
+                raise ValueError('duplicate source name ' + source.name)
+            self.sources[source.name] = source
+        # The first source answers requests that do not name one
+        self.default = sources[0].name
+        self.executor = executor
+        self.max_workers = max_workers
+        # Seconds between checks of the source files
+        self.interval = interval
+        # "alerts" entry of sources.json, see alerts.AlertEvaluator.from_config
+        self.alerts = alerts or {}
+        self.snapshots = OrderedDict((name, SnapshotHolder(source.state_path('outlier.snapshot')))
+                                     for name, source in self.sources.items())
+        # Functions called with (source name, snapshot) after a rebuild and at every
+        # hour boundary, e.g. the hourly anomaly check
+        self.listeners = []
+        # Per source refresh state, all driven by the registry's single thread
+        self.refreshers = OrderedDict((name, Refresher(self.snapshots[name], interval=interval))
+                                      for name in self.sources)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='outlier-sources')
+        self._thread.daemon = True
+
+    @classmethod
+    def load(cls, path='sources.json'):
+        """
+        Purpose:
+            Reads the registry configuration. Without a configuration file the
+            registry holds the single default source, with its state in the
+            working directory as before.
+        Args:
+            path (str): sources.json
+        Returns:
+            SourceRegistry
+        """
+        if not os.path.isfile(path):
+            return cls([Source('default', state_dir='.')])
+        with open(path) as config_file:
+            config = json.load(config_file)
+        sources = [Source.from_dict(source) for source in config['sources']]
+        return cls(sources, config.get('executor', 'serial'), config.get('max_workers'),
+                   config.get('interval', 30.0), config.get('alerts'))
+
+    def resolve(self, name=None):
+        """
+        Purpose:
+            Maps a requested source name to a registered one.
+        Args:
+            name (str): source name, None or empty for the default source
+        Returns:
+            Source name
+        Raises:
+            KeyError if the source is not registered
+        """
+        name = name or self.default
+        if name not in self.sources:
+            raise KeyError(name)
+        return name
+
+    def get(self, name=None):
+        """
+        Purpose:
+            Returns the current snapshot of a source.
+        Args:
+            name (str): source name, None for the default source
+        Returns:
+            Snapshot
+        """
+        return self.snapshots[self.resolve(name)].get()
+
+    def ensure_snapshots(self):
+        """
+        Purpose:
+            Writes the snapshot of every source that has none yet, converting the
+            outlier.pickle of earlier versions or building the source. Snapshots
+            of an older schema are rebuilt.
+        """
+        for name, source in self.sources.items():
+            path = self.snapshots[name].path
+            if os.path.isfile(path):
+                if read_snapshot(path)[0]['schema'] >= SCHEMA_VERSION:
+                    continue
+                log.info('Rebuilding the snapshot of source %s, its schema is older than %d', name, SCHEMA_VERSION)
+                write_snapshot(source.build(self.executor, self.max_workers), path)
+                continue
+            if os.path.isfile(source.state_path('outlier.pickle')):
+                try:
+                    migrate_pickle(source.state_path('outlier.pickle'), path)
+                    continue
+                except Exception:
+                    log.exception('Converting the outlier.pickle of source %s failed, rebuilding it', name)
+            write_snapshot(source.build(self.executor, self.max_workers), path)
+
+    def start(self):
+        """
+        Purpose:
+            Starts refreshing every source in one daemon thread.
+        """
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Purpose:
+            Stops the thread after its current round of checks.
+        """
+        self._stop.set()
+        self._thread.join()
+
+    def run(self):
+        hour = time.localtime().tm_hour
+        while not self._stop.is_set():
+            rebuilt = self.refresh()
+            # Rebuilds are checked at once, every source once an hour has passed
+            if time.localtime().tm_hour != hour:
+                hour = time.localtime().tm_hour
+                rebuilt = list(self.sources)
+            self.notify(rebuilt)
+            self.wait()
+
+    def wait(self):
+        """
+        Purpose:
+            Sleeps until a watched source directory changed, the next hour
+            starts or the refresh interval passed, whichever comes first.
+        """
+        now = datetime.now()
+        next_hour = (now.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1) - now).total_seconds()
+        ingestors = [self.snapshots[name].get().outlier.ingestor for name in self.sources]
+        ingestors = [ingestor for ingestor in ingestors if getattr(ingestor, 'fileno', None) is not None]
+        if wait_for_changes(ingestors, min(self.interval, next_hour + 1), self._stop):
+            self._stop.wait(SETTLE_SECONDS)
+
+    def notify(self, names):
+        """
+        Purpose:
+            Calls the listeners for the current snapshot of each source.
+        Args:
+            names (list): source names
+        """
+        for name in names:
+            snapshot = self.snapshots[name].get()
+            for listener in self.listeners:
+                try:
+                    listener(name, snapshot)
+                except Exception:
+                    log.exception('Listener of source %s failed', name)
+
+    def refresh(self, force=False):
+        """
+        Purpose:
+            Rebuilds every source whose files changed, one after the other so
+            the builds share the worker pools instead of competing for them.
+        Args:
+            force (bool): rebuild even if nothing changed
+        Returns:
+            List of the names of the rebuilt sources
+        """
+        rebuilt = []
+        for name, refresher in self.refreshers.items():
+            try:
+                if refresher.refresh(force):
+                    rebuilt.append(name)
+            except Exception:
+                log.exception('Refresh of source %s failed', name)
+        return rebuilt
+
+    def status(self):
+        """
+        Returns:
+            Dictionary of source name to its refresher status
+        """
+        status = OrderedDict()
+        for name, refresher in self.refreshers.items():
+            status[name] = refresher.status()
+            status[name]['running'] = self._thread.is_alive()
+        return status
@@ -0,0 +1,45 @@
+import json
+
+import numpy as np
+
+from benchmarks.synthetic import make_names, write_dirlist, write_manifest
+from catalog import InterfaceCatalog
+from outlier import Outlier
+from snapshot import StoredOutlier, write_snapshot
+
+
+def test_ids_are_kept_across_loads(tmp_path):
+    path = str(tmp_path / 'catalog.json')
+    catalog = InterfaceCatalog(path).add(['SST0001_A', 'SST0002_A', 'SST0001_B'])
+    catalog.add(['SST0003_A', 'SST0001_B'])
+    loaded = InterfaceCatalog.load(path)
+    assert loaded.names == ['SST0001_A', 'SST0002_A', 'SST0001_B', 'SST0003_A']
+    np.testing.assert_array_equal(loaded.ids(['SST0003_A', 'SST0001_A', 'SST9999_X']), [3, 0, -1])
+    np.testing.assert_array_equal(loaded.interface_ids, [0, 1, 0, 2])
+
+
+def test_names_without_history_are_not_served(tmp_path):
+    raw_path = write_dirlist(str(tmp_path / 'DirList.csv'), 2000, n_names=6, days=30)
+    db_path = write_manifest(str(tmp_path / 'list.txt'), make_names(6))
+    fresh = Outlier(raw_path, db_path, catalog_path=None)
+    # A catalog left over from another source lists names this history does not have
+    catalog_path = str(tmp_path / 'outlier_catalog.json')
+    with open(catalog_path, 'w') as catalog_file:
+        json.dump({'names': ['SST9990_STALE', 'SST9991_STALE']}, catalog_file)
+
+    outlier = Outlier(raw_path, db_path, hourly_path=str(tmp_path / 'hourly.bin'), catalog_path=catalog_path)
+    # The stale names keep their IDs and cube columns but are not served
+    assert outlier.catalog.names == ['SST9990_STALE', 'SST9991_STALE'] + fresh.names
+    assert outlier.hourly_cube.names == outlier.catalog.names
+    np.testing.assert_array_equal(outlier.ids, np.arange(2, 2 + len(fresh.names)))
+    assert outlier.names == fresh.names
+    assert outlier.get_hourly_outliers('2017-01-15') == fresh.get_hourly_outliers('2017-01-15')
+    assert outlier.daily_results.interfaces == fresh.daily_results.interfaces
+    np.testing.assert_array_equal(outlier.daily_results.counts, fresh.daily_results.counts)
+    for filter_flag in ('all', 'lower', 'item_header'):
+        assert outlier.daily_results.to_json(None, filter_flag) == fresh.daily_results.to_json(None, filter_flag)
+    write_snapshot(outlier, str(tmp_path / 'outlier.snapshot'))
+    stored = StoredOutlier(str(tmp_path / 'outlier.snapshot'))
+    assert stored.names == fresh.names
+    for filter_flag in ('all', 'lower', 'item_header'):
+        assert stored.daily_results.to_json(None, filter_flag) == fresh.daily_results.to_json(None, filter_flag)
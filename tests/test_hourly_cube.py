@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from hourly_cube import HourlyCube
+
+
+def make_rows(n_rows=3000, days=30, seed=0):
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame({'date': pd.Timestamp('2017-01-01') + pd.to_timedelta(rng.randint(0, days, n_rows), unit='D'),
+                       'hour': rng.randint(0, 24, n_rows).astype(np.int8),
+                       'name': pd.Categorical(rng.choice(['SST0001_A', 'SST0002_A', 'SST0003_B'], n_rows))})
+    return df.sort_values('date', kind='mergesort').reset_index(drop=True)
+
+
+def with_rows(df, dates, hours, names):
+    late = pd.DataFrame({'date': pd.to_datetime(dates), 'hour': np.array(hours, dtype=np.int8),
+                         'name': pd.Categorical(names)})
+    return pd.concat([df, late]).sort_values('date', kind='mergesort').reset_index(drop=True)
+
+
+@pytest.mark.parametrize('persisted', [False, True])
+def test_update_recounts_changed_earlier_days(tmp_path, persisted):
+    df = make_rows()
+    cube = HourlyCube(str(tmp_path / 'hourly.bin') if persisted else None).update(df)
+    late = with_rows(df, ['2017-01-15', '2017-01-03', '2017-01-31'], [10, 5, 0], ['SST0001_A', 'SST0003_B', 'SST0002_A'])
+
+    cube.update(late, days=['2017-01-03', '2017-01-15', '2017-01-31'])
+    np.testing.assert_array_equal(np.asarray(cube.counts), HourlyCube.from_df(late).counts)
+    # The changed days and the stored last day are recounted, the new day is added
+    assert cube.delta['dates'].strftime('%Y-%m-%d').tolist() == ['2017-01-03', '2017-01-15', '2017-01-30',
+                                                                 '2017-01-31']
+    assert len(cube.delta['removed']) == 3 and len(cube.delta['added']) == 4
+    if persisted:
+        np.testing.assert_array_equal(np.asarray(HourlyCube.load(cube.path).counts), HourlyCube.from_df(late).counts)
+
+
+def test_update_without_changed_days_keeps_earlier_counts():
+    df = make_rows()
+    cube = HourlyCube.from_df(df)
+    before = cube.day('2017-01-15').copy()
+    cube.update(with_rows(df, ['2017-01-15'], [10], ['SST0001_A']))
+    np.testing.assert_array_equal(cube.day('2017-01-15'), before)
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from compute_pool import ComputePool
+from metrics import SlowRequestProfiler, sampled_call
+
+
+def busy_pool_job(seconds):
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        pass
+    return threading.get_ident()
+
+
+def profile_lines(path):
+    with open(path) as profile_file:
+        return profile_file.read().splitlines()
+
+
+def test_profile_samples_the_compute_pool_thread(tmp_path):
+    profiler = SlowRequestProfiler(0.0, str(tmp_path), interval=.002)
+    pool = ComputePool()
+    state = profiler.start()
+    pool_thread = pool.run(busy_pool_job, .2, profile=state)
+    path = profiler.stop(state, '/api/hourly?date=2017-01-15')
+
+    assert pool_thread != threading.get_ident()
+    # The request thread only waits for the job, the work is sampled on the pool thread
+    assert any('busy_pool_job' in line for line in profile_lines(path))
+    assert state['threads'] == {threading.get_ident()}
+
+
+def test_profile_without_a_handle_samples_only_the_request(tmp_path):
+    profiler = SlowRequestProfiler(0.0, str(tmp_path), interval=.002)
+    pool = ComputePool()
+    state = profiler.start()
+    pool.run(busy_pool_job, .1)
+    path = profiler.stop(state, '/api/counter')
+    assert not any('busy_pool_job' in line for line in profile_lines(path))
+
+
+def test_sampled_call_while_sampling(tmp_path, monkeypatch):
+    errors = []
+    monkeypatch.setattr(threading, 'excepthook', errors.append)
+    profiler = SlowRequestProfiler(0.0, str(tmp_path), interval=0)
+    state = profiler.start()
+    threads = [threading.Thread(target=lambda: [sampled_call(state, busy_pool_job, 0) for _ in range(2000)])
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    profiler.stop(state, '/')
+    # Threads joining and leaving the profile never break the sampler
+    assert errors == []
+    assert state['threads'] == {threading.get_ident()}
+    assert sampled_call(None, busy_pool_job, 0) == threading.get_ident()
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import make_names, write_dirlist, write_manifest
+from outlier import Outlier
+
+
+def persisted(directory, raw_path, db_path, scorer):
+    return Outlier(raw_path, db_path, hourly_path=str(directory / 'hourly.bin'),
+                   model_path=str(directory / 'models.pickle'), history_path=str(directory / 'history'),
+                   catalog_path=str(directory / 'catalog.json'), scorer=scorer)
+
+
+@pytest.mark.parametrize('scorer', ['forest', 'profile'])
+def test_late_row_on_an_old_day(tmp_path, scorer):
+    raw_path = write_dirlist(str(tmp_path / 'DirList.csv'), 3000, n_names=5, days=40)
+    db_path = write_manifest(str(tmp_path / 'list.txt'), make_names(5))
+    (tmp_path / 'state').mkdir()
+    (tmp_path / 'fresh').mkdir()
+    outlier = persisted(tmp_path / 'state', raw_path, db_path, scorer)
+    name = outlier.names[0]
+    before = outlier.hourly_cube.day('2017-01-15')[10, 0]
+
+    # CSVGetter.ps1 lists a file that arrived late for an old day next to a new day's file
+    with open(raw_path, 'a') as csv_file:
+        csv_file.write('01.15.2017,10:30,1024,%s_20170115103000.dat\n' % name)
+        csv_file.write('02.10.2017,08:00,1024,%s_20170210080000.dat\n' % name)
+    outlier = outlier.refreshed()
+    fresh = persisted(tmp_path / 'fresh', raw_path, db_path, scorer)
+
+    assert '2017-01-15' in outlier.history_days
+    assert outlier.hourly_cube.day('2017-01-15')[10, 0] == before + 1
+    np.testing.assert_array_equal(np.asarray(outlier.hourly_cube.counts), np.asarray(fresh.hourly_cube.counts))
+    np.testing.assert_array_equal(outlier.daily_results.counts, fresh.daily_results.counts)
+    for date in ('2017-01-15', '2017-02-10'):
+        assert outlier.get_hourly_outliers(date) == fresh.get_hourly_outliers(date)
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+from hourly_cube import HourlyCube
+from scorers import SCORERS, HourlyProfile, weighted_median
+
+
+def hourly_rows(days=60, seed=0):
+    rng = np.random.RandomState(seed)
+    dates = pd.date_range('2017-01-01', periods=days)
+    weekdays = np.repeat(dates.dayofweek.values, 24)
+    hours = np.tile(np.arange(24), days)
+    return np.column_stack([weekdays, hours, rng.poisson(3, days * 24)])
+
+
+def test_weighted_median_matches_np_median():
+    rng = np.random.RandomState(1)
+    weights = rng.randint(0, 4, (50, 12))
+    weights[0] = 0
+    values = np.broadcast_to(np.arange(12), weights.shape)
+    expected = [np.median(np.repeat(row_values, row_weights)) if row_weights.sum() else 0.0
+                for row_values, row_weights in zip(values, weights)]
+    np.testing.assert_array_equal(weighted_median(values, weights), expected)
+
+
+def test_profile_update_matches_refit():
+    rows = hourly_rows()
+    scorer = SCORERS['profile']
+    profile = scorer.fit(rows, .06, 24, 0)
+    # The last 3 days are recounted: their old rows are removed and the new ones added
+    recounted = rows[-72:].copy()
+    recounted[:, 2] = np.random.RandomState(2).poisson(8, 72)
+    profile.predict(rows)
+    profile.add_rows(rows[-72:], -1)
+    profile.add_rows(recounted)
+    refit = scorer.fit(np.vstack([rows[:-72], recounted]), .06, 24, 0)
+
+    np.testing.assert_array_equal(profile.histogram[:, :, :refit.histogram.shape[2]], refit.histogram)
+    assert not profile.histogram[:, :, refit.histogram.shape[2]:].any()
+    target = hourly_rows(days=14, seed=3)
+    target[:, 2] *= 3
+    np.testing.assert_array_equal(profile.predict(target), refit.predict(target))
+    np.testing.assert_array_equal(profile.median, refit.median)
+    np.testing.assert_array_equal(profile.scale, refit.scale)
+
+
+def test_profile_follows_cube_delta():
+    rng = np.random.RandomState(4)
+    n_rows = 4000
+    df = pd.DataFrame({'date': pd.Timestamp('2017-01-01') + pd.to_timedelta(rng.randint(0, 40, n_rows), unit='D'),
+                       'hour': rng.randint(0, 24, n_rows).astype(np.int8),
+                       'name': pd.Categorical(rng.choice(['SST0001_A', 'SST0002_A'], n_rows))})
+    df = df.sort_values('date', kind='mergesort').reset_index(drop=True)
+    cube = HourlyCube.from_df(df[df['date'] < '2017-02-05'])
+    profile = HourlyProfile()
+    profile.add_rows(cube.training_rows('SST0001_A'))
+
+    late = pd.DataFrame({'date': pd.to_datetime(['2017-01-20'] * 5), 'hour': np.full(5, 9, dtype=np.int8),
+                         'name': pd.Categorical(['SST0001_A'] * 5)})
+    df = pd.concat([df, late]).sort_values('date', kind='mergesort').reset_index(drop=True)
+    cube.update(df, days=['2017-01-20'])
+    column = cube.name_index['SST0001_A']
+    profile.add_rows(cube.block_rows(cube.delta['dates'], cube.delta['removed'], column), -1)
+    profile.add_rows(cube.block_rows(cube.delta['dates'], cube.delta['added'], column))
+    refit = HourlyProfile()
+    refit.add_rows(cube.training_rows('SST0001_A'))
+    width = refit.histogram.shape[2]
+    np.testing.assert_array_equal(profile.histogram[:, :, :width], refit.histogram)
+    assert not profile.histogram[:, :, width:].any()
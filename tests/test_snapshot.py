@@ -0,0 +1,100 @@
+import json
+import os
+import subprocess
+import sys
+
+import cloudpickle
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_names, write_dirlist, write_manifest
+from outlier import Outlier
+from snapshot import StoredOutlier, migrate_pickle, write_snapshot
+
+# Attributes of the Outlier object the first version pickled, next to trainingdf and raw_db
+BASELINE_ATTRIBUTES = ('raw_path', 'last_updated_hour', 'last_updated_day', 'outliers_dictionary',
+                       'full_hour_traindata')
+
+
+def baseline_trainingdf(raw_path):
+    # get_df() of the first version: date, time (hh:mm), hour (str), size and name columns
+    raw_df = pd.read_csv(raw_path)
+    raw_df = raw_df[raw_df['name'].str.match('.*SST.*')].reset_index(drop=True)
+    raw_df['name'] = raw_df['name'].str.replace(r"_20[0-9]*.*$", "", regex=True)
+    raw_df['date'] = pd.to_datetime(raw_df['date'].str.replace('.', ''), format='%m%d%Y')
+    raw_df.insert(2, 'hour', raw_df['time'].str.split(':').str[0])
+    return raw_df.sort_values('date', kind='mergesort').reset_index(drop=True)
+
+
+def baseline_pickle(outlier, path):
+    baseline = Outlier.__new__(Outlier)
+    for name in BASELINE_ATTRIBUTES:
+        setattr(baseline, name, getattr(outlier, name))
+    baseline.trainingdf = baseline_trainingdf(outlier.raw_path)
+    assert list(baseline.trainingdf.columns) == ['date', 'time', 'hour', 'size', 'name']
+    baseline.raw_db = pd.read_csv(outlier.db_path)
+    with open(path, 'wb') as outlier_file:
+        cloudpickle.dump(baseline, outlier_file)
+
+
+def test_migrate_baseline_pickle(tmp_path):
+    data_dir = tmp_path / 'data'
+    state_dir = tmp_path / 'state'
+    data_dir.mkdir()
+    state_dir.mkdir()
+    raw_path = write_dirlist(str(data_dir / 'DirList_06_26_2017.csv'), 3000, n_names=6, days=40)
+    db_path = write_manifest(str(data_dir / 'list.txt'), make_names(6))
+    outlier = Outlier(raw_path, db_path, catalog_path=None)
+    baseline_pickle(outlier, str(state_dir / 'outlier.pickle'))
+
+    migrate_pickle(str(state_dir / 'outlier.pickle'), str(state_dir / 'outlier.snapshot'))
+    stored = StoredOutlier(str(state_dir / 'outlier.snapshot'))
+    assert stored.db_path == db_path
+    assert stored.raw_path_pattern == raw_path
+    assert stored.names == outlier.names
+    assert list(stored.daily_results.categories) == list(outlier.daily_results.categories)
+    np.testing.assert_array_equal(stored.daily_results.counts, outlier.daily_results.counts)
+    np.testing.assert_array_equal(stored.daily_results.outliers, outlier.daily_results.outliers)
+    np.testing.assert_array_equal(stored.features, outlier.features)
+    assert stored.hourly_cube.counts.sum() == len(outlier.trainingdf)
+    assert os.path.isfile(str(state_dir / 'outlier_catalog.json'))
+
+
+def test_migrate_baseline_pickle_without_list(tmp_path):
+    raw_path = write_dirlist(str(tmp_path / 'DirList_06_26_2017.csv'), 1000, n_names=4, days=20)
+    db_path = write_manifest(str(tmp_path / 'manifest.txt'), make_names(4))
+    outlier = Outlier(raw_path, db_path, catalog_path=None)
+    state_dir = tmp_path / 'state'
+    state_dir.mkdir()
+    baseline_pickle(outlier, str(state_dir / 'outlier.pickle'))
+
+    migrate_pickle(str(state_dir / 'outlier.pickle'), str(state_dir / 'outlier.snapshot'))
+    stored = StoredOutlier(str(state_dir / 'outlier.snapshot'))
+    # The pickled list.txt contents are written next to the pickle
+    assert stored.db_path == str(state_dir / 'list.txt')
+    assert sorted(pd.read_csv(stored.db_path).columns) == sorted(pd.read_csv(db_path).columns)
+    assert stored.manifest.missing() == outlier.manifest.missing()
+
+
+def test_importing_the_app_builds_no_snapshot(tmp_path):
+    raw_path = write_dirlist(str(tmp_path / 'DirList.csv'), 500, n_names=3, days=10)
+    db_path = write_manifest(str(tmp_path / 'list.txt'), make_names(3))
+    with open(str(tmp_path / 'sources.json'), 'w') as sources_file:
+        json.dump({'sources': [{'name': 'test', 'raw_path': raw_path, 'db_path': db_path, 'state_dir': '.'}]},
+                  sources_file)
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, '-c', 'import flaskServer'], cwd=str(tmp_path), check=True,
+                   env=dict(os.environ, PYTHONPATH=repo))
+    assert not os.path.exists(str(tmp_path / 'outlier.snapshot'))
+
+
+def test_read_only_snapshot_has_no_ingestor(tmp_path):
+    raw_path = write_dirlist(str(tmp_path / 'DirList.csv'), 1000, n_names=4, days=20)
+    db_path = write_manifest(str(tmp_path / 'list.txt'), make_names(4))
+    outlier = Outlier(raw_path, db_path, hourly_path=str(tmp_path / 'hourly.bin'), catalog_path=None)
+    write_snapshot(outlier, str(tmp_path / 'outlier.snapshot'))
+
+    stored = StoredOutlier(str(tmp_path / 'outlier.snapshot'), ingest=False)
+    assert stored.ingestor is None
+    assert stored.daily_results.to_json() == outlier.daily_results.to_json()
+    assert stored.get_hourly_outliers('2017-01-15') == outlier.get_hourly_outliers('2017-01-15')
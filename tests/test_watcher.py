@@ -0,0 +1,70 @@
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from outlier import create_ingestor
+from watcher import IN_CLOSE_WRITE, DirectoryIngestor, libc, wait_for_changes
+
+linux = pytest.mark.skipif(not sys.platform.startswith('linux') or libc() is None, reason='inotify is Linux only')
+
+
+def drop(directory, name, size=1024):
+    with open(os.path.join(directory, name), 'wb') as data_file:
+        data_file.write(b'x' * size)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(.05)
+    return condition()
+
+
+@linux
+def test_create_ingestor_watches_before_the_first_read(tmp_path):
+    ingestor = create_ingestor(str(tmp_path), name_filter='SST')
+    assert isinstance(ingestor, DirectoryIngestor)
+    assert ingestor.fileno() is not None
+    assert ingestor.stats['full'] == 0
+
+    # A file dropped before the first read is reported by the watch and listed by the read
+    drop(str(tmp_path), 'SST_A_20170626120000.dat')
+    events = []
+    assert wait_for(lambda: events.extend(ingestor.watch.read_events()) or events)
+    assert (IN_CLOSE_WRITE, 'SST_A_20170626120000.dat') in [(mask & IN_CLOSE_WRITE, name) for mask, name in events]
+    version = ingestor.poll()
+    assert ingestor.stats == {'full': 1, 'events': 0, 'scans': 0, 'parsed_rows': 1}
+    assert ingestor.fileno() is not None
+
+    # Later files arrive as inotify events, not scans
+    drop(str(tmp_path), 'SST_B_20170626120500.dat')
+    drop(str(tmp_path), 'other.dat')
+    assert wait_for(lambda: ingestor.poll() == version + 2)
+    assert ingestor.stats['events'] >= 2 and ingestor.stats['scans'] == 0
+    assert sorted(ingestor.frame['name']) == ['SST_A', 'SST_B']
+    ingestor.close()
+
+
+@linux
+def test_wait_for_changes_wakes_on_a_dropped_file(tmp_path):
+    ingestor = DirectoryIngestor(lambda raw_df: raw_df, backend='inotify').start(str(tmp_path))
+    ingestor.poll()
+
+    begin = time.time()
+    drop(str(tmp_path), datetime.now().strftime('SST_A_%Y%m%d%H%M%S.dat'))
+    assert wait_for_changes([ingestor], 10.0, threading.Event())
+    assert time.time() - begin < 5.0
+    ingestor.close()
+
+
+def test_scan_backend_sees_dropped_files(tmp_path):
+    ingestor = DirectoryIngestor(lambda raw_df: raw_df, backend='scan').start(str(tmp_path))
+    assert ingestor.fileno() is None
+    assert ingestor.poll() == 0
+    drop(str(tmp_path), 'SST_A_20170626120000.dat')
+    assert ingestor.poll() == 1
+    assert ingestor.stats['scans'] == 1
@@ -0,0 +1,371 @@
+"""
+Directory Watcher Ingestion
+---
+Reads the monitored drop directory directly instead of the listing that
+CSVGetter.ps1 dumps every 5 minutes. DirectoryIngestor has the interface of
+ingest.DirListIngestor: the first read lists the directory, later reads
+only stat the files that changed. Changes come from inotify on Linux, bound
+with ctypes, and from comparing directory scans elsewhere or when inotify is
+unavailable. Every file becomes the row CSVGetter.ps1 would have written
+(date, time, size, name), so the normalized rows, row hashes and history
+digests are the same in both modes.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from ingest import concat_rows
+from metrics import ROWS_INGESTED
+
+log = logging.getLogger(__name__)
+
+# inotify event masks, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+# Events after which the watch is gone or incomplete and the directory is rescanned
+RESCAN_MASK = IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF
+# struct inotify_event: wd, mask, cookie, len, followed by len bytes of name
+EVENT_HEADER = struct.Struct('iIII')
+# Ways of detecting changes in the watched directory
+BACKENDS = ('auto', 'inotify', 'scan')
+
+_libc = None
+
+
+def libc():
+    """
+    Returns:
+        The C library with inotify functions, or None if it has none
+    """
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith('linux'):
+            try:
+                library = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                library.inotify_init1.argtypes = [ctypes.c_int]
+                library.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+                _libc = library
+            except (OSError, AttributeError):
+                log.warning('inotify is not available, the directory is scanned instead')
+    return _libc or None
+
+
+class Inotify(object):
+
+    def __init__(self, path, mask=WATCH_MASK):
+        library = libc()
+        if library is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = library.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        if library.inotify_add_watch(self.fd, os.fsencode(path), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, os.strerror(error), path)
+
+    def fileno(self):
+        return self.fd
+
+    def read_events(self):
+        """
+        Purpose:
+            Drains the pending events without blocking.
+        Returns:
+            List of (mask, file name) tuples
+        """
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((mask, name))
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __del__(self):
+        # Every reloaded snapshot starts a watch, the replaced ones must not leak descriptors
+        self.close()
+
+
+class DirectoryIngestor(object):
+
+    def __init__(self, normalize, observers=None, backend='auto'):
+        if backend not in BACKENDS:
+            raise ValueError('backend must be one of ' + ', '.join(BACKENDS))
+        # Function turning raw DirList rows into get_df() format, extra columns are kept
+        self.normalize = normalize
+        # Functions called with every block of new raw rows, e.g. ManifestIndex.observe
+        self.observers = list(observers or [])
+        self.backend = backend
+        self.path = None
+        self.watch = None
+        # File name -> (row_hash, (mtime in ns, size)) of the listed files
+        self.files = {}
+        self.frame = None
+        # Number of changes applied since the first read, see poll()
+        self.version = 0
+        self.stats = {'full': 0, 'events': 0, 'scans': 0, 'parsed_rows': 0}
+
+    def read(self, path):
+        """
+        Purpose:
+            Brings the in-memory rows up to date with the directory at path.
+        Args:
+            path (str): watched directory
+        Returns:
+            DataFrame in get_df() format sorted by date
+        """
+        path = os.path.abspath(path)
+        if path != self.path or self.frame is None:
+            self._full(path, renew=path != self.path)
+        else:
+            self._changes()
+        return self.frame.drop(columns='row_hash')
+
+    def poll(self):
+        """
+        Purpose:
+            Applies the pending changes without blocking, see refresher.Refresher.
+        Returns:
+            Number of changes applied so far, None before the first read
+        """
+        if self.path is None:
+            return None
+        if self.frame is None:
+            self._full(self.path, renew=False)
+        else:
+            self._changes()
+        return self.version
+
+    def start(self, path):
+        """
+        Purpose:
+            Watches the directory at path before it is first read, so that the
+            build and the snapshot serving its rows wait on inotify events
+            instead of scanning, see create_ingestor.
+        Args:
+            path (str): watched directory
+        Returns:
+            self
+        """
+        path = os.path.abspath(path)
+        if path != self.path or self.watch is None:
+            self.close()
+            self.path = path
+            self._watch()
+        return self
+
+    def fileno(self):
+        """
+        Returns:
+            inotify file descriptor that is readable when the directory changed,
+            None when the directory is scanned
+        """
+        return self.watch.fileno() if self.watch is not None else None
+
+    def _full(self, path, renew=True):
+        # A watch opened by start() already covers the listing, events queued
+        # since then only name files the listing finds unchanged
+        if renew or path != self.path or self.watch is None:
+            self.close()
+            self.path = path
+            self._watch()
+        self.files = {}
+        self.frame = None
+        self._apply(*self._scan_changes())
+        self.stats['full'] += 1
+
+    def _watch(self):
+        if self.backend == 'scan':
+            return
+        # Watching starts before the listing so no file falls between them
+        try:
+            self.watch = Inotify(self.path)
+        except OSError as error:
+            if self.backend == 'inotify':
+                raise
+            log.warning('Scanning %s, inotify failed: %s', self.path, error)
+
+    def _changes(self):
+        if self.watch is None:
+            self.stats['scans'] += 1
+            self._apply(*self._scan_changes())
+            return
+        events = self.watch.read_events()
+        if not events:
+            return
+        self.stats['events'] += len(events)
+        if any(mask & RESCAN_MASK for mask, _ in events):
+            # Overflowed queue or the directory itself moved: the watch is renewed
+            self._full(self.path)
+            return
+        changed = set()
+        removed = set()
+        for mask, name in events:
+            if mask & IN_ISDIR:
+                continue
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                removed.add(name)
+                changed.discard(name)
+            else:
+                changed.add(name)
+                removed.discard(name)
+        stats = {}
+        for name in changed:
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                removed.add(name)
+                continue
+            if self.files.get(name, (None, None))[1] != (stat.st_mtime_ns, stat.st_size):
+                stats[name] = stat
+        self._apply(stats, removed & set(self.files))
+
+    def _scan_changes(self):
+        stats = {}
+        listed = set()
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                listed.add(entry.name)
+                if self.files.get(entry.name, (None, None))[1] != (stat.st_mtime_ns, stat.st_size):
+                    stats[entry.name] = stat
+        return stats, set(self.files) - listed
+
+    def _apply(self, stats, removed):
+        if self.frame is not None and not stats and not removed:
+            return
+        names = sorted(stats)
+        lines = [file_line(name, stats[name]) for name in names]
+        hashes = hash_lines(lines)
+        raw_df = pd.DataFrame([line.split(',', 3) for line in lines], columns=['date', 'time', 'size', 'name'])
+        raw_df['size'] = raw_df['size'].astype(np.int64)
+        raw_df['row_hash'] = hashes
+        if len(raw_df):
+            for observer in self.observers:
+                observer(raw_df)
+        new_rows = self.normalize(raw_df)
+        # Rows of rewritten and removed files are replaced
+        gone = [self.files.pop(name)[0] for name in removed.union(names) if name in self.files]
+        for name, row_hash in zip(names, hashes):
+            self.files[name] = (row_hash, (stats[name].st_mtime_ns, stats[name].st_size))
+        if self.frame is None:
+            frame = new_rows
+        else:
+            kept = self.frame[~np.isin(self.frame['row_hash'].values, np.array(gone, dtype=np.uint64))]
+            frame = concat_rows([kept, new_rows])
+        self.frame = frame.sort_values('date', kind='mergesort').reset_index(drop=True)
+        self.stats['parsed_rows'] += len(lines)
+        ROWS_INGESTED.inc(len(lines))
+        self.version += len(names) + len(gone)
+
+    def close(self):
+        if self.watch is not None:
+            self.watch.close()
+            self.watch = None
+
+    def __getstate__(self):
+        # The rows duplicate the Outlier's trainingdf and the watch is per process,
+        # a restored ingestor lists the directory again on its next read or poll
+        state = self.__dict__.copy()
+        state['frame'] = None
+        state['watch'] = None
+        state['files'] = {}
+        return state
+
+
+def file_line(name, stat):
+    """
+    Purpose:
+        Formats a file as the DirList row CSVGetter.ps1 writes for it.
+    Args:
+        name (str): file name
+        stat (os.stat_result): stat of the file
+    Returns:
+        date,time,size,name line with the date as MM.dd.yyyy
+    """
+    # Creation time where the platform records it, as Get-ChildItem reports, else the modification time
+    created = datetime.fromtimestamp(getattr(stat, 'st_birthtime', stat.st_mtime))
+    return '%s,%s,%d,%s' % (created.strftime('%m.%d.%Y'), created.strftime('%H:%M'), stat.st_size, name)
+
+
+def hash_lines(lines):
+    """
+    Returns:
+        uint64 hashes of DirList lines, equal to DirListIngestor's row_hash of the same CSV line
+    """
+    if not lines:
+        return np.zeros(0, dtype=np.uint64)
+    return pd.util.hash_array(np.array([line.encode('utf-8') for line in lines], dtype=object))
+
+
+def wait_for_changes(ingestors, timeout, stop, scan_interval=2.0):
+    """
+    Purpose:
+        Blocks until a watched directory changed, the timeout passed or stop is set.
+    Args:
+        ingestors (list): DirectoryIngestor objects
+        timeout (float): longest wait in seconds
+        stop (threading.Event): ends the wait early
+        scan_interval (float): longest wait when a directory is scanned instead of watched
+    Returns:
+        True if an inotify watch reported a change
+    """
+    fds = [ingestor.fileno() for ingestor in ingestors]
+    if any(fd is None for fd in fds):
+        timeout = min(timeout, scan_interval)
+    fds = [fd for fd in fds if fd is not None]
+    deadline = time.time() + timeout
+    while not stop.is_set():
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        if not fds:
+            stop.wait(remaining)
+            continue
+        try:
+            # Short slices so stop is noticed, select cannot wait on an Event
+            readable, _, _ = select.select(fds, [], [], min(remaining, 1.0))
+        except (OSError, ValueError):
+            # A watch was closed by a rebuild meanwhile
+            return True
+        if readable:
+            return True
+    return False